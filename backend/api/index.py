@@ -4,6 +4,9 @@ Vercel serverless function entry point for FastAPI backend
 import sys
 import os
 import logging
+import time
+
+_started = time.perf_counter()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,9 +24,10 @@ try:
     
     # Wrap FastAPI app with Mangum for AWS Lambda/Vercel compatibility
     # Disable lifespan for serverless (cold starts)
+    # Startup (metadata store, matcher) runs on the first request instead
     handler = Mangum(app, lifespan="off")
     
-    logger.info("✅ Handler initialized successfully")
+    logger.info(f"✅ Handler initialized successfully in {time.perf_counter() - _started:.3f}s")
     
 except Exception as e:
     logger.error(f"❌ Failed to initialize handler: {e}")
@@ -0,0 +1,430 @@
+"""
+Load tests and micro-benchmarks for the API, run fully in-process
+
+Requests go straight through the ASGI app (no server, no sockets) against
+the in-process fake bucket from fake_gcs.py, so numbers reflect main.py
+itself. For each event size, the event is seeded and indexed, then
+/list-photos, /match, /status and /download-photo are driven at every
+concurrency level, followed by micro-benchmarks of save_metadata,
+load_metadata and the matching path. Results (throughput, p50/p95/p99
+latency) are written as JSON; pass --baseline to compare against an
+earlier run and exit non-zero on regressions.
+
+Usage:
+    python benchmark.py --sizes 100,10000 --concurrency 1,16 --output bench.json
+    python benchmark.py --baseline bench.json --max-regression 0.2
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+BUCKET_NAME = "bench-bucket"
+SCENARIOS = ("list_photos", "list_photos_manifest", "list_photos_live", "match", "status", "download_photo")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="100,1000", help="Comma-separated photos per event (100 to 100000)")
+    parser.add_argument("--concurrency", default="1,16", help="Comma-separated concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario and concurrency level")
+    parser.add_argument("--repeat", type=int, default=20, help="Iterations per micro-benchmark")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of scenarios")
+    parser.add_argument("--embedding-backend", default="hash", choices=("none", "hash"), help="EMBEDDING_BACKEND")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated GCS round-trip latency")
+    parser.add_argument("--selfie-cache", action="store_true", help="Keep the selfie embedding cache enabled")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="Allowed relative slowdown (0.25 = 25%%)")
+    parser.add_argument("--seed", type=int, default=1234)
+    return parser.parse_args(argv)
+
+
+def configure_environment(args: argparse.Namespace, data_dir: str):
+    """Point the app at the fake bucket and a throwaway data directory (before main is imported)"""
+    os.environ.update(
+        GCS_BACKEND="fake",
+        GCS_BUCKET_NAME=BUCKET_NAME,
+        FAKE_GCS_SEED="",
+        FAKE_GCS_LATENCY_MS=str(args.latency_ms),
+        DATA_DIR=data_dir,
+        METADATA_DB_PATH=os.path.join(data_dir, "embeddings_metadata.db"),
+        FAISS_INDEX_DIR=os.path.join(data_dir, "faiss_indexes"),
+        EMBEDDING_BACKEND=args.embedding_backend,
+        DERIVATIVE_SIZES="",  # seeded photos aren't decodable images
+    )
+    if not args.selfie_cache:
+        os.environ["SELFIE_CACHE_MAX"] = "0"
+    # The relative legacy metadata paths then resolve inside the data directory
+    os.chdir(data_dir)
+
+
+class ASGIClient:
+    """Minimal HTTP client that calls an ASGI app directly"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[dict] = None,
+        body: bytes = b"",
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, bytes]:
+        headers = {"host": "bench", "content-length": str(len(body)), **(headers or {})}
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": urlencode(params or {}, doseq=True).encode(),
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+            "client": ("127.0.0.1", 50000),
+            "server": ("bench", 80),
+        }
+        request_sent = False
+        response_done = asyncio.Event()
+        status = 0
+        chunks = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await response_done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    response_done.set()
+
+        await self.app(scope, receive, send)
+        response_done.set()
+        return status, b"".join(chunks)
+
+    async def get(self, path: str, params: Optional[dict] = None) -> Tuple[int, bytes]:
+        return await self.request("GET", path, params)
+
+    async def post_json(self, path: str, data, params: Optional[dict] = None) -> Tuple[int, bytes]:
+        return await self.request(
+            "POST", path, params, json.dumps(data).encode(), {"content-type": "application/json"}
+        )
+
+    async def post_file(self, path: str, field: str, filename: str, content: bytes, params: Optional[dict] = None):
+        boundary = "benchmarkboundary%016x" % random.getrandbits(64)
+        body = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: image/jpeg\r\n\r\n"
+        ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+        return await self.request(
+            "POST", path, params, body, {"content-type": f"multipart/form-data; boundary={boundary}"}
+        )
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), math.ceil(q / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 4),
+        "throughput_per_second": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "mean": round(1000 * sum(ordered) / len(ordered), 3) if ordered else 0.0,
+            "p50": round(1000 * percentile(ordered, 50), 3),
+            "p95": round(1000 * percentile(ordered, 95), 3),
+            "p99": round(1000 * percentile(ordered, 99), 3),
+            "max": round(1000 * ordered[-1], 3) if ordered else 0.0,
+        },
+    }
+
+
+async def run_load(
+    call: Callable[[int], Awaitable[Tuple[int, bytes]]],
+    total: int,
+    concurrency: int,
+    before: Optional[Callable[[], None]] = None,
+) -> dict:
+    """Issue total requests from concurrency clients; call(i) performs request i"""
+    latencies: List[float] = []
+    errors = 0
+    pending = iter(range(total))
+
+    async def client():
+        nonlocal errors
+        for i in pending:
+            if before is not None:
+                before()
+            began = time.perf_counter()
+            status, _ = await call(i)
+            latencies.append(time.perf_counter() - began)
+            if status >= 400:
+                errors += 1
+
+    began = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - began, errors)
+
+
+def run_micro(fn: Callable[[], object], repeat: int) -> dict:
+    """Time repeat calls of a blocking function"""
+    latencies = []
+    began = time.perf_counter()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies, time.perf_counter() - began)
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace):
+        import fake_gcs
+        import main
+        import manifest
+
+        self.args = args
+        self.main = main
+        self.fake_gcs = fake_gcs
+        self.manifest = manifest
+        self.client = ASGIClient(main.app)
+        self.bucket = fake_gcs.get_fake_bucket(BUCKET_NAME)
+        self.scenarios = [s for s in args.scenarios.split(",") if s]
+        self.results: List[dict] = []
+        self.random = random.Random(args.seed)
+
+    def record(self, name: str, event_size: int, concurrency: Optional[int], result: dict, **extra):
+        self.results.append({"name": name, "event_size": event_size, "concurrency": concurrency, **result, **extra})
+        latency = result["latency_ms"]
+        print(
+            f"{name:<22} size={event_size:<7} c={concurrency if concurrency is not None else '-':<4} "
+            f"{result['throughput_per_second']:>10.1f}/s  p50={latency['p50']:.2f}ms "
+            f"p95={latency['p95']:.2f}ms p99={latency['p99']:.2f}ms errors={result['errors']}",
+            flush=True,
+        )
+
+    def seed_event(self, event_id: str, size: int) -> List[str]:
+        self.fake_gcs.seed(self.bucket, f"{event_id}:{size}")
+        prefix = f"https://storage.googleapis.com/{BUCKET_NAME}/"
+        return [f"{prefix}{event_id}/photo_{i:06d}.jpg" for i in range(size)]
+
+    async def index(self, event_id: str, size: int, photo_urls: List[str]):
+        for name in ("index", "index_unchanged"):
+            began = time.perf_counter()
+            status, body = await self.client.post_json(
+                "/index", photo_urls, {"event_id": event_id, "wait": "true"}
+            )
+            elapsed = time.perf_counter() - began
+            job = json.loads(body) if status == 200 else {}
+            self.record(
+                name, size, None, summarize([elapsed], elapsed, int(status != 200 or job.get("status") != "success")),
+                photos_per_second=round(size / elapsed, 2) if elapsed > 0 else 0.0,
+                indexed_photos=job.get("indexed_photos"),
+            )
+
+    async def load_scenarios(self, event_id: str, size: int, photo_urls: List[str], concurrency: int):
+        main = self.main
+        total = self.args.requests
+        manifest_blob = self.bucket.blob(self.manifest.manifest_blob_name(event_id))
+
+        def clear_listing():
+            main.event_listing_cache.invalidate(event_id)
+
+        scenarios = {
+            "list_photos": (lambda i: self.client.get("/list-photos", {"event_id": event_id}), None),
+            "list_photos_manifest": (lambda i: self.client.get("/list-photos", {"event_id": event_id}), clear_listing),
+            "status": (lambda i: self.client.get("/status"), None),
+            "download_photo": (
+                lambda i: self.client.get("/download-photo", {"photo_url": self.random.choice(photo_urls)}),
+                None,
+            ),
+            "match": (
+                lambda i: self.client.post_file(
+                    "/match", "selfie", "selfie.jpg",
+                    # A photo of the event as the selfie, so the hash backend finds real matches
+                    self.fake_gcs.fake_photo_bytes(f"{event_id}/photo_{self.random.randrange(size):06d}.jpg"),
+                    {"event_id": event_id},
+                ),
+                None,
+            ),
+        }
+        for name in self.scenarios:
+            if name == "list_photos_live":
+                continue  # needs the manifest removed; runs last
+            call, before = scenarios[name]
+            self.record(name, size, concurrency, await run_load(call, total, concurrency, before))
+
+        if "list_photos_live" in self.scenarios:
+            saved = manifest_blob.download_as_bytes() if manifest_blob.exists() else None
+            if saved is not None:
+                manifest_blob.delete()
+            try:
+                call = lambda i: self.client.get("/list-photos", {"event_id": event_id})
+                self.record(
+                    "list_photos_live", size, concurrency, await run_load(call, total, concurrency, clear_listing)
+                )
+            finally:
+                if saved is not None:
+                    manifest_blob.upload_from_string(saved, content_type="application/json")
+
+    def micro_benchmarks(self, event_id: str, size: int):
+        main = self.main
+        repeat = self.args.repeat
+        self.record("save_metadata", size, None, run_micro(main.save_metadata, repeat))
+
+        def load_metadata():
+            # open() drops resident shards, so the event is read back from SQLite
+            main.load_metadata()
+            main.metadata_store.get_shard(event_id)
+
+        self.record("load_metadata", size, None, run_micro(load_metadata, repeat))
+
+        if main.embedding_backend is not None:
+            selfies = [
+                self.fake_gcs.fake_photo_bytes(f"{event_id}/photo_{self.random.randrange(size):06d}.jpg")
+                for _ in range(repeat)
+            ]
+            queries = [main.embedding_backend.embed(selfie, main.SELFIE_MAX_SIDE) for selfie in selfies]
+            selfie_iter = itertools.cycle(selfies)
+            self.record(
+                "selfie_embed", size, None,
+                run_micro(lambda: main.embedding_backend.embed(next(selfie_iter), main.SELFIE_MAX_SIDE), repeat),
+            )
+            main.metadata_store.get_shard(event_id)  # resident, as in /match
+            query_iter = itertools.cycle(queries)
+            self.record(
+                "search_faces", size, None,
+                run_micro(lambda: main.search_faces(next(query_iter), [event_id]), repeat),
+            )
+
+    async def run(self):
+        main = self.main
+        main.startup()
+        sizes = [int(s) for s in self.args.sizes.split(",") if s]
+        levels = [int(c) for c in self.args.concurrency.split(",") if c]
+        try:
+            for size in sizes:
+                event_id = f"bench-{size}"
+                photo_urls = self.seed_event(event_id, size)
+                await self.index(event_id, size, photo_urls)
+                for concurrency in levels:
+                    await self.load_scenarios(event_id, size, photo_urls, concurrency)
+                self.micro_benchmarks(event_id, size)
+        finally:
+            main.save_metadata()
+            main.selfie_pool.shutdown()
+
+
+def result_key(result: dict) -> Tuple:
+    return (result["name"], result["event_size"], result["concurrency"])
+
+
+def compare(results: List[dict], baseline: List[dict], max_regression: float) -> List[str]:
+    """Scenarios whose p95 latency rose or throughput fell by more than max_regression"""
+    previous = {result_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        p95, p95_before = result["latency_ms"]["p95"], before["latency_ms"]["p95"]
+        rate, rate_before = result["throughput_per_second"], before["throughput_per_second"]
+        label = f"{result['name']} size={result['event_size']} c={result['concurrency'] or '-'}"
+        if p95_before > 0 and p95 > p95_before * (1 + max_regression):
+            regressions.append(f"{label}: p95 {p95_before:.2f}ms -> {p95:.2f}ms")
+        if rate_before > 0 and rate < rate_before * (1 - max_regression):
+            regressions.append(f"{label}: throughput {rate_before:.1f}/s -> {rate:.1f}/s")
+        if result["errors"] > before["errors"]:
+            regressions.append(f"{label}: errors {before['errors']} -> {result['errors']}")
+    return regressions
+
+
+def git_revision(directory: str) -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=directory, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    data_dir = tempfile.mkdtemp(prefix="photo-bench-")
+    configure_environment(args, data_dir)
+
+    import logging
+
+    logging.disable(logging.INFO)  # per-photo logging would dominate the timings
+
+    try:
+        benchmark = Benchmark(args)
+        asyncio.run(benchmark.run())
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_revision": git_revision(backend_dir),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "results": benchmark.results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(benchmark.results)} results to {output}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(benchmark.results, baseline, args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.max_regression:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions beyond {args.max_regression:.0%} against {baseline_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
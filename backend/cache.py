@@ -0,0 +1,133 @@
+"""
+Small in-process caches shared by the API endpoints
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries expire after a fixed TTL
+
+    With max_bytes, bytes values are also bounded by their total length
+    (a value larger than the whole budget isn't cached). Concurrent misses
+    for the same key through get_or_load() are coalesced into a single
+    in-flight load (single-flight); every waiter receives the same result or
+    exception, and a waiter that is cancelled leaves the load running for
+    the others. A load whose key is invalidated while it runs still answers
+    its waiters but isn't cached.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, max_bytes: Optional[int] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._bytes = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a fresh cached value or None"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at, nbytes = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._bytes -= nbytes
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        """Store a value, evicting least recently used entries past max_entries (and max_bytes)"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        nbytes = len(value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._pop(key)
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, time.monotonic() + ttl, nbytes)
+            self._bytes += nbytes
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes
+            ):
+                _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self.evictions += 1
+
+    def _pop(self, key: Hashable):
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+    def invalidate(self, key: Hashable):
+        """Drop one entry"""
+        with self._lock:
+            self._pop(key)
+            # A load already running may have read the old state: it's no longer cached when it ends
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._inflight.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value, or run loader once for all concurrent callers"""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        load = self._inflight.get(key)
+        if load is not None:
+            self.coalesced += 1
+        else:
+            # Its own task, so it outlives any one caller
+            load = asyncio.ensure_future(loader())
+            self._inflight[key] = load
+            load.add_done_callback(lambda task: self._loaded(key, task))
+        return await asyncio.shield(load)
+
+    def _loaded(self, key: Hashable, load: asyncio.Future):
+        """Cache a finished load unless its key was invalidated (or replaced) meanwhile"""
+        with self._lock:
+            current = self._inflight.get(key) is load
+            if current:
+                del self._inflight[key]
+        if load.cancelled():
+            return
+        # Retrieved here, so a failure nobody else awaited isn't logged
+        if load.exception() is None and current:
+            self.set(key, load.result())
+
+    def stats(self) -> dict:
+        """Counters for status reporting"""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self._bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,281 @@
+"""
+Per-event face clusters, precomputed at index time
+After an indexing job, the event's face embeddings are grouped into
+clusters of (most likely) one person each: a leader pass assigns every
+face to the nearest centroid within the clustering similarity or starts a
+new cluster, then a few k-means iterations settle the assignment.
+
+Each event's clusters are written as two files: a .npy matrix holding the
+centroids followed by the member faces in cluster order (memory-mapped on
+load, like the FAISS indexes), and a JSON file with the member photo keys,
+cluster offsets and radii. /match compares a selfie against the centroids
+first and re-ranks only members of clusters that can still hold a face
+above the match threshold; "photos of this person" reads one cluster's
+members without any similarity search.
+"""
+
+import logging
+import math
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from event_files import EventFileStore, Stamp
+from matcher import normalize
+
+logger = logging.getLogger(__name__)
+
+ASSIGN_CHUNK_ROWS = 8192  # faces scored against all centroids per matrix product
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for every row"""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_ROWS):
+        chunk = vectors[start:start + ASSIGN_CHUNK_ROWS]
+        labels[start:start + len(chunk)] = (chunk @ centroids.T).argmax(axis=1)
+    return labels
+
+
+def _sums(vectors: np.ndarray, labels: np.ndarray, clusters: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Member sums and member counts per cluster"""
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=clusters)
+    sums = np.zeros((clusters, vectors.shape[1]), dtype=np.float32)
+    present = np.flatnonzero(counts)
+    if len(present):
+        starts = np.concatenate(([0], np.cumsum(counts[present])[:-1]))
+        sums[present] = np.add.reduceat(vectors[order], starts, axis=0)
+    return sums, counts
+
+
+def _centroids(vectors: np.ndarray, labels: np.ndarray, clusters: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Normalized member means and member counts per cluster"""
+    sums, counts = _sums(vectors, labels, clusters)
+    return normalize(sums), counts
+
+
+def cluster_embeddings(vectors: np.ndarray, similarity: float, iterations: int = 2, batch_rows: int = 1024) -> np.ndarray:
+    """
+    Cluster label of every face (labels are 0..clusters-1, largest first)
+
+    Faces are taken in batches: those within `similarity` of an existing
+    centroid join it, the rest become leaders of new clusters one at a
+    time. Centroids are running member means, refined by `iterations`
+    rounds of k-means afterwards.
+    """
+    n, dim = vectors.shape
+    labels = np.empty(n, dtype=np.int64)
+    sums = np.zeros((0, dim), dtype=np.float32)
+    centroids = np.zeros((0, dim), dtype=np.float32)
+    for start in range(0, n, batch_rows):
+        batch = vectors[start:start + batch_rows]
+        batch_labels = np.empty(len(batch), dtype=np.int64)
+        if len(centroids):
+            scores = batch @ centroids.T
+            best = scores.argmax(axis=1)
+            assigned = scores[np.arange(len(batch)), best] >= similarity
+            batch_labels[assigned] = best[assigned]
+        else:
+            assigned = np.zeros(len(batch), dtype=bool)
+
+        leaders = np.empty((int((~assigned).sum()), dim), dtype=np.float32)
+        count = 0
+        for row in np.flatnonzero(~assigned):
+            if count:
+                scores = leaders[:count] @ batch[row]
+                best = int(scores.argmax())
+                if scores[best] >= similarity:
+                    batch_labels[row] = len(centroids) + best
+                    continue
+            leaders[count] = batch[row]
+            batch_labels[row] = len(centroids) + count
+            count += 1
+
+        labels[start:start + len(batch)] = batch_labels
+        batch_sums, _ = _sums(batch, batch_labels, len(centroids) + count)
+        batch_sums[:len(sums)] += sums
+        sums = batch_sums
+        centroids = normalize(sums)
+
+    for _ in range(iterations):
+        labels = _assign(vectors, centroids)
+        centroids, counts = _centroids(vectors, labels, len(centroids))
+        # Relabel so empty clusters disappear and the largest comes first
+        order = np.argsort(-counts, kind="stable")
+        order = order[counts[order] > 0]
+        remap = np.empty(len(counts), dtype=np.int64)
+        remap[order] = np.arange(len(order))
+        labels = remap[labels]
+        centroids = centroids[order]
+    if not iterations and len(centroids):
+        counts = np.bincount(labels, minlength=len(centroids))
+        remap = np.empty(len(counts), dtype=np.int64)
+        remap[np.argsort(-counts, kind="stable")] = np.arange(len(counts))
+        labels = remap[labels]
+    return labels
+
+
+class EventClusters:
+    """An event's clusters: centroids, radii and contiguous member faces"""
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        members: np.ndarray,
+        row_keys: List[str],
+        offsets: List[int],
+        radii: List[float],
+        version: int,
+        stamp: Optional[Stamp] = None,
+    ):
+        self.centroids = centroids
+        self.members = members
+        self.row_keys = row_keys
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.radii = np.asarray(radii, dtype=np.float32)
+        # Angular radius: no member is further than this from its centroid
+        self.radius_angles = np.arccos(np.clip(self.radii, -1.0, 1.0))
+        self.version = version
+        self.stamp = stamp
+        self._photo_counts: Optional[List[int]] = None
+        self._people: Dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def faces(self) -> int:
+        return len(self.row_keys)
+
+    def photos(self, cluster: int) -> List[str]:
+        """A cluster's photo keys, those with the most central face first"""
+        seen = set()
+        keys = []
+        for key in self.row_keys[self.offsets[cluster]:self.offsets[cluster + 1]]:
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+        return keys
+
+    def photo_counts(self) -> List[int]:
+        if self._photo_counts is None:
+            self._photo_counts = [
+                len(set(self.row_keys[self.offsets[c]:self.offsets[c + 1]])) for c in range(len(self))
+            ]
+        return self._photo_counts
+
+    def people(self, min_photos: int) -> np.ndarray:
+        """Clusters found in at least min_photos photos"""
+        people = self._people.get(min_photos)
+        if people is None:
+            people = self._people[min_photos] = np.flatnonzero(np.asarray(self.photo_counts()) >= min_photos)
+        return people
+
+    def nearest(self, queries: np.ndarray, threshold: float, min_photos: int = 1) -> List[Tuple[int, float]]:
+        """People whose centroid is within threshold of a query face, most similar first"""
+        people = self.people(min_photos)
+        if not len(people):
+            return []
+        scores = (queries @ np.asarray(self.centroids[people]).T).max(axis=0)
+        hits = np.flatnonzero(scores >= threshold)
+        return [(int(people[i]), float(scores[i])) for i in hits[np.argsort(-scores[hits], kind="stable")]]
+
+    def search(self, queries: np.ndarray, top_k: int, threshold: float, nprobe: int = 0) -> List[Tuple[Hashable, float]]:
+        """
+        Top-k photos (best face per photo) with similarity >= threshold
+
+        Clusters whose bound (centroid angle minus cluster radius) can't
+        reach the threshold are skipped; of the rest, the nprobe (0: all)
+        with the closest centroids have their members re-ranked.
+        """
+        if not len(self):
+            return []
+        scores = queries @ np.asarray(self.centroids).T
+        angles = np.arccos(np.clip(scores, -1.0, 1.0)) - self.radius_angles
+        bounds = np.cos(np.clip(angles, 0.0, math.pi)).max(axis=0)
+        probe = np.flatnonzero(bounds >= threshold)
+        closest = scores.max(axis=0)
+        probe = probe[np.argsort(-closest[probe], kind="stable")]
+        if nprobe:
+            probe = probe[:nprobe]
+        if not len(probe):
+            return []
+
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe])
+        member_scores = (np.asarray(self.members[rows], dtype=np.float32) @ queries.T).max(axis=1)
+        keep = member_scores >= threshold
+        best: Dict[str, float] = {}
+        for row, score in zip(rows[keep], member_scores[keep]):
+            key = self.row_keys[row]
+            if score > best.get(key, -math.inf):
+                best[key] = float(score)
+        return sorted(best.items(), key=lambda r: -r[1])[:top_k]
+
+
+class ClusterStore(EventFileStore[EventClusters]):
+    """Builds, writes and memory-maps per-event face clusters"""
+
+    suffixes = (".clusters.npy", ".clusters.json")
+    kind = "Face clusters"
+
+    def __init__(self, directory: str, similarity: float, iterations: int = 2):
+        super().__init__(directory)
+        self.similarity = similarity
+        self.iterations = iterations
+        self.builds = 0
+
+    def build(self, event_id: str, row_keys: List[str], embeddings: np.ndarray, version: int) -> Optional[EventClusters]:
+        """Cluster an event's faces and atomically replace its files (empty input deletes them)"""
+        if not len(row_keys):
+            self.delete(event_id)
+            return None
+        vectors = normalize(embeddings)
+        labels = cluster_embeddings(vectors, self.similarity, self.iterations)
+        centroids, counts = _centroids(vectors, labels, int(labels.max()) + 1)
+        similarity = np.einsum("ij,ij->i", vectors, centroids[labels])
+        # Members grouped by cluster, the most central first
+        order = np.lexsort((-similarity, labels))
+        offsets = np.concatenate(([0], np.cumsum(counts))).tolist()
+        radii = [
+            float(similarity[order[offsets[c]:offsets[c + 1]]].min()) for c in range(len(centroids))
+        ]
+        sorted_keys = [row_keys[row] for row in order]
+
+        def write_data(path: str):
+            with open(path, "wb") as f:
+                np.save(f, np.concatenate([centroids, vectors[order]]))
+
+        meta = {"version": version, "row_keys": sorted_keys, "offsets": offsets, "radii": radii}
+        self._replace(event_id, write_data, meta)
+        with self._lock:
+            self.builds += 1
+        logger.info(f"👥 Clustered {len(row_keys)} faces of event {event_id} into {len(centroids)} people")
+        return self.load(event_id)
+
+    def _read(self, data_path: str, meta: dict, stamp: Stamp) -> Optional[EventClusters]:
+        """Memory-map an event's clusters"""
+        matrix = np.load(data_path, mmap_mode="r")
+        clusters = len(meta["offsets"]) - 1
+        if clusters + len(meta["row_keys"]) != len(matrix):
+            return None
+        return EventClusters(
+            np.ascontiguousarray(matrix[:clusters]),  # small and read on every search
+            matrix[clusters:],
+            meta["row_keys"],
+            meta["offsets"],
+            meta["radii"],
+            meta["version"],
+            stamp,
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaded = list(self._loaded.values())
+        return {
+            "similarity": self.similarity,
+            "builds": self.builds,
+            "loaded_events": len(loaded),
+            "loaded_clusters": sum(len(c) for c in loaded),
+            "loaded_faces": sum(c.faces for c in loaded),
+        }
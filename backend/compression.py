@@ -0,0 +1,177 @@
+"""
+Response compression negotiated from Accept-Encoding
+Brotli is preferred when the optional brotli package is installed, gzip
+otherwise. Bodies smaller than COMPRESS_MIN_BYTES are sent as they are.
+Streamed responses (NDJSON listings) are compressed chunk by chunk and
+flushed after each one, so clients still see photos as pages arrive.
+"""
+
+import importlib.util
+import os
+import zlib
+from typing import Optional
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))  # 0: compress nothing
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))  # 0-11; higher costs far more CPU per response
+BROTLI_AVAILABLE = importlib.util.find_spec("brotli") is not None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+class GzipEncoder:
+    def __init__(self, level: int = GZIP_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a chunk and flush it, so it can be decoded before the next one arrives"""
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self, quality: int = BROTLI_QUALITY):
+        import brotli  # optional dependency, only needed when clients accept br
+
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """The preferred encoding a client accepts ("br", "gzip"), or None"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    wildcard = accepted.get("*", 0.0)
+    for coding in (("br", "gzip") if BROTLI_AVAILABLE else ("gzip",)):
+        if accepted.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+
+def _encoder(encoding: str):
+    return BrotliEncoder() if encoding == "br" else GzipEncoder()
+
+
+def negotiate(accept_encoding: str, size: int) -> Optional[str]:
+    """Encoding for a body of `size` bytes, or None to send it as it is"""
+    if not COMPRESS_MIN_BYTES or size < COMPRESS_MIN_BYTES:
+        return None
+    return choose_encoding(accept_encoding)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """One-shot compression, for bodies cached already encoded"""
+    encoder = _encoder(encoding)
+    return encoder.compress(data) + encoder.finish()
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing JSON, NDJSON and text responses
+
+    A response whose whole body arrives in one message is compressed in one
+    go (and left alone below the minimum size); a streamed one is
+    compressed as it goes. Responses that already carry a Content-Encoding
+    (e.g. cached pre-compressed bodies), and 304s, pass through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.minimum_size:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        encoder = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                response_headers = dict(message.get("headers", ()))
+                content_type = response_headers.get(b"content-type", b"").decode("latin-1")
+                passthrough = (
+                    b"content-encoding" in response_headers
+                    or message["status"] in (204, 304)
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                )
+                if passthrough:
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                encoder = _encoder(encoding)
+                if not more_body:
+                    # The whole body is here: compress it at once, so Content-Length is known
+                    body = encoder.compress(body) + encoder.finish()
+                    await send(self._compressed_start(start, encoding, len(body)))
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(self._compressed_start(start, encoding, None))
+            data = encoder.compress(body) if body else b""
+            if not more_body:
+                data += encoder.finish()
+            if data or not more_body:
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _compressed_start(start: dict, encoding: str, content_length: Optional[int]) -> dict:
+        """Response start with Content-Encoding, Vary and a weak ETag (the bytes differ by encoding)"""
+        headers = []
+        vary = None
+        for name, value in start.get("headers", ()):
+            if name in (b"content-length", b"content-encoding"):
+                continue
+            if name == b"etag" and not value.startswith(b"W/"):
+                value = b"W/" + value
+            if name == b"vary":
+                vary = value
+                continue
+            headers.append((name, value))
+        if vary is None:
+            vary = b"Accept-Encoding"
+        elif b"accept-encoding" not in vary.lower() and vary != b"*":
+            vary += b", Accept-Encoding"
+        headers.append((b"vary", vary))
+        headers.append((b"content-encoding", encoding.encode()))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+        return {**start, "headers": headers}
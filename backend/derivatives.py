@@ -0,0 +1,141 @@
+"""
+Resized derivatives of event photos
+Indexing renders every photo at each of DERIVATIVE_SIZES (longest side, in
+pixels) as WebP under DERIVATIVE_PREFIX, so gallery grids and previews load
+a few KB per tile instead of the full-size original.
+
+Rendering runs on its own pool of DERIVATIVE_WORKERS threads: it overlaps
+with face embedding of the same photo, and bounds how many full-size
+images are decoded at once across indexing workers.
+"""
+
+import importlib.util
+import io
+import logging
+import os
+from concurrent.futures import Future
+from typing import Dict, Iterable, List, Optional
+
+import gcs
+import metrics
+from pools import LazyThreadPool
+
+logger = logging.getLogger(__name__)
+
+SIZES = sorted({int(s) for s in os.getenv("DERIVATIVE_SIZES", "256,1024").split(",") if s.strip()})  # empty: off
+PREFIX = os.getenv("DERIVATIVE_PREFIX", "_derivatives/")  # outside every event folder
+QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+WORKERS = int(os.getenv("DERIVATIVE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Names don't change when the original is replaced, so caches must revalidate eventually
+CACHE_CONTROL = os.getenv("DERIVATIVE_CACHE_CONTROL", "public, max-age=86400")
+PIL_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+RENDER_SECONDS = metrics.REGISTRY.histogram(
+    "derivative_render_duration_seconds", "Decode, resize and WebP-encode time per photo"
+)
+
+_pool = LazyThreadPool(WORKERS, "derivatives")
+_rendered = 0
+_unreadable = 0
+
+
+def enabled() -> bool:
+    return bool(SIZES) and PIL_AVAILABLE
+
+
+def derivative_prefix(size: int) -> str:
+    """Blob name prefix of every derivative of one size"""
+    return f"{PREFIX}{size}/"
+
+
+def derivative_blob_name(key: str, size: int) -> str:
+    """Blob name of a photo's derivative, e.g. _derivatives/256/<event>/<photo>.jpg.webp"""
+    return f"{derivative_prefix(size)}{key}.webp"
+
+
+def render(image_bytes: bytes) -> Dict[int, bytes]:
+    """
+    WebP encodings of an image at every configured size, largest first
+
+    JPEGs are decoded at a reduced scale close to the largest size, and
+    each smaller size is shrunk from the previous one. Images are never
+    upscaled.
+    """
+    from PIL import Image, ImageOps
+
+    rendered = {}
+    with Image.open(io.BytesIO(image_bytes)) as original:
+        original.draft("RGB", (SIZES[-1], SIZES[-1]))
+        img = ImageOps.exif_transpose(original)
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha else "RGB")
+        for size in reversed(SIZES):
+            img.thumbnail((size, size), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            img.save(buffer, "WEBP", quality=QUALITY, method=4)
+            rendered[size] = buffer.getvalue()
+    return rendered
+
+
+def write_derivatives(key: str, image_bytes: bytes) -> List[int]:
+    """
+    Render and upload a photo's derivatives (blocking). Returns the sizes
+    written; an image Pillow can't decode gets none, while upload errors
+    propagate so the photo is retried.
+    """
+    global _rendered, _unreadable
+    try:
+        with RENDER_SECONDS.time():
+            rendered = render(image_bytes)
+    except Exception as e:
+        _unreadable += 1
+        logger.warning(f"  ⚠️ No derivatives for {key}, image unreadable: {e}")
+        return []
+    bucket = gcs.get_bucket()
+    for size, data in rendered.items():
+        blob = bucket.blob(derivative_blob_name(key, size))
+        blob.cache_control = CACHE_CONTROL
+        with gcs.timed("upload_derivative"):
+            blob.upload_from_string(data, content_type="image/webp", timeout=gcs.CALL_TIMEOUT_SECONDS)
+    _rendered += 1
+    return sorted(rendered)
+
+
+def submit(key: str, image_bytes: bytes) -> Future:
+    """Schedule write_derivatives on the derivative pool"""
+    return _pool.submit(write_derivatives, key, image_bytes)
+
+
+def delete_derivatives(keys: Iterable[str]):
+    """Delete every derivative of the given photos, ignoring missing ones (blocking)"""
+    bucket = gcs.get_bucket()
+    for key in keys:
+        for size in SIZES:
+            try:
+                bucket.blob(derivative_blob_name(key, size)).delete(timeout=gcs.CALL_TIMEOUT_SECONDS)
+            except Exception as e:
+                if not gcs.is_not_found(e):
+                    raise
+
+
+def is_current(sizes: Optional[List[int]]) -> bool:
+    """Whether an entry's recorded derivatives match the configuration"""
+    if not enabled():
+        return True
+    # [] marks an image that couldn't be decoded; re-rendering won't help
+    return sizes is not None and (not sizes or list(sizes) == SIZES)
+
+
+def stats() -> dict:
+    return {
+        "enabled": enabled(),
+        "sizes": SIZES,
+        "workers": WORKERS,
+        "rendered": _rendered,
+        "unreadable": _unreadable,
+    }
+
+
+def shutdown():
+    """Stop the worker threads; the pool restarts on the next submit()"""
+    _pool.shutdown()
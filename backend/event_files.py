@@ -0,0 +1,134 @@
+"""
+Per-event pairs of on-disk files shared across workers
+FaissEventStore and ClusterStore keep each event as a data file (memory-
+mapped on load) plus a JSON file of the photo keys of its rows. Every write
+goes to a data file of its own (named with a random nonce) and is published
+by atomically replacing the JSON file, which names that data file: a reader
+always gets the keys and vectors of one write, never a mix of two. An opened
+event is reused until its JSON file is replaced, i.e. until some worker has
+rewritten it.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+Loaded = TypeVar("Loaded")
+
+Stamp = Tuple[int, int]  # (inode, mtime_ns) of a published JSON file
+
+
+class EventFileStore(Generic[Loaded]):
+    """
+    Base for stores of one (data, keys) file pair per event
+
+    Subclasses set `suffixes` and `kind` and implement _read(). Files are
+    replaced atomically, and a worker reopens an event whenever another
+    worker has rewritten its files.
+    """
+
+    suffixes: Tuple[str, str] = (".data", ".keys.json")  # data file, keys file
+    kind = "Event files"  # for errors: "<kind> for event ... could not be read"
+    read_attempts = 3
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._loaded: Dict[str, Loaded] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _base(self, event_id: str) -> str:
+        # A digest, so distinct event ids never share files (even on case-insensitive filesystems)
+        return os.path.join(self.directory, hashlib.sha256(event_id.encode("utf-8")).hexdigest())
+
+    def _keys_path(self, event_id: str) -> str:
+        return f"{self._base(event_id)}{self.suffixes[1]}"
+
+    def _read_meta(self, keys_path: str) -> dict:
+        with open(keys_path, "r") as f:
+            return json.load(f)
+
+    def _replace(self, event_id: str, write_data: Callable[[str], None], meta: dict):
+        """Write a new data file, then publish it with meta by swapping in the JSON file"""
+        base = self._base(event_id)
+        keys_path = f"{base}{self.suffixes[1]}"
+        data_name = f"{os.path.basename(base)}.{uuid.uuid4().hex}{self.suffixes[0]}"
+        write_data(os.path.join(self.directory, data_name))
+        try:
+            previous = self._read_meta(keys_path).get("data")
+        except (OSError, ValueError):
+            previous = None
+        tmp_keys = f"{keys_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_keys, "w") as f:
+            json.dump({"data": data_name, **meta}, f, separators=(",", ":"))
+        os.replace(tmp_keys, keys_path)
+        with self._lock:
+            self._loaded.pop(event_id, None)
+        if previous and previous != data_name:
+            # Readers that already mapped it keep their mapping
+            self._remove(os.path.join(self.directory, previous))
+
+    def _read(self, data_path: str, meta: dict, stamp: Stamp) -> Optional[Loaded]:
+        """Open the data file published with meta; None if they don't belong together"""
+        raise NotImplementedError
+
+    def _stamp(self, keys_path: str) -> Optional[Stamp]:
+        try:
+            st = os.stat(keys_path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def load(self, event_id: str) -> Optional[Loaded]:
+        """Open an event's files, reusing them until they are rewritten"""
+        keys_path = self._keys_path(event_id)
+        for _ in range(self.read_attempts):
+            stamp = self._stamp(keys_path)
+            if stamp is None:
+                with self._lock:
+                    self._loaded.pop(event_id, None)
+                return None
+            loaded = self._loaded.get(event_id)
+            if loaded is not None and loaded.stamp == stamp:
+                return loaded
+            try:
+                meta = self._read_meta(keys_path)
+                # Gone if a rewrite replaced the JSON file after the stat; read the new one
+                loaded = self._read(os.path.join(self.directory, meta["data"]), meta, stamp)
+            except FileNotFoundError:
+                continue
+            if loaded is not None:
+                with self._lock:
+                    self._loaded[event_id] = loaded
+                return loaded
+        raise RuntimeError(f"{self.kind} for event {event_id} could not be read")
+
+    def unload(self, event_id: str):
+        """Release an event's mapping; it is reopened on next use"""
+        with self._lock:
+            self._loaded.pop(event_id, None)
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def delete(self, event_id: str):
+        with self._lock:
+            self._loaded.pop(event_id, None)
+        base = os.path.basename(self._base(event_id))
+        self._remove(self._keys_path(event_id))
+        for name in os.listdir(self.directory):
+            if name.startswith(f"{base}.") and name.endswith(self.suffixes[0]):
+                self._remove(os.path.join(self.directory, name))
+
+    def clear(self):
+        with self._lock:
+            self._loaded.clear()
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffixes):
+                self._remove(os.path.join(self.directory, name))
@@ -0,0 +1,142 @@
+"""
+Per-event FAISS indexes persisted on disk
+Each event gets its own index file plus a row -> photo key list. Indexes are
+opened on first use with their vectors memory-mapped (IVF inverted lists,
+flat and HNSW vector storage), so worker startup doesn't deserialize every
+event and the pages are shared across uvicorn workers. Only small
+structures (the HNSW graph, IVF centroids, the key list) are read into memory.
+"""
+
+import logging
+import math
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from event_files import EventFileStore, Stamp
+
+logger = logging.getLogger(__name__)
+
+
+class LoadedEventIndex:
+    """An opened event index (vectors memory-mapped) and the photo key of each row"""
+
+    def __init__(self, index, row_keys: List[str], stamp: Stamp):
+        self.index = index
+        self.row_keys = row_keys
+        self.stamp = stamp
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+
+class FaissEventStore(EventFileStore[LoadedEventIndex]):
+    """
+    Writes and searches one FAISS index per event
+
+    Events with fewer than ann_threshold faces use an exact flat
+    inner-product index; larger ones use IVF (or HNSW) approximate search.
+    """
+
+    suffixes = (".index", ".keys.json")
+    kind = "FAISS index"
+
+    def __init__(
+        self,
+        directory: str,
+        ann_threshold: int = 10000,
+        ann_type: str = "ivf",
+        nprobe: int = 16,
+        hnsw_m: int = 32,
+    ):
+        import faiss  # optional dependency, only needed when this store is enabled
+
+        super().__init__(directory)
+        self.faiss = faiss
+        self.ann_threshold = ann_threshold
+        self.ann_type = ann_type
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+
+    def _build(self, embeddings: np.ndarray):
+        faiss = self.faiss
+        n, dim = embeddings.shape
+        if n < self.ann_threshold:
+            index = faiss.IndexFlatIP(dim)
+        elif self.ann_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            # ~40 training points per centroid keeps k-means well conditioned
+            nlist = max(1, min(int(4 * math.sqrt(n)), n // 40))
+            index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings)
+        index.add(embeddings)
+        if isinstance(index, faiss.IndexIVF):
+            # Lets read_embeddings() reconstruct rows when the event is rebuilt
+            index.make_direct_map()
+        return index
+
+    def write(self, event_id: str, row_keys: List[str], embeddings: np.ndarray):
+        """Build and atomically replace an event's index (empty input deletes it)"""
+        if not len(row_keys):
+            self.delete(event_id)
+            return
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        index = self._build(embeddings)
+        self._replace(event_id, lambda path: self.faiss.write_index(index, path), {"row_keys": row_keys})
+        logger.info(f"💾 Wrote {type(index).__name__} for event {event_id} ({len(row_keys)} faces)")
+
+    def _read_flags(self, index_path: str) -> int:
+        """
+        IO_FLAG_MMAP only maps IVF inverted lists: flat and HNSW indexes
+        need IO_FLAG_MMAP_IFC, or their vectors are read into memory
+        """
+        with open(index_path, "rb") as f:
+            fourcc = f.read(4)
+        ivf = fourcc[:2] in (b"Iw", b"Iv")  # IndexIVF* headers
+        mmap = self.faiss.IO_FLAG_MMAP if ivf else self.faiss.IO_FLAG_MMAP_IFC
+        return mmap | self.faiss.IO_FLAG_READ_ONLY
+
+    def _read(self, index_path: str, meta: dict, stamp: Stamp) -> Optional[LoadedEventIndex]:
+        """Open an event's index with its vectors memory-mapped"""
+        index = self.faiss.read_index(index_path, self._read_flags(index_path))
+        row_keys = meta["row_keys"]
+        if len(row_keys) != index.ntotal:
+            return None
+        if isinstance(index, self.faiss.IndexIVF):
+            index.nprobe = self.nprobe
+        return LoadedEventIndex(index, row_keys, stamp)
+
+    def row_keys(self, event_id: str) -> List[str]:
+        loaded = self.load(event_id)
+        return loaded.row_keys if loaded is not None else []
+
+    def read_embeddings(self, event_id: str) -> Tuple[List[str], np.ndarray]:
+        """Row keys and embeddings currently on disk for an event"""
+        loaded = self.load(event_id)
+        if loaded is None or not len(loaded):
+            return [], np.zeros((0, 0), dtype=np.float32)
+        return list(loaded.row_keys), loaded.index.reconstruct_n(0, len(loaded))
+
+    def search(
+        self,
+        event_id: str,
+        queries: np.ndarray,
+        top_k: int,
+        threshold: float,
+    ) -> List[Tuple[Hashable, float]]:
+        """Top-k photos (best face per photo) with similarity >= threshold"""
+        loaded = self.load(event_id)
+        if loaded is None or not len(loaded):
+            return []
+        k = min(len(loaded), top_k * 4)
+        scores, rows = loaded.index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+
+        best: Dict[str, float] = {}
+        for score, row in zip(scores.ravel(), rows.ravel()):
+            if row < 0 or score < threshold:
+                continue
+            key = loaded.row_keys[row]
+            if score > best.get(key, -math.inf):
+                best[key] = float(score)
+        return sorted(best.items(), key=lambda r: -r[1])[:top_k]
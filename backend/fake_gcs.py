@@ -0,0 +1,258 @@
+"""
+In-process stand-ins for a GCS bucket
+Implements the slice of the google-cloud-storage Bucket/Blob API the backend
+uses (paged list_blobs, ranged download, upload, delete, generation/etag/size,
+V4-style signed URLs), so the API can be run and load-tested offline.
+
+GCS_BACKEND=fake keeps objects in memory; GCS_BACKEND=local stores them as
+files under LOCAL_GCS_DIR/<bucket>/, so uploads and generated derivatives
+can be inspected on disk and survive restarts.
+
+FAKE_GCS_SEED="event-a:500,event-b:100" pre-populates photos and
+FAKE_GCS_LATENCY_MS adds a simulated round-trip delay to every call.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+DEFAULT_PAGE_SIZE = 1000
+LOCAL_GCS_DIR = os.getenv("LOCAL_GCS_DIR", "local_gcs")
+
+
+class FakeBlob:
+    """A blob handle; like the real client, it may name an object that doesn't exist"""
+
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.cache_control: Optional[str] = None
+        stat = bucket._stat(name)
+        self.generation, self.size = stat if stat else (None, None)
+        self.etag = f"fake-{self.generation}" if self.generation is not None else None
+
+    def exists(self, timeout=None) -> bool:
+        self.bucket._delay()
+        return self.bucket._stat(self.name) is not None
+
+    def download_as_bytes(self, start: Optional[int] = None, end: Optional[int] = None, timeout=None) -> bytes:
+        self.bucket._delay()
+        data = self.bucket._read(self.name)
+        if data is None:
+            raise FileNotFoundError(f"No such object: {self.bucket.name}/{self.name}")
+        # Like GCS, end is inclusive
+        return data[start or 0:None if end is None else end + 1]
+
+    def upload_from_string(self, data, content_type: Optional[str] = None, timeout=None):
+        self.bucket._delay()
+        self.bucket.put(self.name, data.encode() if isinstance(data, str) else data)
+
+    def delete(self, timeout=None):
+        self.bucket._delay()
+        if self.bucket._stat(self.name) is None:
+            raise FileNotFoundError(f"No such object: {self.bucket.name}/{self.name}")
+        self.bucket.remove(self.name)
+
+    def generate_signed_url(
+        self,
+        version: str = "v4",
+        expiration: timedelta = timedelta(hours=1),
+        method: str = "GET",
+        response_disposition: Optional[str] = None,
+        **kwargs,
+    ) -> str:
+        # Signing is local in the real client too, so no simulated latency
+        expires = int(expiration.total_seconds())
+        signature = hashlib.sha256(f"{self.name}:{expires}:{time.time()}".encode()).hexdigest()
+        url = (
+            f"https://storage.googleapis.com/{self.bucket.name}/{quote(self.name)}"
+            f"?X-Goog-Algorithm=FAKE&X-Goog-Expires={expires}&X-Goog-Signature={signature}"
+        )
+        if response_disposition:
+            url += f"&response-content-disposition={quote(response_disposition)}"
+        return url
+
+
+class FakeBlobIterator:
+    """Paged listing with the .pages / next_page_token interface of the real iterator"""
+
+    def __init__(self, bucket: "FakeBucket", names: List[str], page_size: Optional[int], page_token: Optional[str]):
+        self.bucket = bucket
+        self.names = names
+        self.page_size = page_size or DEFAULT_PAGE_SIZE
+        self.start = int(page_token or 0)
+        self.next_page_token: Optional[str] = None
+
+    @property
+    def pages(self) -> Iterator[List[FakeBlob]]:
+        start = self.start
+        while start < len(self.names):
+            self.bucket._delay()
+            end = start + self.page_size
+            self.next_page_token = str(end) if end < len(self.names) else None
+            yield [FakeBlob(self.bucket, name) for name in self.names[start:end]]
+            start = end
+
+    def __iter__(self) -> Iterator[FakeBlob]:
+        for page in self.pages:
+            yield from page
+
+
+class FakeBucket:
+    """Thread-safe in-memory bucket: blob name -> (bytes, generation)"""
+
+    def __init__(self, name: str, latency_seconds: float = 0.0):
+        self.name = name
+        self.latency_seconds = latency_seconds
+        self._objects: Dict[str, Tuple[bytes, int]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _delay(self):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    # Storage (LocalBucket overrides these)
+
+    def _stat(self, name: str) -> Optional[Tuple[int, int]]:
+        """(generation, size) of an object, or None"""
+        item = self._objects.get(name)
+        return (item[1], len(item[0])) if item else None
+
+    def _read(self, name: str) -> Optional[bytes]:
+        item = self._objects.get(name)
+        return item[0] if item else None
+
+    def _names(self, prefix: str) -> List[str]:
+        with self._lock:
+            return sorted(name for name in self._objects if name.startswith(prefix))
+
+    def put(self, name: str, data: bytes):
+        """Create or overwrite an object, bumping its generation"""
+        with self._lock:
+            self._generation += 1
+            self._objects[name] = (data, self._generation)
+
+    def remove(self, name: str):
+        with self._lock:
+            self._objects.pop(name, None)
+
+    # Bucket API
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def list_blobs(
+        self,
+        prefix: Optional[str] = None,
+        delimiter: Optional[str] = None,
+        page_size: Optional[int] = None,
+        page_token: Optional[str] = None,
+        start_offset: Optional[str] = None,
+        end_offset: Optional[str] = None,
+        timeout=None,
+        **kwargs,
+    ) -> FakeBlobIterator:
+        prefix = prefix or ""
+        names = self._names(prefix)
+        if start_offset or end_offset:
+            # GCS semantics: start_offset inclusive, end_offset exclusive
+            names = [
+                name for name in names
+                if (not start_offset or name >= start_offset) and (not end_offset or name < end_offset)
+            ]
+        if delimiter:
+            # Like GCS, don't descend into "sub-folders" below the prefix
+            names = [name for name in names if delimiter not in name[len(prefix):]]
+        return FakeBlobIterator(self, names, page_size, page_token)
+
+
+class LocalBucket(FakeBucket):
+    """Bucket backed by a directory: each object is the file <root>/<blob name>"""
+
+    def __init__(self, name: str, root: str, latency_seconds: float = 0.0):
+        super().__init__(name, latency_seconds)
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, *name.split("/"))
+
+    def _stat(self, name: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self._path(name))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        # The mtime stands in for the generation: it changes on every rewrite
+        return st.st_mtime_ns, st.st_size
+
+    def _read(self, name: str) -> Optional[bytes]:
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            return None
+
+    def _names(self, prefix: str) -> List[str]:
+        names = []
+        for directory, _, files in os.walk(self.root):
+            relative = os.path.relpath(directory, self.root).replace(os.sep, "/")
+            for filename in files:
+                if filename.endswith(".tmp"):
+                    continue  # a put() in progress
+                name = filename if relative == "." else f"{relative}/{filename}"
+                if name.startswith(prefix):
+                    names.append(name)
+        return sorted(names)
+
+    def put(self, name: str, data: bytes):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def remove(self, name: str):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+
+def fake_photo_bytes(name: str) -> bytes:
+    """Deterministic placeholder content for a seeded photo"""
+    return b"FAKEJPEG" + hashlib.sha256(name.encode()).digest()
+
+
+def seed(bucket: FakeBucket, spec: str):
+    """Add photos described as "event-a:500,event-b:100", keeping existing objects"""
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        event_id, _, count = part.partition(":")
+        for i in range(int(count or 0)):
+            name = f"{event_id}/photo_{i:06d}.jpg"
+            if bucket._stat(name) is None:
+                bucket.put(name, fake_photo_bytes(name))
+
+
+_buckets: Dict[str, FakeBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_fake_bucket(name: str) -> FakeBucket:
+    """Process-wide stand-in bucket, seeded from the environment on first use"""
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            latency = float(os.getenv("FAKE_GCS_LATENCY_MS", "0")) / 1000
+            if os.getenv("GCS_BACKEND") == "local":
+                bucket = LocalBucket(name, os.path.join(LOCAL_GCS_DIR, name), latency_seconds=latency)
+            else:
+                bucket = FakeBucket(name, latency_seconds=latency)
+            _buckets[name] = bucket
+            seed(bucket, os.getenv("FAKE_GCS_SEED", ""))
+        return bucket
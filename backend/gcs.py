@@ -0,0 +1,260 @@
+"""
+Process-wide Google Cloud Storage client shared by all endpoints
+Credentials are parsed and the client is built once per worker (or warm
+serverless instance) and rebuilt only when the credentials change
+
+The google-cloud-storage API is blocking, so async handlers go through
+run(): calls execute on a dedicated bounded thread pool with a per-call
+timeout, keeping GCS round trips off the event loop. GCS_BACKEND=fake
+swaps the bucket for the in-process fake in fake_gcs.py, and
+GCS_BACKEND=local for its filesystem-backed variant.
+"""
+
+import asyncio
+import os
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Optional, Tuple
+
+import metrics
+from pools import LazyThreadPool
+
+if TYPE_CHECKING:  # the google libraries are imported when the client is first built
+    from google.cloud import storage
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+DEFAULT_BUCKET_NAME = "event-photos-demo"
+DEFAULT_HTTP_POOL_SIZE = 32
+MAX_CONCURRENCY = int(os.getenv("GCS_MAX_CONCURRENCY", "32"))
+CALL_TIMEOUT_SECONDS = float(os.getenv("GCS_CALL_TIMEOUT_SECONDS", "30"))
+# How often a credentials file is re-checked for changes; the env variable itself is read on every call
+CREDENTIALS_CHECK_SECONDS = float(os.getenv("GCS_CREDENTIALS_CHECK_SECONDS", "60"))
+
+CALL_SECONDS = metrics.REGISTRY.histogram(
+    "gcs_call_duration_seconds", "GCS call latency, including the wait for a pool thread", ("op",)
+)
+CALLS = metrics.REGISTRY.counter("gcs_calls_total", "GCS calls by outcome (ok, error, timeout)", ("op", "outcome"))
+
+_lock = threading.Lock()
+_client: Optional["storage.Client"] = None
+_credentials = None
+_client_key: Optional[Tuple] = None
+_checked_key: Optional[Tuple] = None
+_key_checked_at = 0.0
+
+
+def get_bucket_name() -> str:
+    """Configured GCS bucket name"""
+    return os.getenv("GCS_BUCKET_NAME", DEFAULT_BUCKET_NAME)
+
+
+def _credentials_key() -> Tuple:
+    """
+    Cheap fingerprint of the configured credentials. Changes when the
+    environment variable is edited or the credentials file is rewritten,
+    which is what triggers a client rebuild. The fingerprint taken when the
+    client is built is reused, so the file is only stat'ed again every
+    CREDENTIALS_CHECK_SECONDS.
+    """
+    global _checked_key, _key_checked_at
+    credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    now = time.monotonic()
+    key = _checked_key
+    if key is not None and key[0] == credentials_path and now - _key_checked_at < CREDENTIALS_CHECK_SECONDS:
+        return key
+    mtime = None
+    if credentials_path and not credentials_path.lstrip().startswith("{"):
+        try:
+            mtime = os.stat(credentials_path).st_mtime_ns
+        except OSError:
+            pass
+    _checked_key, _key_checked_at = (credentials_path, mtime), now
+    return _checked_key
+
+
+def _load_credentials():
+    """Parse GOOGLE_APPLICATION_CREDENTIALS as inline JSON or a file path"""
+    from google.cloud import storage
+    from google.oauth2 import service_account
+
+    credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    if not credentials_path:
+        return None
+    try:
+        # Vercel stores the whole credentials.json as a JSON string
+        creds_dict = json.loads(credentials_path)
+        logger.info("✅ Using credentials from environment variable (JSON)")
+        return service_account.Credentials.from_service_account_info(
+            creds_dict, scopes=storage.Client.SCOPE
+        )
+    except (json.JSONDecodeError, TypeError):
+        if os.path.exists(credentials_path):
+            logger.info(f"✅ Using credentials from file: {credentials_path}")
+            return service_account.Credentials.from_service_account_file(
+                credentials_path, scopes=storage.Client.SCOPE
+            )
+        logger.warning(f"⚠️ Credentials path not found: {credentials_path}")
+        return None
+
+
+def _build_client():
+    """Build credentials and a storage client backed by a pooled HTTP session"""
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import storage
+    from requests.adapters import HTTPAdapter
+
+    credentials = _load_credentials()
+    project = getattr(credentials, "project_id", None)
+    if credentials is None:
+        # Fallback to application default credentials
+        logger.warning("⚠️ Trying application default credentials...")
+        credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+
+    pool_size = int(os.getenv("GCS_HTTP_POOL_SIZE", DEFAULT_HTTP_POOL_SIZE))
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    client = storage.Client(project=project, credentials=credentials, _http=session)
+    return client, credentials
+
+
+def get_storage_client() -> "storage.Client":
+    """Return the shared storage client, building it on first use"""
+    global _client, _credentials, _client_key
+    key = _credentials_key()
+    client = _client
+    if client is not None and _client_key == key:
+        return client
+    with _lock:
+        if _client is None or _client_key != key:
+            if _client is not None:
+                logger.info("🔄 Credentials changed, rebuilding GCS client")
+            _client, _credentials = _build_client()
+            _client_key = key
+        return _client
+
+
+def get_credentials():
+    """Credentials backing the shared storage client"""
+    get_storage_client()
+    return _credentials
+
+
+def backend_name() -> str:
+    """gcs, or fake / local for the stand-ins in fake_gcs.py"""
+    return os.getenv("GCS_BACKEND", "gcs")
+
+
+def use_fake() -> bool:
+    return backend_name() in ("fake", "local")
+
+
+def get_bucket(bucket_name: Optional[str] = None) -> "storage.Bucket":
+    """Bucket handle on the shared client (no network call)"""
+    if use_fake():
+        import fake_gcs
+
+        return fake_gcs.get_fake_bucket(bucket_name or get_bucket_name())
+    return get_storage_client().bucket(bucket_name or get_bucket_name())
+
+
+def is_not_found(e: Exception) -> bool:
+    """Whether a GCS call failed because the object doesn't exist"""
+    # google.api_core NotFound carries code 404; the fake bucket raises FileNotFoundError
+    return isinstance(e, FileNotFoundError) or getattr(e, "code", None) == 404
+
+
+class GCSTimeout(Exception):
+    """A GCS call took longer than its timeout"""
+
+
+_pool = LazyThreadPool(MAX_CONCURRENCY, "gcs")
+_in_flight = 0
+_completed = 0
+_failed = 0
+_timeouts = 0
+
+
+_DEFAULT_TIMEOUT: Any = object()
+
+
+async def run(fn: Callable[..., Any], *args, timeout: Optional[float] = _DEFAULT_TIMEOUT) -> Any:
+    """
+    Run a blocking GCS call on the GCS pool without blocking the event loop
+
+    At most GCS_MAX_CONCURRENCY calls run at once; the rest queue. timeout
+    covers queueing plus the call itself (None waits indefinitely). A timed
+    out call can't be interrupted, but its caller is released immediately.
+    """
+    global _in_flight, _completed, _failed, _timeouts
+    if timeout is _DEFAULT_TIMEOUT:
+        timeout = CALL_TIMEOUT_SECONDS
+    op = getattr(fn, "__name__", "call")
+    outcome = "error"
+    began = time.perf_counter()
+    future = asyncio.get_running_loop().run_in_executor(_pool.executor(), fn, *args)
+    _in_flight += 1
+    try:
+        result = await asyncio.wait_for(future, timeout)
+        outcome = "ok"
+        return result
+    except asyncio.TimeoutError:
+        _timeouts += 1
+        outcome = "timeout"
+        raise GCSTimeout(f"GCS call {op} timed out after {timeout}s")
+    finally:
+        _in_flight -= 1
+        if outcome == "ok":
+            _completed += 1
+        elif outcome == "error":
+            _failed += 1
+        CALL_SECONDS.observe(time.perf_counter() - began, op=op)
+        CALLS.inc(op=op, outcome=outcome)
+
+
+@contextmanager
+def timed(op: str):
+    """Record a blocking GCS call made directly on a worker thread (outside run())"""
+    outcome = "error"
+    began = time.perf_counter()
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        CALL_SECONDS.observe(time.perf_counter() - began, op=op)
+        CALLS.inc(op=op, outcome=outcome)
+
+
+def stats() -> dict:
+    """Counters for status reporting"""
+    return {
+        "backend": backend_name(),
+        "max_concurrency": MAX_CONCURRENCY,
+        "call_timeout_seconds": CALL_TIMEOUT_SECONDS,
+        "in_flight": _in_flight,
+        "completed": _completed,
+        "failed": _failed,
+        "timeouts": _timeouts,
+    }
+
+
+def describe_init_error(e: Exception) -> str:
+    """Human readable hint for a failed client initialization"""
+    credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    error_msg = "GCS initialization failed. "
+    if not credentials_path:
+        error_msg += "GOOGLE_APPLICATION_CREDENTIALS not set in .env file. "
+    elif not credentials_path.lstrip().startswith("{") and not os.path.exists(credentials_path):
+        error_msg += f"Credentials file not found: {credentials_path}. "
+    else:
+        error_msg += f"Error: {str(e)}. "
+    error_msg += "Please check your .env file and credentials.json path."
+    return error_msg
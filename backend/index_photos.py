@@ -1,144 +1,368 @@
-"""
-Background script to index photos from GCS bucket using FAISS
-Run this script once per event to precompute all embeddings
-"""
-
-import requests
-import json
-import os
-import sys
-from typing import List
-from google.cloud import storage
-import logging
-
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Configuration
-GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "event-photos-demo")
-BACKEND_API_URL = os.getenv("BACKEND_API_URL", "http://localhost:8000")
-
-def get_gcs_photos(bucket_name: str, event_id: str) -> List[str]:
-    """
-    Get list of photo URLs from GCS bucket
-    
-    Args:
-        bucket_name: GCS bucket name
-        event_id: Event folder name
-    
-    Returns:
-        List of public photo URLs
-    """
-    try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blobs = bucket.list_blobs(prefix=f"{event_id}/", delimiter="/")
-        
-        photo_urls = []
-        for blob in blobs:
-            if blob.name.lower().endswith(('.jpg', '.jpeg', '.png')):
-                url = f"https://storage.googleapis.com/{bucket_name}/{blob.name}"
-                photo_urls.append(url)
-                logger.info(f"  📷 Found: {blob.name}")
-        
-        return photo_urls
-    
-    except Exception as e:
-        logger.error(f"❌ Failed to list GCS photos: {e}")
-        raise
-
-
-def index_event_photos(event_id: str, photo_urls: List[str]):
-    """
-    Call backend API to index photos for an event
-    
-    Args:
-        event_id: Event identifier
-        photo_urls: List of GCS photo URLs
-    """
-    try:
-        logger.info(f"\n🚀 Indexing event: {event_id}")
-        logger.info(f"📊 Total photos: {len(photo_urls)}")
-        
-        if not photo_urls:
-            logger.warning("⚠️  No photos found for this event")
-            return
-        
-        # Call backend indexing endpoint
-        response = requests.post(
-            f"{BACKEND_API_URL}/index",
-            json={
-                "event_id": event_id,
-                "photo_urls": photo_urls,
-            },
-            timeout=600,  # 10 minute timeout
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Backend returned {response.status_code}: {response.text}")
-        
-        result = response.json()
-        logger.info(f"\n✅ Indexing complete!")
-        logger.info(f"   Indexed faces: {result['indexed_faces']}")
-        logger.info(f"   Processed photos: {result['total_photos']}")
-        if result.get('failed_photos'):
-            logger.warning(f"   Failed photos: {len(result['failed_photos'])}")
-            for photo in result['failed_photos'][:5]:  # Show first 5
-                logger.warning(f"     - {photo}")
-        
-        return result
-    
-    except Exception as e:
-        logger.error(f"❌ Failed to index photos: {e}")
-        raise
-
-
-def get_backend_status():
-    """Check if backend is running and healthy"""
-    try:
-        response = requests.get(f"{BACKEND_API_URL}/health", timeout=5)
-        if response.status_code == 200:
-            status = response.json()
-            logger.info(f"✅ Backend OK - Indexed faces: {status['indexed_faces']}")
-            return True
-        else:
-            logger.error(f"❌ Backend unhealthy: {response.status_code}")
-            return False
-    except Exception as e:
-        logger.error(f"❌ Cannot connect to backend at {BACKEND_API_URL}: {e}")
-        return False
-
-
-def main():
-    """Main entry point"""
-    
-    # Check backend
-    logger.info(f"🔍 Checking backend at {BACKEND_API_URL}...")
-    if not get_backend_status():
-        logger.error("⚠️  Backend is not running. Start it with: python main.py")
-        sys.exit(1)
-    
-    # Get event ID from command line or use default
-    event_id = sys.argv[1] if len(sys.argv) > 1 else "demo-event-1"
-    
-    logger.info(f"\n📂 Fetching photos from GCS bucket: {GCS_BUCKET_NAME}/{event_id}")
-    
-    # Get photos from GCS
-    photo_urls = get_gcs_photos(GCS_BUCKET_NAME, event_id)
-    
-    if not photo_urls:
-        logger.error("❌ No photos found. Make sure:")
-        logger.error(f"   1. GCS bucket '{GCS_BUCKET_NAME}' exists and is public")
-        logger.error(f"   2. Photos are in folder: {event_id}/")
-        logger.error(f"   3. Photos are in JPEG format (*.jpg, *.jpeg)")
-        sys.exit(1)
-    
-    # Index photos
-    result = index_event_photos(event_id, photo_urls)
-    
-    if result:
-        logger.info(f"\n✨ Ready to match! Run the FastAPI server and upload selfies.")
-
-
-if __name__ == "__main__":
-    main()
+"""
+Background script to index photos from GCS bucket using FAISS
+Run this script once per event to precompute all embeddings
+
+The GCS listing is streamed into fixed-size batches that are indexed
+several at a time over a pooled HTTP session. Completed batches are
+checkpointed to a local state file, so an interrupted run resumes where it
+stopped (pass --fresh to ignore the checkpoint); a batch with failed photos
+isn't checkpointed, so they are retried on resume. Batches don't rebuild the
+event manifest; it is written once after the last batch. Batches follow
+the GCS listing's name order, so the backend only re-lists each batch's
+own name range; the final manifest step sweeps the whole event once.
+"""
+
+import requests
+import json
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, List, Optional
+from google.cloud import storage
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Configuration
+GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "event-photos-demo")
+BACKEND_API_URL = os.getenv("BACKEND_API_URL", "http://localhost:8000")
+# Seconds; a serverless backend runs each batch inside the request instead of enqueuing it
+SUBMIT_TIMEOUT = float(os.getenv("INDEX_SUBMIT_TIMEOUT", "600"))
+# Seconds; /index/manifest lists the whole event, flushes its faces and re-clusters them in the request
+MANIFEST_TIMEOUT = float(os.getenv("INDEX_MANIFEST_TIMEOUT", "1800"))
+POLL_INTERVAL = float(os.getenv("INDEX_POLL_INTERVAL", "2"))
+BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "500"))
+PARALLEL_BATCHES = int(os.getenv("INDEX_PARALLEL_BATCHES", "4"))
+STATE_DIR = os.getenv("INDEX_STATE_DIR", ".")
+
+
+def create_session() -> requests.Session:
+    """HTTP session with a connection pool sized for the in-flight batches"""
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=None)
+    adapter = HTTPAdapter(pool_connections=PARALLEL_BATCHES, pool_maxsize=PARALLEL_BATCHES * 2, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def iter_gcs_photos(bucket_name: str, event_id: str) -> Iterator[str]:
+    """
+    Stream photo URLs from GCS bucket page by page
+
+    Args:
+        bucket_name: GCS bucket name
+        event_id: Event folder name
+
+    Yields:
+        Public photo URLs
+    """
+    try:
+        storage_client = storage.Client()
+        bucket = storage_client.bucket(bucket_name)
+        blobs = bucket.list_blobs(prefix=f"{event_id}/", delimiter="/")
+
+        for blob in blobs:
+            if blob.name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                yield f"https://storage.googleapis.com/{bucket_name}/{blob.name}"
+
+    except Exception as e:
+        logger.error(f"❌ Failed to list GCS photos: {e}")
+        raise
+
+
+def get_gcs_photos(bucket_name: str, event_id: str) -> List[str]:
+    """
+    Get list of photo URLs from GCS bucket
+
+    Args:
+        bucket_name: GCS bucket name
+        event_id: Event folder name
+
+    Returns:
+        List of public photo URLs
+    """
+    return list(iter_gcs_photos(bucket_name, event_id))
+
+
+def iter_batches(photo_urls: Iterator[str], batch_size: int) -> Iterator[List[str]]:
+    """Group a stream of URLs into lists of batch_size"""
+    batch = []
+    for url in photo_urls:
+        batch.append(url)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class IndexCheckpoint:
+    """
+    Completed batches of an index run, persisted to a local JSON file
+
+    A batch is identified by its position and last URL, so a checkpoint is
+    only honoured if the listing still lines up with the previous run.
+    """
+
+    def __init__(self, event_id: str, batch_size: int, fresh: bool = False):
+        self.path = os.path.join(STATE_DIR, f".index_state_{event_id}.json")
+        self.event_id = event_id
+        self.batch_size = batch_size
+        self.completed = {}
+        self._lock = threading.Lock()
+        if not fresh and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    state = json.load(f)
+                if state.get("batch_size") == batch_size:
+                    self.completed = state.get("completed", {})
+                    logger.info(f"♻️  Resuming: {len(self.completed)} batches already indexed")
+                else:
+                    logger.warning("⚠️  Batch size changed since last run, starting over")
+            except Exception as e:
+                logger.warning(f"⚠️  Ignoring unreadable checkpoint {self.path}: {e}")
+
+    def is_done(self, batch_no: int, batch: List[str]) -> bool:
+        return self.completed.get(str(batch_no)) == batch[-1]
+
+    def mark_done(self, batch_no: int, batch: List[str]):
+        with self._lock:
+            self.completed[str(batch_no)] = batch[-1]
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    "event_id": self.event_id,
+                    "batch_size": self.batch_size,
+                    "completed": self.completed,
+                }, f)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def index_event_photos(event_id: str, photo_urls: List[str], session: Optional[requests.Session] = None):
+    """
+    Submit an indexing job to the backend and poll it until it finishes
+
+    Args:
+        event_id: Event identifier
+        photo_urls: List of GCS photo URLs
+        session: Optional pooled HTTP session
+    """
+    http = session or requests
+
+    # Enqueue the indexing job; the backend returns a job id right away (202),
+    # or runs it inside the request and returns the finished job (200).
+    # The manifest is rebuilt once after all batches (see publish_manifest)
+    response = http.post(
+        f"{BACKEND_API_URL}/index",
+        params={"event_id": event_id, "write_manifest": "false"},
+        json=photo_urls,
+        timeout=SUBMIT_TIMEOUT,
+    )
+
+    if response.status_code == 200:
+        result = response.json()
+        if result["status"] == "success":
+            result["status"] = "completed"
+    elif response.status_code == 202:
+        result = wait_for_job(response.json()["job_id"], http)
+    else:
+        raise Exception(f"Backend returned {response.status_code}: {response.text}")
+
+    if result["status"] != "completed":
+        raise Exception(f"Job {result['job_id']} {result['status']}: {result.get('error')}")
+
+    return result
+
+
+def wait_for_job(job_id: str, http=requests) -> dict:
+    """Poll the job-status endpoint until the job completes or fails"""
+    while True:
+        response = http.get(f"{BACKEND_API_URL}/index/jobs/{job_id}", timeout=30)
+        if response.status_code != 200:
+            raise Exception(f"Backend returned {response.status_code}: {response.text}")
+        job = response.json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(POLL_INTERVAL)
+
+
+def index_event_in_batches(event_id: str, photo_urls: Iterator[str], fresh: bool = False) -> dict:
+    """
+    Index a stream of photo URLs in fixed-size batches with several batches
+    in flight, checkpointing each batch that completed without failures
+
+    Args:
+        event_id: Event identifier
+        photo_urls: Stream of GCS photo URLs
+        fresh: Ignore any checkpoint from a previous run
+
+    Returns:
+        Totals for the run
+    """
+    logger.info(f"\n🚀 Indexing event: {event_id} (batches of {BATCH_SIZE}, {PARALLEL_BATCHES} in flight)")
+
+    checkpoint = IndexCheckpoint(event_id, BATCH_SIZE, fresh=fresh)
+    session = create_session()
+    # photos: listed; processed: indexed, skipped or failed by this run's jobs
+    totals = {
+        "photos": 0, "processed": 0, "indexed": 0, "skipped": 0, "deleted": 0, "resumed": 0, "failed_batches": 0,
+    }
+    failed_photos = []
+    started = time.time()
+
+    def run_batch(batch_no: int, batch: List[str]) -> dict:
+        result = index_event_photos(event_id, batch, session)
+        if not result.get("failed_photos"):
+            checkpoint.mark_done(batch_no, batch)
+        return result
+
+    def record(future, batch_no: int, batch: List[str]):
+        try:
+            result = future.result()
+        except Exception as e:
+            totals["failed_batches"] += 1
+            logger.error(f"   ❌ Batch {batch_no} failed: {e}")
+            return
+        totals["indexed"] += result["indexed_photos"]
+        totals["skipped"] += result["skipped_photos"]
+        totals["deleted"] += result["deleted_photos"]
+        failed = result.get("failed_photos", [])
+        failed_photos.extend(failed)
+        totals["processed"] += result["indexed_photos"] + result["skipped_photos"] + len(failed)
+        elapsed = time.time() - started
+        logger.info(
+            f"   ✅ Batch {batch_no}: {result['indexed_photos']} indexed, "
+            f"{result['skipped_photos']} unchanged, {len(failed)} failed — {totals['processed']} photos so far "
+            f"({totals['processed'] / elapsed:.1f} photos/s)"
+        )
+
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=PARALLEL_BATCHES) as executor:
+        for batch_no, batch in enumerate(iter_batches(photo_urls, BATCH_SIZE)):
+            totals["photos"] += len(batch)
+            if checkpoint.is_done(batch_no, batch):
+                totals["resumed"] += len(batch)
+                continue
+            # Keep at most PARALLEL_BATCHES requests in flight while listing continues
+            if len(in_flight) >= PARALLEL_BATCHES:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(future, *in_flight.pop(future))
+            in_flight[executor.submit(run_batch, batch_no, batch)] = (batch_no, batch)
+        for future in list(in_flight):
+            record(future, *in_flight.pop(future))
+
+    elapsed = time.time() - started
+    totals["photos_per_second"] = round(totals["processed"] / elapsed, 2) if elapsed > 0 else 0.0
+    totals["failed_photos"] = failed_photos
+
+    if totals["photos"] and not totals["failed_batches"] and not failed_photos:
+        checkpoint.clear()
+    return totals
+
+
+def publish_manifest(event_id: str) -> dict:
+    """
+    Have the backend rebuild the event manifest that /list-photos serves
+
+    Args:
+        event_id: Event identifier
+
+    Returns:
+        Manifest summary (photo count, object name)
+    """
+    response = requests.post(
+        f"{BACKEND_API_URL}/index/manifest",
+        params={"event_id": event_id},
+        timeout=MANIFEST_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise Exception(f"Backend returned {response.status_code}: {response.text}")
+    return response.json()
+
+
+def get_backend_status():
+    """Check if backend is running and healthy"""
+    try:
+        response = requests.get(f"{BACKEND_API_URL}/health", timeout=5)
+        if response.status_code == 200:
+            status = response.json()
+            logger.info(f"✅ Backend OK - Indexed photos: {status['indexed_photos']}")
+            return True
+        else:
+            logger.error(f"❌ Backend unhealthy: {response.status_code}")
+            return False
+    except Exception as e:
+        logger.error(f"❌ Cannot connect to backend at {BACKEND_API_URL}: {e}")
+        return False
+
+
+def main():
+    """Main entry point"""
+
+    # Check backend
+    logger.info(f"🔍 Checking backend at {BACKEND_API_URL}...")
+    if not get_backend_status():
+        logger.error("⚠️  Backend is not running. Start it with: python main.py")
+        sys.exit(1)
+
+    # Get event ID from command line or use default
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    fresh = "--fresh" in sys.argv[1:]
+    event_id = args[0] if args else "demo-event-1"
+
+    logger.info(f"\n📂 Streaming photos from GCS bucket: {GCS_BUCKET_NAME}/{event_id}")
+
+    # Index photos as the listing streams in
+    try:
+        totals = index_event_in_batches(event_id, iter_gcs_photos(GCS_BUCKET_NAME, event_id), fresh=fresh)
+    except Exception as e:
+        logger.error(f"❌ Failed to index photos: {e}")
+        sys.exit(1)
+
+    if not totals["photos"]:
+        logger.error("❌ No photos found. Make sure:")
+        logger.error(f"   1. GCS bucket '{GCS_BUCKET_NAME}' exists and is public")
+        logger.error(f"   2. Photos are in folder: {event_id}/")
+        logger.error(f"   3. Photos are in JPEG format (*.jpg, *.jpeg)")
+        sys.exit(1)
+
+    # Publish the listing even after failed batches; a resumed run rebuilds it
+    try:
+        summary = publish_manifest(event_id)
+        logger.info(f"🗂️  Manifest written: {summary['count']} photos ({summary['manifest']})")
+    except Exception as e:
+        logger.warning(f"⚠️  Could not write the event manifest, listings will query GCS: {e}")
+
+    logger.info(f"\n✅ Indexing finished!")
+    logger.info(f"   Total photos: {totals['photos']}")
+    logger.info(f"   Processed this run: {totals['processed']}")
+    logger.info(f"   Indexed photos: {totals['indexed']}")
+    logger.info(f"   Unchanged (skipped): {totals['skipped']}")
+    logger.info(f"   Deleted from GCS: {totals['deleted']}")
+    logger.info(f"   Resumed from checkpoint: {totals['resumed']}")
+    logger.info(f"   Throughput: {totals['photos_per_second']} photos/s")
+    if totals["failed_photos"]:
+        logger.warning(f"   Failed photos: {len(totals['failed_photos'])}")
+        for photo in totals["failed_photos"][:5]:  # Show first 5
+            logger.warning(f"     - {photo['photo_url']}: {photo['error']}")
+
+    if totals["failed_batches"]:
+        logger.error(f"⚠️  {totals['failed_batches']} batches failed. Re-run to resume from the checkpoint.")
+        sys.exit(1)
+
+    logger.info(f"\n✨ Ready to match! Run the FastAPI server and upload selfies.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Background indexing jobs
+/index enqueues a job and returns its id; photos are processed by a bounded
+pool of workers with retry and exponential backoff, and progress is exposed
+through the job-status endpoint. Job status is snapshotted to a SQLite file
+shared by every uvicorn worker, so a poll landing on another worker than
+the one running the job still finds it.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from pools import SQLiteConnections
+
+logger = logging.getLogger(__name__)
+
+
+class IndexJob:
+    """State and progress of one indexing job"""
+
+    def __init__(self, event_id: str, photo_urls: List[str], options: Optional[dict] = None):
+        self.job_id = uuid.uuid4().hex
+        self.event_id = event_id
+        self.photo_urls = photo_urls
+        self.options = options or {}  # caller settings read by prepare/finalize
+        # Work items ({"photo_url": ...} dicts); prepare may narrow these down
+        self.items: List[dict] = [{"photo_url": url} for url in photo_urls]
+        self.status = "queued"
+        self.processed = 0
+        self.indexed = 0
+        self.skipped = 0
+        self.deleted = 0
+        self.retries = 0
+        self.failed_photos: List[dict] = []
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def to_dict(self) -> dict:
+        """JSON-friendly job status"""
+        queued = len(self.items)
+        elapsed = 0.0
+        if self.started_at:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "job_id": self.job_id,
+            "event_id": self.event_id,
+            "status": self.status,
+            "total_photos": len(self.photo_urls),
+            "queued_photos": queued,
+            "processed_photos": self.processed,
+            "indexed_photos": self.indexed,
+            "skipped_photos": self.skipped,
+            "deleted_photos": self.deleted,
+            "progress": round(self.processed / queued, 4) if queued else 1.0,
+            "elapsed_seconds": round(elapsed, 3),
+            "photos_per_second": round(self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+            "retries": self.retries,
+            "failed_photos": self.failed_photos,
+            "error": self.error,
+        }
+
+
+class JobStore:
+    """
+    Status snapshots of indexing jobs in a SQLite database shared by workers
+
+    A job's owner saves its to_dict() when it is queued, after every
+    committed chunk and when it finishes; other workers serve the last
+    snapshot. A job whose worker died stays at its last saved status.
+    """
+
+    def __init__(self, path: str, max_jobs_kept: int = 1000, busy_timeout_ms: int = 10000):
+        self.path = path
+        self.max_jobs_kept = max_jobs_kept
+        self._connections = SQLiteConnections(path, busy_timeout_ms)
+
+    def _conn(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, created_at REAL NOT NULL, state TEXT NOT NULL)"
+        )
+
+    def save(self, job: "IndexJob"):
+        """Store a job's current status, forgetting the oldest jobs once it finishes (blocking)"""
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?)",
+            (job.job_id, job.created_at, json.dumps(job.to_dict(), separators=(",", ":"))),
+        )
+        if job.done:
+            conn.execute(
+                "DELETE FROM jobs WHERE job_id NOT IN (SELECT job_id FROM jobs ORDER BY created_at DESC LIMIT ?)",
+                (self.max_jobs_kept,),
+            )
+
+    def load(self, job_id: str) -> Optional[dict]:
+        """Last saved status of a job, or None (blocking)"""
+        row = self._conn().execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def clear(self):
+        self._conn().execute("DELETE FROM jobs")
+
+
+class IndexJobRunner:
+    """
+    Runs indexing jobs on the event loop
+
+    prepare(job), if given, runs first on the event loop and may narrow
+    job.items down to the photos that actually need work.
+    process(event_id, item) does the per-photo work in a worker thread
+    and returns a metadata entry. commit(event_id, entries) is awaited on the
+    event loop to persist finished entries in chunks of commit_every; it
+    should hand its blocking writes to a thread.
+    finalize(job), if given, runs once all photos are committed.
+    At most `concurrency` photos are processed at once across all jobs.
+    With a store, job status is shared with the other workers.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[str, dict], Any],
+        commit: Callable[[str, List[Any]], Awaitable[None]],
+        prepare: Optional[Callable[[IndexJob], Awaitable[None]]] = None,
+        finalize: Optional[Callable[[IndexJob], Awaitable[None]]] = None,
+        concurrency: int = 8,
+        max_retries: int = 3,
+        retry_backoff_seconds: float = 0.5,
+        commit_every: int = 100,
+        max_jobs_kept: int = 100,
+        store: Optional[JobStore] = None,
+    ):
+        self.process = process
+        self.commit = commit
+        self.prepare = prepare
+        self.finalize = finalize
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.commit_every = max(1, commit_every)
+        self.max_jobs_kept = max_jobs_kept
+        self.store = store
+        self.jobs: "OrderedDict[str, IndexJob]" = OrderedDict()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def get(self, job_id: str) -> Optional[IndexJob]:
+        return self.jobs.get(job_id)
+
+    async def status(self, job_id: str) -> Optional[dict]:
+        """Status of a job run by this worker, or its last snapshot from the store"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.store is None:
+            return None
+        return await run_in_threadpool(self.store.load, job_id)
+
+    async def save(self, job: IndexJob):
+        """Snapshot a job's status to the store; a failure only costs other workers' view of it"""
+        if self.store is None:
+            return
+        try:
+            await run_in_threadpool(self.store.save, job)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not save status of job {job.job_id}: {e}")
+
+    def create(self, event_id: str, photo_urls: List[str], options: Optional[dict] = None) -> IndexJob:
+        """Register a new job, forgetting the oldest finished ones"""
+        job = IndexJob(event_id, photo_urls, options)
+        self.jobs[job.job_id] = job
+        finished = [jid for jid, j in self.jobs.items() if j.done]
+        for jid in finished[: max(0, len(self.jobs) - self.max_jobs_kept)]:
+            del self.jobs[jid]
+        return job
+
+    async def submit(self, event_id: str, photo_urls: List[str], options: Optional[dict] = None) -> IndexJob:
+        """Create a job, saved before its id is handed out, and start it in the background"""
+        job = self.create(event_id, photo_urls, options)
+        await self.save(job)
+        task = asyncio.create_task(self.run(job))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+        return job
+
+    async def _process_with_retry(self, job: IndexJob, item: dict):
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    return await run_in_threadpool(self.process, job.event_id, item)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff_seconds * (2 ** attempt)
+                attempt += 1
+                job.retries += 1
+                logger.warning(f"  ⚠️ Retry {attempt}/{self.max_retries} for {item['photo_url']} in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+    async def run(self, job: IndexJob) -> IndexJob:
+        """Process every photo of a job and commit results in chunks"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        job.status = "running"
+        job.started_at = time.time()
+        logger.info(f"📸 Job {job.job_id}: indexing {len(job.photo_urls)} photos for event {job.event_id}")
+
+        finished: List[Any] = []
+
+        async def flush():
+            if finished:
+                # Taken before awaiting, so entries finished meanwhile go in the next chunk
+                chunk = list(finished)
+                finished.clear()
+                await self.commit(job.event_id, chunk)
+                await self.save(job)
+
+        async def worker(pending):
+            for item in pending:
+                try:
+                    entry = await self._process_with_retry(job, item)
+                    finished.append(entry)
+                    job.indexed += 1
+                except Exception as e:
+                    logger.error(f"  ❌ Failed to process photo {item['photo_url']}: {e}")
+                    job.failed_photos.append({"photo_url": item["photo_url"], "error": str(e)})
+                job.processed += 1
+                if len(finished) >= self.commit_every:
+                    await flush()
+
+        try:
+            if self.prepare is not None:
+                await self.prepare(job)
+            await self.save(job)
+            pending = iter(job.items)
+            workers = min(self.concurrency, len(job.items)) or 1
+            await asyncio.gather(*(worker(pending) for _ in range(workers)))
+            await flush()
+            if self.finalize is not None:
+                await self.finalize(job)
+            job.status = "completed"
+        except Exception as e:
+            logger.error(f"❌ Job {job.job_id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+        await self.save(job)
+
+        summary = job.to_dict()
+        logger.info(
+            f"✅ Job {job.job_id} {job.status}: {job.indexed}/{len(job.items)} photos indexed, "
+            f"{job.skipped} unchanged, {job.deleted} deleted ({summary['photos_per_second']} photos/s)"
+        )
+        return job
@@ -1,80 +1,423 @@
 """
 FastAPI Backend for Event Photo Gallery MVP
 Simplified version without heavy AI/ML dependencies for fast local testing
+
+Heavy dependencies (google-cloud-storage, numpy, faiss, insightface) are
+imported on first use, and startup runs lazily on the first request when
+the lifespan is disabled (Vercel/Mangum), so cold starts stay short.
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+import time
+
+_import_started = time.perf_counter()
+
+from fastapi import Depends, FastAPI, File, UploadFile, HTTPException, Query, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
+import asyncio
 import os
 import json
-from typing import List
+import hashlib
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set, Tuple
 import logging
 import random
+import threading
 from datetime import timedelta
 from urllib.parse import urlparse
-from google.cloud import storage
-from google.oauth2 import service_account
 from dotenv import load_dotenv
 
+import compression
+import derivatives
+import gcs
+import manifest
+import metrics
+from cache import TTLCache
+from jobs import IndexJob, IndexJobRunner, JobStore
+from metadata_store import EventShard, MetadataStore
+from selfie import MULTIPART_OVERHEAD_BYTES, BoundedExecutor, PoolSaturated, UploadLimitMiddleware, UploadTooLarge, read_upload
+
+if TYPE_CHECKING:  # imported lazily at runtime; see initialize_face_analyzer()
+    from clusters import ClusterStore, EventClusters
+    from faiss_store import FaissEventStore
+    from matcher import EmbeddingBackend, FaceMatcher
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))  # share of per-photo debug lines emitted
+
+
+def log_sampled(message: Callable[[], str]):
+    """Per-photo debug line for a LOG_SAMPLE_RATE sample; the message isn't even built otherwise"""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_SAMPLE_RATE:
+        logger.debug(message())
+
 
 # Configuration
-EMBEDDINGS_METADATA_PATH = "embeddings_metadata.json"
+DATA_DIR = os.getenv("DATA_DIR", "/tmp" if os.getenv("VERCEL") else ".")  # Vercel only allows writes to /tmp
+METADATA_DB_PATH = os.getenv("METADATA_DB_PATH", os.path.join(DATA_DIR, "embeddings_metadata.db"))  # shared by all workers
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(DATA_DIR, "index_jobs.db"))  # job status, shared by all workers
+LEGACY_METADATA_PATH = "embeddings_metadata.json"  # single-file metadata, migrated on startup
+METADATA_MEMORY_BUDGET_MB = int(os.getenv("METADATA_MEMORY_BUDGET_MB", "256"))
+METADATA_MMAP_MB = int(os.getenv("METADATA_MMAP_MB", "256"))
+LIST_CACHE_TTL_SECONDS = float(os.getenv("LIST_CACHE_TTL_SECONDS", "30"))
+LIST_CACHE_MAX_EVENTS = int(os.getenv("LIST_CACHE_MAX_EVENTS", "256"))
+LIST_BODY_CACHE_MB = int(os.getenv("LIST_BODY_CACHE_MB", "64"))  # serialized /list-photos bodies, all variants
+SIGNED_URL_EXPIRY_SECONDS = int(os.getenv("SIGNED_URL_EXPIRY_SECONDS", "600"))
+SIGNED_URL_REUSE_MARGIN_SECONDS = int(os.getenv("SIGNED_URL_REUSE_MARGIN_SECONDS", "120"))
+SIGNED_URL_CACHE_MAX = int(os.getenv("SIGNED_URL_CACHE_MAX", "20000"))
+DOWNLOAD_BATCH_MAX = int(os.getenv("DOWNLOAD_BATCH_MAX", "5000"))
+INDEX_WORKER_CONCURRENCY = int(os.getenv("INDEX_WORKER_CONCURRENCY", "8"))
+INDEX_MAX_RETRIES = int(os.getenv("INDEX_MAX_RETRIES", "3"))
+INDEX_RETRY_BACKOFF_SECONDS = float(os.getenv("INDEX_RETRY_BACKOFF_SECONDS", "0.5"))
+# Run /index jobs inside the request: serverless instances freeze background tasks once the response is sent
+INDEX_INLINE = os.getenv("INDEX_INLINE", "1" if os.getenv("VERCEL") else "0") == "1"
+# Quiet period after a batch job (write_manifest=false) before its event's FAISS index and clusters are rebuilt
+FACE_REFRESH_DELAY_SECONDS = float(os.getenv("FACE_REFRESH_DELAY_SECONDS", "60"))
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "none")  # none | hash | insightface
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")  # float16 halves memory, slower search
+FACE_MATCH_THRESHOLD = float(os.getenv("FACE_MATCH_THRESHOLD", "0.6"))
+FACE_MATCH_TOP_K = int(os.getenv("FACE_MATCH_TOP_K", "200"))
+SELFIE_MAX_BYTES = int(os.getenv("SELFIE_MAX_BYTES", str(15 * 1024 * 1024)))
+SELFIE_MAX_SIDE = int(os.getenv("SELFIE_MAX_SIDE", "1280"))  # detector runs at 640x640
+SELFIE_WORKERS = int(os.getenv("SELFIE_WORKERS", "4"))
+SELFIE_QUEUE_SIZE = int(os.getenv("SELFIE_QUEUE_SIZE", "8"))
+SELFIE_RETRY_AFTER_SECONDS = int(os.getenv("SELFIE_RETRY_AFTER_SECONDS", "2"))
+SELFIE_CACHE_TTL_SECONDS = float(os.getenv("SELFIE_CACHE_TTL_SECONDS", "900"))
+SELFIE_CACHE_MAX = int(os.getenv("SELFIE_CACHE_MAX", "1024"))
+USE_FAISS = os.getenv("USE_FAISS", "auto")  # auto: when faiss is installed and matching is enabled
+FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", os.path.join(DATA_DIR, "faiss_indexes"))
+FAISS_ANN_THRESHOLD = int(os.getenv("FAISS_ANN_THRESHOLD", "10000"))
+FAISS_ANN_TYPE = os.getenv("FAISS_ANN_TYPE", "ivf")  # ivf | hnsw
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+CLUSTER_FACES = os.getenv("CLUSTER_FACES", "1")  # 0: no per-event face clusters
+CLUSTER_DIR = os.getenv("CLUSTER_DIR", os.path.join(DATA_DIR, "face_clusters"))
+CLUSTER_SIMILARITY = float(os.getenv("CLUSTER_SIMILARITY", str(FACE_MATCH_THRESHOLD)))
+CLUSTER_ITERATIONS = int(os.getenv("CLUSTER_ITERATIONS", "2"))
+CLUSTER_NPROBE = int(os.getenv("CLUSTER_NPROBE", "16"))  # clusters re-ranked per selfie; 0: all that can match
+CLUSTER_SEARCH_MIN_FACES = int(os.getenv("CLUSTER_SEARCH_MIN_FACES", "2000"))  # smaller events are searched flat
+CLUSTER_MIN_PHOTOS = int(os.getenv("CLUSTER_MIN_PHOTOS", "2"))  # smaller clusters aren't listed as people
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+COLD_START_BUDGET_SECONDS = float(os.getenv("COLD_START_BUDGET_SECONDS", "1.5"))
 
 # Global variables
-embeddings_metadata = {}
+embedding_backend: Optional["EmbeddingBackend"] = None  # None while AI matching is disabled
+face_matcher: Optional["FaceMatcher"] = None  # resident events' faces, or only unpersisted ones with FAISS
+faiss_store: Optional["FaissEventStore"] = None  # per-event on-disk indexes, when enabled
+dirty_faiss_events: Dict[str, int] = {}  # events whose on-disk index is behind the metadata -> changes since
+cluster_store: Optional["ClusterStore"] = None  # per-event face clusters built after indexing
+
+# Decodes, downscales and embeds selfies off the event loop and default threadpool
+selfie_pool = BoundedExecutor(SELFIE_WORKERS, SELFIE_QUEUE_SIZE)
+
+# Selfie content hash -> query face embeddings, so resubmitted selfies skip detection
+selfie_embedding_cache = TTLCache(SELFIE_CACHE_TTL_SECONDS, SELFIE_CACHE_MAX)
+
+# Per-event listings served by /list-photos: {"photos", "thumbnails", "details", "source"},
+# plus a content "digest" for ETags
+event_listing_cache = TTLCache(LIST_CACHE_TTL_SECONDS, LIST_CACHE_MAX_EVENTS)
+
+# (event_id, ETag, encoding) -> serialized full-listing response; bounded by bytes, since
+# every listing can have several variants (details, compact) in several encodings
+listing_body_cache = TTLCache(
+    LIST_CACHE_TTL_SECONDS, LIST_CACHE_MAX_EVENTS * 16, max_bytes=LIST_BODY_CACHE_MB * 1024 * 1024
+)
+
+# Hot-path timers; gauges over the state above are registered next to /metrics
+METADATA_WRITE_SECONDS = metrics.REGISTRY.histogram(
+    "metadata_write_duration_seconds", "Metadata store transactions and checkpoints", ("op",)
+)
+SIGNING_SECONDS = metrics.REGISTRY.histogram(
+    "url_signing_duration_seconds", "V4 signed URL generation (signed URL cache misses)"
+)
+MATCH_SECONDS = metrics.REGISTRY.histogram(
+    "match_duration_seconds", "Selfie matching stages (embed, search)", ("stage",)
+)
+INDEX_PHOTO_SECONDS = metrics.REGISTRY.histogram(
+    "index_photo_duration_seconds", "Per-photo indexing work on an indexing worker"
+)
+CLUSTER_BUILD_SECONDS = metrics.REGISTRY.histogram(
+    "face_cluster_build_duration_seconds", "Clustering an event's faces after an indexing job",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+# Serializes manifest rebuilds per event; manifest_stats counts how listings were served
+manifest_locks: Dict[str, asyncio.Lock] = {}
+manifest_stats = {"served": 0, "missing": 0, "stale": 0, "errors": 0, "written": 0}
+
+# Serializes FAISS flushes and re-clustering per event; pending delayed refreshes after batch jobs
+face_refresh_locks: Dict[str, asyncio.Lock] = {}
+face_refresh_tasks: Dict[str, asyncio.Task] = {}
+
+# blob name -> (signed URL, expires_at); dropped before the URL gets close to expiry
+signed_url_cache = TTLCache(
+    max(SIGNED_URL_EXPIRY_SECONDS - SIGNED_URL_REUSE_MARGIN_SECONDS, 0), SIGNED_URL_CACHE_MAX
+)
+
+
+def metadata_key(photo_url: str) -> str:
+    """
+    Stable metadata key for a photo: its blob name within the bucket, so
+    re-indexing the same object replaces its entry instead of adding one
+    """
+    path_parts = urlparse(photo_url).path.lstrip("/").split("/", 1)
+    if len(path_parts) == 2 and path_parts[1]:
+        return path_parts[1]
+    return photo_url
+
+
+def photo_thumbnails(key: str, sizes: Optional[List[int]]) -> Dict[str, str]:
+    """Public URLs of a photo's rendered derivatives, keyed by size"""
+    return {
+        str(size): metadata_store.url_prefix + derivatives.derivative_blob_name(key, size)
+        for size in sizes or ()
+    }
+
+
+def relative_urls(urls: List[Optional[str]], base_url: str) -> List[Optional[str]]:
+    """URLs with a shared base URL stripped (None stays None)"""
+    n = len(base_url)
+    return [url[n:] if url and url.startswith(base_url) else url for url in urls]
+
+
+def url_fields(key: str, photo_urls: List[str], thumbnails: Dict[str, List[Optional[str]]], compact: bool, folder: str = "") -> dict:
+    """
+    Photo and thumbnail URL fields of a response. The compact form sends
+    base URLs once plus names relative to them (photos to base_url,
+    thumbnails to the thumbnail_base_urls entry of their size); any name
+    starting with "https://" is already absolute.
+    """
+    if not compact:
+        return {key: photo_urls, "thumbnails": thumbnails}
+    base_url = metadata_store.url_prefix + folder
+    thumbnail_base_urls = {
+        str(size): metadata_store.url_prefix + derivatives.derivative_prefix(size) + folder
+        for size in derivatives.SIZES
+    }
+    return {
+        "base_url": base_url,
+        key: relative_urls(photo_urls, base_url),
+        "thumbnail_base_urls": thumbnail_base_urls,
+        "thumbnails": {
+            size: relative_urls(urls, thumbnail_base_urls.get(size, "")) for size, urls in thumbnails.items()
+        },
+    }
+
+
+def thumbnail_urls(items: List[Tuple[str, Optional[List[int]]]]) -> Dict[str, List[Optional[str]]]:
+    """
+    Derivative URLs per configured size ({"256": [...], "1024": [...]}),
+    parallel to (blob name, rendered sizes) items; None where a photo has
+    no derivative of that size
+    """
+    per_photo = [photo_thumbnails(key, sizes) for key, sizes in items]
+    return {str(size): [urls.get(str(size)) for urls in per_photo] for size in derivatives.SIZES}
+
+
+def on_shard_load(shard: EventShard) -> int:
+    """Build the face matrix of an event whose metadata was just loaded"""
+    if face_matcher is None:
+        return 0
+    from matcher import decode_embeddings
+    
+    faces = 0
+    for key, entry in shard.entries.items():
+        if entry.get("embeddings"):
+            embeddings = decode_embeddings(entry["embeddings"], embedding_backend.dim)
+            face_matcher.add(shard.event_id, key, embeddings)
+            faces += len(embeddings)
+    return faces * face_matcher.dim * face_matcher.itemsize
+
+
+def on_shard_evict(shard: EventShard):
+    """Release derived in-memory state of an evicted event"""
+    if face_matcher is None:
+        return
+    if cluster_store is not None:
+        cluster_store.unload(shard.event_id)
+    if faiss_store is None:
+        face_matcher.drop_event(shard.event_id)
+    else:
+        # Unflushed faces stay in face_matcher; only the mapped index is released
+        faiss_store.unload(shard.event_id)
+
+
+metadata_store = MetadataStore(
+    METADATA_DB_PATH,
+    # Rows hold blob names; URLs are rebuilt only for responses
+    url_prefix=f"https://storage.googleapis.com/{gcs.get_bucket_name()}/",
+    memory_budget_bytes=METADATA_MEMORY_BUDGET_MB * 1024 * 1024,
+    mmap_bytes=METADATA_MMAP_MB * 1024 * 1024,
+    on_load=on_shard_load,
+    on_evict=on_shard_evict,
+)
+job_store = JobStore(JOBS_DB_PATH)
+
+
+def load_legacy_metadata() -> Dict[str, dict]:
+    """Read embeddings_metadata.json, re-keyed by blob name"""
+    with open(LEGACY_METADATA_PATH, 'r') as f:
+        entries = json.load(f)
+    # Positional ids ("0", "1", ...) from before keys were blob names
+    return {metadata_key(entry["photo_url"]): entry for entry in entries.values()}
 
 
 def load_metadata():
-    """Load metadata from disk or create new"""
-    global embeddings_metadata
-    if os.path.exists(EMBEDDINGS_METADATA_PATH):
+    """Open the shared metadata and job databases, importing embeddings_metadata.json once"""
+    metadata_store.open()
+    job_store.open()
+    if os.path.exists(LEGACY_METADATA_PATH) and not metadata_store.event_ids():
         try:
-            with open(EMBEDDINGS_METADATA_PATH, 'r') as f:
-                embeddings_metadata = json.load(f)
-                logger.info(f"✅ Loaded metadata with {len(embeddings_metadata)} photos")
+            entries = load_legacy_metadata()
+            # Upserts, so a second worker migrating at the same time is harmless
+            metadata_store.import_legacy(entries)
+            os.replace(LEGACY_METADATA_PATH, f"{LEGACY_METADATA_PATH}.migrated")
+            logger.info(f"🔄 Migrated {len(entries)} photos into {METADATA_DB_PATH}")
         except Exception as e:
-            logger.error(f"❌ Failed to load metadata: {e}")
-            embeddings_metadata = {}
-    else:
-        embeddings_metadata = {}
+            logger.error(f"❌ Failed to migrate legacy metadata: {e}")
 
 
 def save_metadata():
-    """Save metadata to disk"""
+    """Checkpoint the metadata WAL so the next start reads a compact file"""
+    with METADATA_WRITE_SECONDS.time(op="checkpoint"):
+        metadata_store.checkpoint()
+    logger.info("✅ Saved metadata")
+
+
+def initialize_face_analyzer():
+    """Create the embedding backend selected by EMBEDDING_BACKEND ("none" keeps AI disabled)"""
+    global embedding_backend, face_matcher
+    if EMBEDDING_BACKEND in ("", "none"):
+        return  # numpy and the model stack are never imported
+    from matcher import FaceMatcher, create_embedding_backend
+    
+    embedding_backend = create_embedding_backend(EMBEDDING_BACKEND)
+    face_matcher = FaceMatcher(dim=embedding_backend.dim, dtype=EMBEDDING_DTYPE)
+    logger.info(f"✅ Face matching enabled ({embedding_backend.name} embeddings)")
+
+
+def initialize_faiss_index():
+    """
+    Open the per-event FAISS index directory. With FAISS enabled, face
+    embeddings live in memory-mapped per-event index files instead of the
+    metadata JSON, and only faces indexed since the last flush stay in
+    face_matcher.
+    """
+    global faiss_store
+    if embedding_backend is None or USE_FAISS in ("0", "false", "no"):
+        return
     try:
-        with open(EMBEDDINGS_METADATA_PATH, 'w') as f:
-            json.dump(embeddings_metadata, f, indent=2)
-        logger.info("✅ Saved metadata")
-    except Exception as e:
-        logger.error(f"❌ Failed to save metadata: {e}")
+        from faiss_store import FaissEventStore
+        
+        faiss_store = FaissEventStore(
+            FAISS_INDEX_DIR,
+            ann_threshold=FAISS_ANN_THRESHOLD,
+            ann_type=FAISS_ANN_TYPE,
+            nprobe=FAISS_NPROBE,
+        )
+        logger.info(f"✅ FAISS indexes in {FAISS_INDEX_DIR}/ (memory-mapped per event)")
+    except ImportError:
+        if USE_FAISS != "auto":
+            raise
+        logger.warning("⚠️ faiss not installed, keeping face embeddings in memory")
+
+
+def initialize_face_clusters():
+    """Open the per-event face cluster directory; clusters are built after each indexing job"""
+    global cluster_store
+    if embedding_backend is None or CLUSTER_FACES in ("0", "false", "no"):
+        return
+    from clusters import ClusterStore
+    
+    cluster_store = ClusterStore(CLUSTER_DIR, CLUSTER_SIMILARITY, CLUSTER_ITERATIONS)
+    logger.info(f"✅ Face clusters in {CLUSTER_DIR}/ (similarity {CLUSTER_SIMILARITY})")
+
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+startup_profile = {
+    "import_seconds": round(IMPORT_SECONDS, 4),
+    "startup_seconds": None,
+    "steps": {},
+    "lazy": None,  # True when started by the first request instead of the lifespan
+}
+_started = False
+_startup_lock = threading.Lock()
+
+
+def startup(lazy: bool = False):
+    """Initialize the matcher, FAISS, face clusters and metadata store once per process (blocking)"""
+    global _started
+    if _started:
+        return
+    with _startup_lock:
+        if _started:
+            return
+        logger.info("🚀 Starting Event Photo Gallery API (MVP)...")
+        began = time.perf_counter()
+        steps = {}
+        for step in (initialize_face_analyzer, initialize_faiss_index, initialize_face_clusters, load_metadata):
+            step_began = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logger.error(f"⚠️ Startup warning ({step.__name__}): {e}")
+            steps[step.__name__] = round(time.perf_counter() - step_began, 4)
+        startup_profile.update(
+            startup_seconds=round(time.perf_counter() - began, 4), steps=steps, lazy=lazy
+        )
+        _started = True
+        total = IMPORT_SECONDS + startup_profile["startup_seconds"]
+        log = logger.warning if total > COLD_START_BUDGET_SECONDS else logger.info
+        log(
+            f"⏱️ Cold start {total:.3f}s (import {IMPORT_SECONDS:.3f}s, startup {steps}) "
+            f"— budget {COLD_START_BUDGET_SECONDS}s"
+        )
+
+
+async def ensure_started():
+    """
+    App-wide dependency. Serverless runs with the lifespan off, so the
+    first request performs startup (in a thread; concurrent first requests
+    wait on the startup lock there); afterwards this is a flag check on
+    the event loop, with no threadpool hop.
+    """
+    if not _started:
+        await run_in_threadpool(startup, True)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan event handler for startup and shutdown"""
-    # Startup
-    logger.info("🚀 Starting Event Photo Gallery API (MVP)...")
-    try:
-        load_metadata()
-        logger.info("✅ Startup complete")
-    except Exception as e:
-        logger.error(f"⚠️ Startup warning: {e}")
+    global _started
+    await run_in_threadpool(startup)
     yield
-    # Shutdown (if needed)
+    # Shutdown: every write is already committed; flush pending faces and checkpoint the WAL
     logger.info("🛑 Shutting down...")
+    for event_id in list(face_refresh_tasks):
+        await refresh_event_faces(event_id)
+    save_metadata()
+    selfie_pool.shutdown()
+    derivatives.shutdown()
+    _started = False
 
 
 # Initialize FastAPI app
-# Note: In serverless (Vercel), lifespan is disabled via Mangum
-app = FastAPI(title="Event Photo Gallery API (MVP)", version="1.0.0", lifespan=lifespan)
+# Note: In serverless (Vercel), lifespan is disabled via Mangum; ensure_started() covers it
+app = FastAPI(
+    title="Event Photo Gallery API (MVP)",
+    version="1.0.0",
+    lifespan=lifespan,
+    dependencies=[Depends(ensure_started)],
+)
+
+# Innermost, so its 413s still get CORS headers; the /match body is capped before the form is parsed
+app.add_middleware(UploadLimitMiddleware, limits={"/match": SELFIE_MAX_BYTES + MULTIPART_OVERHEAD_BYTES})
 
 # Add CORS middleware
 app.add_middleware(
@@ -85,6 +428,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(compression.CompressionMiddleware)
+
+# Outermost, so request latency covers every other middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
 
 @app.get("/")
 async def root():
@@ -95,7 +443,12 @@ async def root():
         "endpoints": {
             "health": "/health",
             "list_photos": "/list-photos?event_id=<event_id>",
-            "status": "/status"
+            "index_manifest": "/index/manifest?event_id=<event_id>",
+            "people": "/people?event_id=<event_id>",
+            "download_photos": "/download-photos",
+            "status": "/status",
+            "metrics": "/metrics",
+            "startup_profile": "/startup-profile"
         }
     }
 
@@ -104,48 +457,415 @@ async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "mode": "MVP (simplified for testing)",
-        "indexed_photos": len(embeddings_metadata),
+        "mode": "AI" if embedding_backend else "MVP (simplified for testing)",
+        "indexed_photos": metadata_store.total_entries(),
+        # With FAISS only faces not yet flushed to the on-disk indexes are held in memory
+        "faces_in_memory": face_matcher.face_count() if face_matcher else 0,
+        "faiss_enabled": faiss_store is not None,
     }
 
 
-@app.post("/index")
-async def index_event_photos(event_id: str, photo_urls: List[str]):
+def fetch_event_blob_versions(
+    event_id: str, first: Optional[str] = None, last: Optional[str] = None, page_size: Optional[int] = None
+) -> Dict[str, Tuple[Optional[int], Optional[str], Optional[int]]]:
+    """
+    Map blob name -> (generation, etag, size) for every image under an
+    event prefix, or only for names from first to last inclusive (blocking)
+    """
+    bucket = gcs.get_bucket()
+    versions = {}
+    blobs = bucket.list_blobs(
+        prefix=f"{event_id}/", start_offset=first, page_size=page_size, timeout=gcs.CALL_TIMEOUT_SECONDS
+    )
+    for blob in blobs:
+        if last is not None and blob.name > last:
+            break  # listings are sorted by name; no further page is fetched
+        if blob.name.lower().endswith(IMAGE_EXTENSIONS):
+            versions[blob.name] = (blob.generation, blob.etag, blob.size)
+    return versions
+
+
+async def plan_index_job(job: IndexJob):
+    """
+    Turn a submitted photo list into the delta that needs work.
+    
+    Photos whose blob generation/etag match the indexed entry are skipped,
+    changed ones are re-processed and replace their entry, and indexed
+    photos of the event that no longer exist in GCS are tombstoned. If GCS
+    can't be listed, photos are de-duplicated by blob name only.
+    
+    A batch of a larger run (write_manifest=false) only lists the name
+    range its photos span, so a run over contiguous batches lists the
+    event about once; photos deleted outside every batch's range are
+    tombstoned by the final /index/manifest.
+    """
+    span = (None, None)
+    page_size = None
+    if not job.options.get("write_manifest", True) and job.photo_urls:
+        keys = [metadata_key(url) for url in job.photo_urls]
+        span = (min(keys), max(keys))
+        # A contiguous batch plus the name after it, in one page
+        page_size = min(len(keys) + 1, 1000)
+    try:
+        # Each page request has its own timeout; the whole listing may take longer
+        versions = await gcs.run(fetch_event_blob_versions, job.event_id, *span, page_size, timeout=None)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not list GCS versions for {job.event_id}, skipping by name only: {e}")
+        versions = None
+    
+    # Photos whose faces never reached the on-disk index (e.g. a crash before
+    # the job's final flush) are re-processed rather than skipped
+    faiss_keys = set(await run_in_threadpool(faiss_store.row_keys, job.event_id)) if faiss_store else None
+    shard = await run_in_threadpool(metadata_store.get_shard, job.event_id)
+    
+    items = []
+    seen = set()
+    for photo_url in job.photo_urls:
+        key = metadata_key(photo_url)
+        if key in seen:
+            continue
+        seen.add(key)
+        generation, etag, size = (versions or {}).get(key, (None, None, None))
+        if versions is not None and key not in versions:
+            job.failed_photos.append({"photo_url": photo_url, "error": "Not found in GCS"})
+            continue
+        existing = shard.entries.get(key)
+        if (
+            existing is not None
+            and existing.get("generation") == generation
+            and existing.get("etag") == etag
+            and derivatives.is_current(existing.get("derivatives"))
+            and not (
+                faiss_keys is not None
+                and existing.get("faces")
+                and key not in faiss_keys
+                and not face_matcher.has_photo(job.event_id, key)
+            )
+        ):
+            job.skipped += 1
+            continue
+        items.append({"photo_url": photo_url, "key": key, "generation": generation, "etag": etag, "size": size})
+    job.items = items
+    
+    if versions is not None:
+        gone = [
+            key for key in shard.entries
+            if key not in versions and (span[0] is None or span[0] <= key <= span[1])
+        ]
+        if gone:
+            await remove_deleted_photos(job.event_id, gone)
+            job.deleted = len(gone)
+    
+    logger.info(
+        f"🔎 Job {job.job_id}: {len(items)} new/changed, {job.skipped} unchanged, "
+        f"{job.deleted} deleted photos for event {job.event_id}"
+    )
+
+
+async def remove_deleted_photos(event_id: str, keys: List[str]):
+    """Tombstone indexed photos that no longer exist in GCS and delete their derivatives"""
+    await tombstone_index_entries(event_id, keys)
+    if derivatives.enabled():
+        try:
+            await gcs.run(derivatives.delete_derivatives, keys, timeout=None)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not delete derivatives of removed photos of {event_id}: {e}")
+
+
+def index_photo(event_id: str, item: dict) -> dict:
+    """
+    Per-photo indexing work, run on an indexing worker thread.
+    The photo is downloaded to render its resized derivatives (on the
+    derivative pool, while faces are embedded) and, with an embedding
+    backend, to store its face embeddings. With neither (MVP) only the URL
+    is recorded, plus dimensions read from the image header.
+    """
+    with INDEX_PHOTO_SECONDS.time():
+        entry = {
+            "photo_url": item["photo_url"],  # dropped by the store; it keeps the blob name
+            "generation": item.get("generation"),
+            "etag": item.get("etag"),
+            "size": item.get("size"),
+        }
+        key = item.get("key") or metadata_key(item["photo_url"])
+        rendering = None
+        if embedding_backend is None and not derivatives.enabled():
+            width, height = manifest.read_header_dimensions(key)
+        else:
+            with gcs.timed("download"):
+                image_bytes = gcs.get_bucket().blob(key).download_as_bytes(timeout=gcs.CALL_TIMEOUT_SECONDS)
+            width, height = manifest.image_dimensions(image_bytes)
+            if derivatives.enabled():
+                rendering = derivatives.submit(key, image_bytes)
+        if width:
+            entry["width"], entry["height"] = width, height
+        if embedding_backend is not None:
+            embeddings = embedding_backend.embed(image_bytes)
+            entry["faces"] = len(embeddings)
+            if len(embeddings):
+                from matcher import encode_embeddings
+                
+                entry["embeddings"] = encode_embeddings(embeddings)
+        if rendering is not None:
+            entry["derivatives"] = rendering.result()
+        return entry
+
+
+def write_index_entries(event_id: str, entries: List[dict]) -> bool:
+    """
+    Add or replace finished entries in one metadata transaction (blocking).
+    Returns whether any faces were left for the event's FAISS index.
+    """
+    items = []
+    faces = []
+    for entry in entries:
+        key = metadata_key(entry["photo_url"])
+        if "embeddings" in entry:
+            from matcher import decode_embeddings
+            
+            faces.append((key, decode_embeddings(entry["embeddings"], embedding_backend.dim)))
+            if faiss_store is not None:
+                # Faces go to the event's FAISS file at the end of the job, not the metadata store
+                entry = dict(entry)
+                del entry["embeddings"]
+        items.append((key, entry))
+        log_sampled(lambda: f"  ✅ Indexed: {key}")
+    # Committed first: reloading a shard another worker changed rebuilds its faces from the store
+    with METADATA_WRITE_SECONDS.time(op="put"):
+        metadata_store.put(event_id, items)
+    for key, embeddings in faces:
+        face_matcher.add(event_id, key, embeddings)
+    logger.info(f"✅ Committed {len(items)} indexed photos for event {event_id}")
+    return faiss_store is not None and bool(faces)
+
+
+async def commit_index_entries(event_id: str, entries: List[dict]):
+    """IndexJobRunner commit hook; the write transaction runs on a worker thread"""
+    if await run_in_threadpool(write_index_entries, event_id, entries):
+        # Marked once the faces are in face_matcher, so a flush never clears the flag before exporting them
+        mark_faiss_dirty(event_id)
+    event_listing_cache.invalidate(event_id)
+
+
+def delete_index_entries(event_id: str, keys: List[str]):
+    """Remove entries for deleted GCS objects in one metadata transaction (blocking)"""
+    with METADATA_WRITE_SECONDS.time(op="delete"):
+        metadata_store.delete(event_id, keys)
+    for key in keys:
+        if face_matcher is not None:
+            face_matcher.remove(event_id, key)
+        log_sampled(lambda: f"  🗑️ Removed deleted photo: {key}")
+    logger.info(f"🗑️ Removed {len(keys)} deleted photos of event {event_id}")
+
+
+async def tombstone_index_entries(event_id: str, keys: List[str]):
+    """Tombstone deleted GCS objects; the write transaction runs on a worker thread"""
+    await run_in_threadpool(delete_index_entries, event_id, keys)
+    event_listing_cache.invalidate(event_id)
+    if faiss_store is not None:
+        mark_faiss_dirty(event_id)
+
+
+def write_event_faiss_index(event_id: str, delta_keys: List[str], delta_vectors, live_keys: Set[str]):
+    """Merge on-disk faces with newly indexed ones and rewrite the event's index (blocking)"""
+    import numpy as np
+    
+    disk_keys, disk_vectors = faiss_store.read_embeddings(event_id)
+    replaced = set(delta_keys)
+    keep = [
+        row for row, key in enumerate(disk_keys)
+        if key in live_keys and key not in replaced
+    ]
+    row_keys = [disk_keys[row] for row in keep] + list(delta_keys)
+    parts = [disk_vectors[keep]] if keep else []
+    if len(delta_keys):
+        parts.append(delta_vectors)
+    vectors = np.concatenate(parts) if parts else np.zeros((0, face_matcher.dim), dtype=np.float32)
+    faiss_store.write(event_id, row_keys, vectors)
+
+
+def mark_faiss_dirty(event_id: str):
+    """Record that an event's FAISS index is behind its metadata"""
+    dirty_faiss_events[event_id] = dirty_faiss_events.get(event_id, 0) + 1
+
+
+async def flush_event_faces(event_id: str):
+    """Persist an event's new and removed faces to its FAISS index"""
+    changes = dirty_faiss_events.get(event_id)
+    if faiss_store is None or changes is None:
+        return
+    delta_keys, delta_vectors, snapshot = await run_in_threadpool(face_matcher.export, event_id)
+    live_keys = set((await run_in_threadpool(metadata_store.get_shard, event_id)).entries)
+    await run_in_threadpool(write_event_faiss_index, event_id, delta_keys, delta_vectors, live_keys)
+    await run_in_threadpool(face_matcher.release, event_id, snapshot)
+    # Cleared only once written, and only if nothing changed after the export
+    if dirty_faiss_events.get(event_id) == changes:
+        del dirty_faiss_events[event_id]
+
+
+def build_event_clusters(event_id: str, version: int):
+    """
+    Cluster an event's live faces, read from its FAISS index (flushed by
+    now) or from face_matcher, and record them as of `version` (blocking)
+    """
+    with CLUSTER_BUILD_SECONDS.time():
+        if faiss_store is not None:
+            row_keys, vectors = faiss_store.read_embeddings(event_id)
+        else:
+            row_keys, vectors, _ = face_matcher.export(event_id)
+        cluster_store.build(event_id, row_keys, vectors, version)
+
+
+async def cluster_event_faces(event_id: str):
+    """Rebuild an event's face clusters unless they match its metadata version"""
+    if cluster_store is None or event_id in dirty_faiss_events:
+        return
+    # Read before the faces: a commit in between leaves the clusters stale, never short
+    shard = await run_in_threadpool(metadata_store.get_shard, event_id)
+    version = shard.version
+    if faiss_store is not None:
+        on_disk = set(await run_in_threadpool(faiss_store.row_keys, event_id))
+        if any(entry.get("faces") and key not in on_disk for key, entry in shard.entries.items()):
+            # Another worker hasn't flushed its faces yet; its own refresh clusters the event
+            return
+    existing = await run_in_threadpool(cluster_store.load, event_id)
+    if existing is not None and existing.version == version:
+        return
+    await run_in_threadpool(build_event_clusters, event_id, version)
+
+
+async def publish_event_manifest(event_id: str) -> dict:
+    """
+    Rebuild an event's manifest from a fresh GCS listing and its indexed
+    entries, and upload it. Indexed photos missing from the listing are
+    tombstoned first (batch jobs only sweep their own name range). Rebuilds
+    of the same event are serialized, so the manifest written last always
+    comes from the newest listing.
+    """
+    async with manifest_locks.setdefault(event_id, asyncio.Lock()):
+        # Each page request has its own timeout; the whole listing may take longer
+        versions = await gcs.run(fetch_event_blob_versions, event_id, timeout=None)
+        shard = await run_in_threadpool(metadata_store.get_shard, event_id)
+        gone = [key for key in shard.entries if key not in versions]
+        if gone:
+            await remove_deleted_photos(event_id, gone)
+            shard = await run_in_threadpool(metadata_store.get_shard, event_id)
+        event_manifest = manifest.build_manifest(event_id, versions, shard.entries, shard.version)
+        await gcs.run(manifest.write_manifest, event_manifest)
+    manifest_stats["written"] += 1
+    event_listing_cache.invalidate(event_id)
+    logger.info(f"🗂️ Wrote manifest of {event_manifest['count']} photos for event {event_id}")
+    return event_manifest
+
+
+async def refresh_event_faces(event_id: str):
+    """Flush an event's faces to its FAISS index and re-cluster them, cancelling a pending delayed refresh"""
+    pending = face_refresh_tasks.pop(event_id, None)
+    if pending is not None and pending is not asyncio.current_task():
+        pending.cancel()
+    async with face_refresh_locks.setdefault(event_id, asyncio.Lock()):
+        await flush_event_faces(event_id)
+        try:
+            await cluster_event_faces(event_id)
+        except Exception as e:
+            # /match searches the event flat until its clusters catch up
+            logger.warning(f"⚠️ Could not cluster faces of {event_id}: {e}")
+
+
+def schedule_face_refresh(event_id: str):
+    """Refresh an event's faces once no batch job has finished for it in FACE_REFRESH_DELAY_SECONDS"""
+    pending = face_refresh_tasks.pop(event_id, None)
+    if pending is not None:
+        pending.cancel()
+    
+    async def refresh_later():
+        await asyncio.sleep(FACE_REFRESH_DELAY_SECONDS)
+        try:
+            await refresh_event_faces(event_id)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not flush faces of {event_id}: {e}")
+    
+    face_refresh_tasks[event_id] = asyncio.create_task(refresh_later())
+
+
+async def finalize_index_job(job: IndexJob):
+    """
+    Flush the event's faces, cluster them and refresh its manifest. A batch
+    of a larger run (write_manifest=false) defers all of it: /index/manifest
+    does it once at the end, and workers that request never reaches flush
+    their own faces after a quiet period.
+    """
+    if not job.options.get("write_manifest", True):
+        schedule_face_refresh(job.event_id)
+        return
+    await refresh_event_faces(job.event_id)
+    try:
+        await publish_event_manifest(job.event_id)
+    except Exception as e:
+        # Listings fall back to GCS until the next successful write
+        logger.warning(f"⚠️ Could not write manifest for {job.event_id}: {e}")
+
+
+index_jobs = IndexJobRunner(
+    index_photo,
+    commit_index_entries,
+    prepare=plan_index_job,
+    finalize=finalize_index_job,
+    concurrency=INDEX_WORKER_CONCURRENCY,
+    max_retries=INDEX_MAX_RETRIES,
+    retry_backoff_seconds=INDEX_RETRY_BACKOFF_SECONDS,
+    store=job_store,
+)
+
+
+@app.post("/index", status_code=202)
+async def index_event_photos(
+    event_id: str,
+    photo_urls: List[str],
+    wait: bool = Query(False),
+    write_manifest: bool = Query(True, description="Rebuild the event's face index, clusters and manifest when the job finishes"),
+):
     """
     Index photos for an event (MVP version - stores URLs without AI)
     
+    Indexing is incremental: unchanged GCS objects are skipped, changed
+    ones replaced and deleted ones tombstoned, so re-running an event only
+    processes the delta. Enqueues a background job and returns its id immediately; poll
+    /index/jobs/{job_id} for progress. With wait=true, or always when
+    INDEX_INLINE is set (the default on Vercel, where background tasks don't
+    outlive the response), the job runs to completion inside the request
+    and the finished job is returned with status 200. A finished job rebuilds the
+    event's FAISS index, face clusters and manifest; batch indexers pass
+    write_manifest=false and call /index/manifest once at the end instead.
+    
     Args:
         event_id: Event identifier
         photo_urls: List of photo URLs from GCS
+        wait: Run the job inside the request (implied by INDEX_INLINE)
+        write_manifest: Rebuild the event's face index, clusters and manifest after the job
     
     Returns:
-        Status and number of indexed photos
+        Job id and status URL (or the finished job when wait=true)
     """
+    options = {"write_manifest": write_manifest}
     try:
-        logger.info(f"📸 Indexing {len(photo_urls)} photos for event {event_id}")
-        
-        indexed_count = 0
-        for i, photo_url in enumerate(photo_urls):
-            try:
-                # MVP: Store URL directly without face detection
-                idx = str(len(embeddings_metadata))
-                embeddings_metadata[idx] = {
-                    "photo_url": photo_url,
-                    "event_id": event_id,
-                    "indexed": True,
-                }
-                indexed_count += 1
-                logger.info(f"  ✅ Indexed: {photo_url}")
-            except Exception as e:
-                logger.error(f"  ❌ Failed to process photo: {e}")
+        if wait or INDEX_INLINE:
+            job = await index_jobs.run(index_jobs.create(event_id, photo_urls, options))
+            return JSONResponse(status_code=200, content={
+                **job.to_dict(),
+                "status": "success" if job.status == "completed" else job.status,
+                "mode": "MVP",
+            })
         
-        save_metadata()
+        job = await index_jobs.submit(event_id, photo_urls, options)
+        logger.info(f"📥 Queued job {job.job_id} for {len(photo_urls)} photos of event {event_id}")
         
         return {
-            "status": "success",
+            "status": job.status,
+            "job_id": job.job_id,
             "event_id": event_id,
-            "indexed_photos": indexed_count,
             "total_photos": len(photo_urls),
+            "status_url": f"/index/jobs/{job.job_id}",
             "mode": "MVP",
         }
         
@@ -154,152 +874,727 @@ async def index_event_photos(event_id: str, photo_urls: List[str]):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/index/manifest")
+async def rebuild_event_manifest(event_id: str = Query(..., description="Event identifier")):
+    """
+    Rebuild an event's manifest from a live GCS listing and its indexed
+    photos, then flush its faces and re-cluster them: the end-of-run step
+    for batch jobs submitted with write_manifest=false
+    """
+    try:
+        event_manifest = await publish_event_manifest(event_id)
+        await refresh_event_faces(event_id)
+    except HTTPException:
+        raise
+    except gcs.GCSTimeout as e:
+        logger.error(f"❌ Timed out writing manifest: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Failed to write manifest: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "status": "success",
+        "event_id": event_id,
+        "count": event_manifest["count"],
+        "manifest": manifest.manifest_blob_name(event_id),
+        "generated_at": event_manifest["generated_at"],
+    }
+
+
+@app.get("/index/jobs/{job_id}")
+async def get_index_job(job_id: str):
+    """
+    Progress, throughput and failed photos of an indexing job. Jobs run
+    by another worker are answered from their last saved snapshot (taken
+    after every committed chunk).
+    """
+    status = await index_jobs.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return status
+
+
 @app.post("/match")
-async def match_selfie(selfie: UploadFile = File(...), event_id: str = Query(None)):
+async def match_selfie(
+    selfie: UploadFile = File(...),
+    event_id: str = Query(None),
+    compact: bool = Query(False, description="Send base URLs once plus relative photo and thumbnail names"),
+):
     """
-    Match uploaded selfie - AI DISABLED
-    For now, returns all photos for the event (if event_id provided)
-    or all indexed photos
+    Match uploaded selfie against indexed face embeddings
+    
+    With an embedding backend configured, the selfie's faces are compared
+    against the event's faces and photos scoring at least
+    FACE_MATCH_THRESHOLD are returned, best first, along with the
+    precomputed people (face clusters) the selfie resembles. With AI disabled
+    (EMBEDDING_BACKEND=none) all photos for the event are returned.
+    
+    Uploads over SELFIE_MAX_BYTES get 413, oversized bodies before the
+    form is even parsed (UploadLimitMiddleware); when the selfie pool is
+    saturated the request gets 503 with Retry-After.
     
     Args:
-        selfie: Uploaded image file (not used when AI disabled)
+        selfie: Uploaded image file
         event_id: Optional event ID to filter photos
+        compact: Return photo and thumbnail names relative to "base_url"
+            and "thumbnail_base_urls" (relative to the bucket without event_id)
     
     Returns:
-        All photos for the event (AI matching disabled)
+        Matched photo URLs, their thumbnail URLs per size, similarity scores
+        and matching people for /people/{person_id}/photos
     """
     try:
-        contents = await selfie.read()
+        digest = hashlib.sha256()
+        try:
+            contents = await read_upload(selfie, SELFIE_MAX_BYTES, hasher=digest)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
         
         if not contents:
             raise HTTPException(status_code=400, detail="Invalid image file")
         
-        logger.info(f"📸 Selfie uploaded (AI disabled - returning all photos)")
+        if embedding_backend is None:
+            return JSONResponse(await run_in_threadpool(match_all_photos, event_id, compact))
         
-        # Get all photos, optionally filtered by event
-        if event_id:
-            all_photos = [
-                m["photo_url"] 
-                for m in embeddings_metadata.values() 
-                if m.get("event_id") == event_id
-            ]
-        else:
-            all_photos = [m["photo_url"] for m in embeddings_metadata.values()]
+        event_ids = [event_id] if event_id else metadata_store.event_ids()
+        computed = False
+        
+        async def embed_selfie():
+            nonlocal computed
+            computed = True
+            queries = await selfie_pool.run(embed_selfie_bytes, contents)
+            queries.setflags(write=False)  # shared by every request that hits the cache
+            return queries
+        
+        try:
+            # Same bytes, backend and resolution always give the same faces
+            cache_key = (embedding_backend.name, SELFIE_MAX_SIDE, digest.hexdigest())
+            queries = await selfie_embedding_cache.get_or_load(cache_key, embed_selfie)
+            matched, people = await selfie_pool.run(search_selfie, queries, event_ids) if len(queries) else ([], [])
+        except PoolSaturated:
+            logger.warning("⚠️ Selfie pool saturated, shedding /match request")
+            raise HTTPException(
+                status_code=503,
+                detail="Too many selfies being processed, retry shortly",
+                headers={"Retry-After": str(SELFIE_RETRY_AFTER_SECONDS)},
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid image file: {e}")
         
-        if not all_photos:
+        if not len(queries):
             return {
-                "status": "no_indexed_photos",
+                "status": "no_face_detected",
                 "matched_photos": [],
                 "similarity_scores": [],
                 "face_detected": False,
-                "mode": "AI_DISABLED",
-                "note": "No photos indexed. Use /list-photos endpoint to get photos directly from GCS.",
+                "embedding_cache_hit": not computed,
+                "mode": "AI",
             }
         
-        logger.info(f"✅ Returning {len(all_photos)} photos (AI disabled)")
+        logger.info(
+            f"✅ Matched {len(matched)} photos for {len(queries)} selfie face(s)"
+            f"{'' if computed else ' (cached embedding)'}"
+        )
+        
+        # JSONResponse directly: the body is plain JSON, so FastAPI's encoding pass is pure overhead
+        return JSONResponse({
+            "status": "success" if matched else "no_matches",
+            **url_fields(
+                "matched_photos",
+                [metadata_store.url_prefix + key for key, _, _ in matched],
+                thumbnail_urls([(key, sizes) for key, _, sizes in matched]),
+                compact,
+                f"{event_id}/" if event_id else "",
+            ),
+            "similarity_scores": [round(score, 4) for _, score, _ in matched],
+            "people": people,
+            "face_detected": True,
+            "embedding_cache_hit": not computed,
+            "mode": "AI",
+        })
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Matching error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def embed_selfie_bytes(contents: bytes):
+    """Selfie face embeddings (blocking, on the selfie pool)"""
+    with MATCH_SECONDS.time(stage="embed"):
+        return embedding_backend.embed(contents, SELFIE_MAX_SIDE)
+
+
+def current_clusters(event_id: str, shard: EventShard) -> Optional["EventClusters"]:
+    """An event's face clusters, if built from its current metadata version (blocking)"""
+    if cluster_store is None:
+        return None
+    clusters = cluster_store.load(event_id)
+    if clusters is None or clusters.version != shard.version:
+        return None
+    return clusters
+
+
+def search_faces(queries, event_ids: List[str]) -> List[Tuple[str, float, Optional[List[int]]]]:
+    """
+    Top (blob name, score, derivative sizes) matches across events
+    (blocking). Each event's shard is made resident before it is searched.
+    Large events with current clusters compare the selfie against the
+    centroids and re-rank only the closest clusters' members; otherwise
+    every face is searched, and with FAISS the event's on-disk index is
+    searched too (faces re-indexed since the last flush win)
+    """
+    results = []
+    with MATCH_SECONDS.time(stage="search"):
+        for ev in event_ids:
+            shard = metadata_store.get_shard(ev)
+            clusters = current_clusters(ev, shard)
+            # Mostly singleton clusters would make the first stage a flat search anyway
+            if clusters is not None and clusters.faces >= CLUSTER_SEARCH_MIN_FACES and len(clusters) <= clusters.faces // 2:
+                hits = clusters.search(queries, FACE_MATCH_TOP_K, FACE_MATCH_THRESHOLD, CLUSTER_NPROBE)
+            else:
+                hits = face_matcher.match(queries, ev, FACE_MATCH_TOP_K, FACE_MATCH_THRESHOLD)
+                if faiss_store is not None:
+                    for key, score in faiss_store.search(ev, queries, FACE_MATCH_TOP_K, FACE_MATCH_THRESHOLD):
+                        if not face_matcher.has_photo(ev, key):
+                            hits.append((key, score))
+            results.extend(
+                (key, score, shard.entries[key].get("derivatives")) for key, score in hits if key in shard.entries
+            )
+    results.sort(key=lambda r: -r[1])
+    return results[:FACE_MATCH_TOP_K]
+
+
+def match_people(queries, event_ids: List[str], limit: int = 5) -> List[dict]:
+    """People (clusters) whose centroid matches a selfie face, for the "photos of this person" lookup (blocking)"""
+    people = []
+    for ev in event_ids:
+        clusters = current_clusters(ev, metadata_store.get_shard(ev))
+        if clusters is None:
+            continue
+        counts = clusters.photo_counts()
+        for person_id, score in clusters.nearest(queries, FACE_MATCH_THRESHOLD, CLUSTER_MIN_PHOTOS):
+            people.append({
+                "event_id": ev,
+                "person_id": person_id,
+                "version": clusters.version,
+                "photo_count": counts[person_id],
+                "score": round(score, 4),
+            })
+    people.sort(key=lambda p: -p["score"])
+    return people[:limit]
+
+
+def search_selfie(queries, event_ids: List[str]) -> Tuple[List[Tuple[str, float, Optional[List[int]]]], List[dict]]:
+    """search_faces() plus match_people(), in one trip to the selfie pool (blocking)"""
+    return search_faces(queries, event_ids), match_people(queries, event_ids)
+
+
+def match_all_photos(event_id: Optional[str], compact: bool = False) -> dict:
+    """AI-disabled /match response: every photo of the event (or all photos) (blocking)"""
+    logger.info(f"📸 Selfie uploaded (AI disabled - returning all photos)")
+    
+    # Get all photos, optionally filtered by event
+    event_ids = [event_id] if event_id else metadata_store.event_ids()
+    all_photos = []
+    thumbnail_items = []
+    for ev in event_ids:
+        if metadata_store.count(ev):
+            shard = metadata_store.get_shard(ev)
+            all_photos.extend(shard.photo_urls())
+            thumbnail_items.extend((key, entry.get("derivatives")) for key, entry in shard.entries.items())
+    
+    if not all_photos:
         return {
-            "status": "success",
-            "matched_photos": all_photos,
+            "status": "no_indexed_photos",
+            "matched_photos": [],
             "similarity_scores": [],
             "face_detected": False,
             "mode": "AI_DISABLED",
-            "note": "AI face matching is currently disabled. All event photos are shown.",
+            "note": "No photos indexed. Use /list-photos endpoint to get photos directly from GCS.",
         }
-        
+    
+    logger.info(f"✅ Returning {len(all_photos)} photos (AI disabled)")
+    
+    return {
+        "status": "success",
+        **url_fields("matched_photos", all_photos, thumbnail_urls(thumbnail_items), compact, f"{event_id}/" if event_id else ""),
+        "similarity_scores": [],
+        "face_detected": False,
+        "mode": "AI_DISABLED",
+        "note": "AI face matching is currently disabled. All event photos are shown.",
+    }
+
+
+async def load_event_clusters(event_id: str) -> Tuple["EventClusters", EventShard]:
+    """An event's face clusters (current or not) and its shard, or 404"""
+    if cluster_store is None:
+        raise HTTPException(status_code=404, detail="Face clustering is disabled")
+    clusters = await run_in_threadpool(cluster_store.load, event_id)
+    if clusters is None:
+        raise HTTPException(status_code=404, detail=f"No face clusters for event {event_id}; index it first")
+    return clusters, await run_in_threadpool(metadata_store.get_shard, event_id)
+
+
+@app.get("/people")
+async def list_event_people(
+    event_id: str = Query(..., description="Event identifier"),
+    min_photos: int = Query(CLUSTER_MIN_PHOTOS, ge=1, description="Omit people found in fewer photos"),
+):
+    """
+    People (face clusters) precomputed for an event, most photographed first
+    
+    Person IDs are only valid for the returned clusters version; indexing
+    the event again rebuilds its clusters. "current" is false while the
+    event has changed since they were built.
+    """
+    clusters, shard = await load_event_clusters(event_id)
+    people = []
+    for person_id, photo_count in enumerate(clusters.photo_counts()):
+        if photo_count < min_photos:
+            continue
+        cover = next((key for key in clusters.photos(person_id) if key in shard.entries), None)
+        if cover is None:
+            continue  # every photo of this person was removed since clustering
+        people.append({
+            "person_id": person_id,
+            "photo_count": photo_count,
+            "cover_photo": shard.photo_url(cover),
+            "cover_thumbnails": photo_thumbnails(cover, shard.entries[cover].get("derivatives")),
+        })
+    people.sort(key=lambda p: -p["photo_count"])
+    return {
+        "event_id": event_id,
+        "version": clusters.version,
+        "current": clusters.version == shard.version,
+        "people": people,
+        "count": len(people),
+    }
+
+
+@app.get("/people/{person_id}/photos")
+async def get_person_photos(
+    person_id: int,
+    event_id: str = Query(..., description="Event identifier"),
+    version: Optional[int] = Query(None, description="Clusters version the person ID came from"),
+):
+    """
+    Photos of one precomputed person, without any similarity search
+    
+    Photos are ordered by how central the person's face is to the cluster.
+    Passing the version from /people or /match gets 409 once the clusters
+    have been rebuilt and the ID may name someone else.
+    """
+    clusters, shard = await load_event_clusters(event_id)
+    if version is not None and version != clusters.version:
+        raise HTTPException(
+            status_code=409, detail=f"Clusters of event {event_id} were rebuilt (version {clusters.version})"
+        )
+    if not 0 <= person_id < len(clusters):
+        raise HTTPException(status_code=404, detail=f"Unknown person {person_id} in event {event_id}")
+    keys = [key for key in clusters.photos(person_id) if key in shard.entries]
+    return {
+        "event_id": event_id,
+        "person_id": person_id,
+        "version": clusters.version,
+        "photos": [shard.photo_url(key) for key in keys],
+        "thumbnails": thumbnail_urls([(key, shard.entries[key].get("derivatives")) for key in keys]),
+        "count": len(keys),
+    }
+
+
+def iter_event_photo_pages(event_id: str, page_size: Optional[int] = None, page_token: Optional[str] = None):
+    """
+    Yield (photo_urls, next_page_token) for each GCS listing page under an
+    event prefix (blocking). Non-image blobs are filtered out, so a page can
+    hold fewer than page_size photos.
+    """
+    bucket_name = gcs.get_bucket_name()
+    
+    # Shared GCS client (built once per worker)
+    try:
+        bucket = gcs.get_bucket(bucket_name)
     except Exception as e:
-        logger.error(f"❌ Matching error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"❌ Failed to initialize GCS client: {e}")
+        raise HTTPException(status_code=500, detail=gcs.describe_init_error(e))
+    
+    # List all blobs with the event prefix
+    try:
+        blobs = bucket.list_blobs(
+            prefix=f"{event_id}/", page_size=page_size, page_token=page_token, timeout=gcs.CALL_TIMEOUT_SECONDS
+        )
+    except Exception as e:
+        logger.error(f"❌ Failed to list blobs: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to list GCS files: {str(e)}")
+    
+    for page in blobs.pages:
+        photo_urls = []
+        for blob in page:
+            # Only include image files
+            if blob.name.lower().endswith(IMAGE_EXTENSIONS):
+                # Construct public URL
+                url = f"https://storage.googleapis.com/{bucket_name}/{blob.name}"
+                photo_urls.append(url)
+                # A sample of photo URLs at debug level; one line per photo costs too much on big events
+                log_sampled(lambda: f"  📷 {url}")
+        yield photo_urls, blobs.next_page_token
+
+
+def fetch_event_photo_urls(event_id: str) -> List[str]:
+    """List image URLs under an event prefix in GCS (blocking)"""
+    photo_urls = []
+    for page_urls, _ in iter_event_photo_pages(event_id):
+        photo_urls.extend(page_urls)
+    
+    logger.info(f"📸 Found {len(photo_urls)} photos for event {event_id}")
+    return photo_urls
+
+
+def fetch_event_photo_page(event_id: str, page_size: Optional[int], page_token: Optional[str]) -> Tuple[List[str], Optional[str]]:
+    """Fetch a single listing page for cursor pagination (blocking)"""
+    for photo_urls, next_page_token in iter_event_photo_pages(event_id, page_size, page_token):
+        return photo_urls, next_page_token
+    return [], None
+
+
+LISTING_OFFSET_TOKEN = "offset:"  # page tokens into a whole-event listing; GCS tokens are opaque
+
+
+async def load_event_manifest(event_id: str) -> Optional[dict]:
+    """An event's manifest if it exists and is fresh, else None (callers then list GCS)"""
+    try:
+        event_manifest = await gcs.run(manifest.read_manifest, event_id)
+    except Exception as e:
+        manifest_stats["errors"] += 1
+        logger.warning(f"⚠️ Could not read manifest for {event_id}, listing GCS instead: {e}")
+        return None
+    if event_manifest is None:
+        manifest_stats["missing"] += 1
+        return None
+    reason = manifest.stale_reason(event_manifest, metadata_store.version(event_id))
+    if reason:
+        manifest_stats["stale"] += 1
+        logger.info(f"🗂️ Manifest for {event_id} is stale ({reason}), listing GCS instead")
+        return None
+    manifest_stats["served"] += 1
+    return event_manifest
+
+
+def manifest_listing(event_manifest: dict) -> dict:
+    url_prefix = metadata_store.url_prefix
+    keys = manifest.photo_keys(event_manifest)
+    return {
+        "photos": manifest.photo_urls(event_manifest, url_prefix),
+        "thumbnails": thumbnail_urls(
+            [(key, photo.get("derivatives")) for key, photo in zip(keys, event_manifest["photos"])]
+        ),
+        "details": manifest.photo_details(event_manifest, url_prefix),
+        "source": "manifest",
+        # A manifest is never rewritten with the same version and timestamp
+        "digest": f"{event_manifest['index_version']}:{event_manifest['generated_at']!r}",
+    }
+
+
+def live_listing(event_id: str, photo_urls: List[str]) -> dict:
+    """Listing dict for photo URLs listed from GCS; thumbnails come from the indexed entries (blocking)"""
+    entries = metadata_store.get_shard(event_id).entries if metadata_store.count(event_id) else {}
+    keys = [metadata_key(url) for url in photo_urls]
+    return {
+        "photos": photo_urls,
+        "thumbnails": thumbnail_urls([(key, entries.get(key, {}).get("derivatives")) for key in keys]),
+        "details": None,
+        "source": "listing",
+    }
+
+
+async def load_event_listing(event_id: str) -> dict:
+    """Whole-event listing: the manifest in one read when fresh, else a live GCS listing"""
+    event_manifest = await load_event_manifest(event_id)
+    if event_manifest is not None:
+        return manifest_listing(event_manifest)
+    # Each page request has its own timeout; the whole listing may take longer
+    photo_urls = await gcs.run(fetch_event_photo_urls, event_id, timeout=None)
+    return await run_in_threadpool(live_listing, event_id, photo_urls)
+
+
+async def get_event_listing(event_id: str) -> dict:
+    """Cached whole-event listing; concurrent misses share one load"""
+    return await event_listing_cache.get_or_load(event_id, lambda: load_event_listing(event_id))
+
+
+async def get_cached_or_manifest_listing(event_id: str) -> Optional[dict]:
+    """Whole-event listing if it's cached or one manifest read away, without listing GCS"""
+    listing = event_listing_cache.get(event_id)
+    if listing is None:
+        event_manifest = await load_event_manifest(event_id)
+        if event_manifest is not None:
+            listing = manifest_listing(event_manifest)
+            event_listing_cache.set(event_id, listing)
+    return listing
+
+
+LISTING_CACHE_CONTROL = "no-cache"  # clients may keep listings but revalidate them with If-None-Match
+
+
+def listing_etag(event_id: str, listing: dict, variant: str) -> str:
+    """
+    Weak ETag of a /list-photos response: the event's metadata version,
+    the listing's content digest and the response variant (flags, page)
+    """
+    digest = listing.get("digest")
+    if digest is None:
+        # Live listings are hashed once, when first revalidated or served
+        digest = listing["digest"] = hashlib.sha1("\n".join(listing["photos"]).encode()).hexdigest()
+    tag = f"{metadata_store.version(event_id)}:{listing['source']}:{digest}:{variant}"
+    return f'W/"{hashlib.sha1(tag.encode()).hexdigest()[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether If-None-Match names this ETag (weak comparison, as for GET)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def listing_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": LISTING_CACHE_CONTROL}
+
+
+def dump_json(content: dict) -> bytes:
+    """Compact JSON, as JSONResponse renders it, without FastAPI's per-field encoding pass"""
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def listing_response(event_id: str, listing: dict, details: bool, compact: bool) -> dict:
+    """/list-photos response for a listing or a page of one"""
+    response = {"status": "success", "event_id": event_id}
+    response.update(url_fields("photos", listing["photos"], listing["thumbnails"], compact, f"{event_id}/"))
+    response["count"] = len(listing["photos"])
+    response["source"] = listing["source"]
+    if details:
+        response["details"] = listing["details"]
+    return response
+
+
+def stream_lines(listing: dict) -> str:
+    """One NDJSON line per photo of a listing, with its available thumbnails"""
+    thumbnails = listing["thumbnails"]
+    lines = []
+    for i, url in enumerate(listing["photos"]):
+        photo_thumbnails = {size: urls[i] for size, urls in thumbnails.items() if urls[i]}
+        lines.append(json.dumps({"photo": url, "thumbnails": photo_thumbnails}) + "\n")
+    return "".join(lines)
+
+
+async def stream_event_photos(event_id: str):
+    """
+    NDJSON lines for an event listing: one {"photo": url, "thumbnails"}
+    per photo as each GCS page arrives, then a {"status", "count"} trailer.
+    Cached listings and fresh manifests are emitted at once; a completed
+    live stream fills the listing cache.
+    """
+    listing = await get_cached_or_manifest_listing(event_id)
+    if listing is not None:
+        photo_urls = listing["photos"]
+        yield stream_lines(listing)
+        yield json.dumps({
+            "status": "success", "event_id": event_id, "count": len(photo_urls), "source": listing["source"],
+        }) + "\n"
+        return
+
+    photo_urls = []
+    page_token = None
+    try:
+        # One GCS round trip per page, each on the GCS pool with its own timeout
+        while True:
+            page_urls, page_token = await gcs.run(fetch_event_photo_page, event_id, None, page_token)
+            photo_urls.extend(page_urls)
+            yield stream_lines(await run_in_threadpool(live_listing, event_id, page_urls))
+            if not page_token:
+                break
+    except Exception as e:
+        # Headers are already sent, so report the failure in-band
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        logger.error(f"❌ Failed to stream photos: {detail}")
+        yield json.dumps({"status": "error", "event_id": event_id, "detail": detail}) + "\n"
+        return
+
+    event_listing_cache.set(event_id, await run_in_threadpool(live_listing, event_id, photo_urls))
+    logger.info(f"📸 Streamed {len(photo_urls)} photos for event {event_id}")
+    yield json.dumps({"status": "success", "event_id": event_id, "count": len(photo_urls), "source": "listing"}) + "\n"
 
 
 @app.get("/list-photos")
-async def list_event_photos(event_id: str = Query(..., description="Event identifier")):
+async def list_event_photos(
+    request: Request,
+    event_id: str = Query(..., description="Event identifier"),
+    page_size: Optional[int] = Query(None, ge=1, le=1000, description="Return one page of at most this many blobs"),
+    page_token: Optional[str] = Query(None, description="next_page_token from a previous page"),
+    stream: bool = Query(False, description="Stream photos as NDJSON while GCS is listed"),
+    details: bool = Query(False, description="Include size, etag and dimensions when served from a manifest"),
+    compact: bool = Query(False, description="Send base URLs once plus relative photo and thumbnail names"),
+):
     """
-    List all photos for an event from GCS
+    List all photos for an event
+    
+    The event's manifest (written after indexing) is served with a single
+    GCS read; only when it's missing or stale is the event prefix listed
+    live. Full listings are cached per event for LIST_CACHE_TTL_SECONDS, and
+    concurrent misses for the same event share one load. With page_size
+    the response is a single page plus next_page_token; with stream=true
+    photos are emitted as NDJSON as each GCS page arrives.
+    
+    Responses built from a whole-event listing carry an ETag derived from
+    the event's version and the listing's content: If-None-Match gets an
+    empty 304 while neither has changed. Full response variants are kept
+    serialized, and compressed per accepted encoding, in a cache bounded by
+    LIST_BODY_CACHE_MB.
     
     Args:
         event_id: Event identifier
+        page_size: Optional page size for cursor pagination
+        page_token: Cursor returned as next_page_token
+        stream: Stream the listing as NDJSON
+        details: Add per-photo size, etag and dimensions ("details")
+        compact: Return "base_url" and "thumbnail_base_urls" once, and
+            photo and thumbnail names relative to them
     
     Returns:
-        List of photo URLs from GCS
+        Photo URLs, thumbnail URLs per derivative size (parallel lists, None
+        where not rendered), and whether they came from the manifest or a
+        live listing
     """
     try:
-        bucket_name = os.getenv("GCS_BUCKET_NAME", "event-photos-demo")
+        if stream:
+            return StreamingResponse(stream_event_photos(event_id), media_type="application/x-ndjson")
         
-        # Initialize GCS client with explicit credentials
-        try:
-            credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-            credentials = None
-            
-            # Check if credentials_path is a JSON string (Vercel environment variable)
-            if credentials_path:
+        if page_size:
+            listing = None
+            offset = 0
+            if page_token and page_token.startswith(LISTING_OFFSET_TOKEN):
                 try:
-                    # Try to parse as JSON string
-                    creds_dict = json.loads(credentials_path)
-                    # Create credentials from dict
-                    credentials = service_account.Credentials.from_service_account_info(creds_dict)
-                    logger.info("✅ Using credentials from environment variable (JSON)")
-                except (json.JSONDecodeError, TypeError):
-                    # Not JSON, try as file path
-                    if os.path.exists(credentials_path):
-                        credentials = service_account.Credentials.from_service_account_file(credentials_path)
-                        logger.info(f"✅ Using credentials from file: {credentials_path}")
-                    else:
-                        logger.warning(f"⚠️ Credentials path not found: {credentials_path}")
+                    offset = int(page_token[len(LISTING_OFFSET_TOKEN):])
+                except ValueError:
+                    raise HTTPException(status_code=400, detail="Invalid page_token")
+                listing = await get_event_listing(event_id)
+            elif not page_token:
+                listing = await get_cached_or_manifest_listing(event_id)
             
-            if credentials:
-                storage_client = storage.Client(credentials=credentials, project=credentials.project_id)
-            else:
-                # Fallback to application default credentials
-                logger.warning("⚠️ Trying application default credentials...")
-                storage_client = storage.Client()
+            if listing is None:
+                # A live GCS page: nothing stable to derive an ETag from
+                photo_urls, next_page_token = await gcs.run(fetch_event_photo_page, event_id, page_size, page_token)
+                listing = await run_in_threadpool(live_listing, event_id, photo_urls)
+                response = listing_response(event_id, listing, details, compact)
+                response["next_page_token"] = next_page_token
+                return JSONResponse(response)
             
-            bucket = storage_client.bucket(bucket_name)
-        except Exception as e:
-            logger.error(f"❌ Failed to initialize GCS client: {e}")
-            error_msg = f"GCS initialization failed. "
-            if not credentials_path:
-                error_msg += "GOOGLE_APPLICATION_CREDENTIALS not set in .env file. "
-            elif not os.path.exists(credentials_path):
-                error_msg += f"Credentials file not found: {credentials_path}. "
-            else:
-                error_msg += f"Error: {str(e)}. "
-            error_msg += "Please check your .env file and credentials.json path."
-            raise HTTPException(status_code=500, detail=error_msg)
-        
-        # List all blobs with the event prefix
-        try:
-            blobs = bucket.list_blobs(prefix=f"{event_id}/")
-        except Exception as e:
-            logger.error(f"❌ Failed to list blobs: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to list GCS files: {str(e)}")
-        
-        photo_urls = []
-        for blob in blobs:
-            # Only include image files
-            if blob.name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
-                # Construct public URL
-                url = f"https://storage.googleapis.com/{bucket_name}/{blob.name}"
-                photo_urls.append(url)
-                # Log each photo URL for easy debugging
-                logger.info(f"  📷 {url}")
+            etag = listing_etag(event_id, listing, f"page:{offset}:{page_size}:{details:d}{compact:d}")
+            if etag_matches(request, etag):
+                return Response(status_code=304, headers=listing_headers(etag))
+            end = offset + page_size
+            page = {
+                "photos": listing["photos"][offset:end],
+                "thumbnails": {size: urls[offset:end] for size, urls in listing["thumbnails"].items()},
+                "details": listing["details"][offset:end] if listing["details"] is not None else None,
+                "source": listing["source"],
+            }
+            response = listing_response(event_id, page, details, compact)
+            response["next_page_token"] = f"{LISTING_OFFSET_TOKEN}{end}" if end < len(listing["photos"]) else None
+            return Response(dump_json(response), media_type="application/json", headers=listing_headers(etag))
         
-        logger.info(f"📸 Found {len(photo_urls)} photos for event {event_id}")
-        
-        return {
-            "status": "success",
-            "event_id": event_id,
-            "photos": photo_urls,
-            "count": len(photo_urls),
-        }
+        listing = await get_event_listing(event_id)
+        variant = f"full:{details:d}{compact:d}"
+        etag = listing_etag(event_id, listing, variant)
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=listing_headers(etag))
+        body = listing_body_cache.get((event_id, etag, None))
+        if body is None:
+            body = dump_json(listing_response(event_id, listing, details, compact))
+            listing_body_cache.set((event_id, etag, None), body)
+        headers = listing_headers(etag)
+        encoding = compression.negotiate(request.headers.get("accept-encoding", ""), len(body))
+        if encoding:
+            # Kept encoded too, so repeated gallery loads skip compression as well as serialization
+            encoded = listing_body_cache.get((event_id, etag, encoding))
+            if encoded is None:
+                encoded = compression.compress(body, encoding)
+                listing_body_cache.set((event_id, etag, encoding), encoded)
+            body = encoded
+            headers.update({"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+        return Response(body, media_type="application/json", headers=headers)
         
     except HTTPException:
         raise
+    except gcs.GCSTimeout as e:
+        logger.error(f"❌ Timed out listing photos: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"❌ Failed to list photos: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def parse_photo_url(photo_url: str) -> str:
+    """Extract the blob name from a public GCS photo URL"""
+    bucket_name = gcs.get_bucket_name()
+    parsed = urlparse(photo_url)
+    # Expect path like "/<bucket>/<blob-name>"
+    path_parts = parsed.path.lstrip("/").split("/", 1)
+    if len(path_parts) != 2 or not path_parts[1]:
+        raise ValueError("Invalid GCS URL path format")
+
+    bucket_from_url, blob_name = path_parts
+    if bucket_from_url != bucket_name:
+        logger.warning(
+            f"Bucket in URL ({bucket_from_url}) does not match configured bucket ({bucket_name}). "
+            "Using configured bucket."
+        )
+    return blob_name
+
+
+def sign_download_url(blob_name: str) -> Tuple[str, float]:
+    """
+    Return a V4 signed download URL for a blob and its expiry (epoch seconds).
+
+    Signing happens locally with the cached service account credentials.
+    A previously issued URL is reused while it has more than
+    SIGNED_URL_REUSE_MARGIN_SECONDS of validity left.
+    """
+    cached = signed_url_cache.get(blob_name)
+    if cached is not None:
+        return cached
+
+    # Shared GCS client (built once per worker)
+    try:
+        blob = gcs.get_bucket().blob(blob_name)
+    except Exception as e:
+        logger.error(f"❌ Failed to initialize GCS client or blob for download: {e}")
+        raise HTTPException(status_code=500, detail="Failed to initialize GCS client for download")
+
+    # Derive a nice filename from the blob name (last path segment)
+    filename = os.path.basename(blob_name) if "/" in blob_name else blob_name
+
+    try:
+        expires_at = time.time() + SIGNED_URL_EXPIRY_SECONDS
+        with SIGNING_SECONDS.time():
+            signed_url = blob.generate_signed_url(
+                version="v4",
+                expiration=timedelta(seconds=SIGNED_URL_EXPIRY_SECONDS),
+                method="GET",
+                response_disposition=f'attachment; filename="{filename}"',
+            )
+    except Exception as e:
+        logger.error(f"❌ Failed to generate signed URL: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate signed download URL")
+
+    signed_url_cache.set(blob_name, (signed_url, expires_at))
+    return signed_url, expires_at
+
+
 @app.get("/download-photo")
 async def generate_download_url(
     photo_url: str = Query(..., description="Public GCS photo URL to generate a signed download URL for"),
@@ -312,99 +1607,203 @@ async def generate_download_url(
     in a new tab.
     """
     try:
-        bucket_name = os.getenv("GCS_BUCKET_NAME", "event-photos-demo")
-
         # Parse the GCS URL to extract the bucket and blob name
         try:
-            parsed = urlparse(photo_url)
-            # Expect path like "/<bucket>/<blob-name>"
-            path_parts = parsed.path.lstrip("/").split("/", 1)
-            if len(path_parts) != 2:
-                raise ValueError("Invalid GCS URL path format")
-
-            bucket_from_url, blob_name = path_parts
-            if bucket_from_url != bucket_name:
-                logger.warning(
-                    f"Bucket in URL ({bucket_from_url}) does not match configured bucket ({bucket_name}). "
-                    "Using configured bucket."
-                )
+            blob_name = parse_photo_url(photo_url)
         except Exception as e:
             logger.error(f"❌ Failed to parse photo_url '{photo_url}': {e}")
             raise HTTPException(status_code=400, detail="Invalid photo_url format")
 
-        # Initialize GCS client (reuse the same pattern as list-photos)
-        try:
-            credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-            credentials = None
-
-            if credentials_path:
-                try:
-                    creds_dict = json.loads(credentials_path)
-                    credentials = service_account.Credentials.from_service_account_info(creds_dict)
-                    logger.info("✅ Using credentials from environment variable (JSON)")
-                except (json.JSONDecodeError, TypeError):
-                    if os.path.exists(credentials_path):
-                        credentials = service_account.Credentials.from_service_account_file(credentials_path)
-                        logger.info(f"✅ Using credentials from file: {credentials_path}")
-                    else:
-                        logger.warning(f"⚠️ Credentials path not found: {credentials_path}")
-
-            if credentials:
-                storage_client = storage.Client(credentials=credentials, project=credentials.project_id)
-            else:
-                logger.warning("⚠️ Trying application default credentials for signed URL generation...")
-                storage_client = storage.Client()
+        signed_url, _ = await gcs.run(sign_download_url, blob_name)
+        return {"signed_url": signed_url}
 
-            bucket = storage_client.bucket(bucket_name)
-            blob = bucket.blob(blob_name)
-        except Exception as e:
-            logger.error(f"❌ Failed to initialize GCS client or blob for download: {e}")
-            raise HTTPException(status_code=500, detail="Failed to initialize GCS client for download")
+    except HTTPException:
+        raise
+    except gcs.GCSTimeout as e:
+        logger.error(f"❌ Timed out signing download URL: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Unexpected error in /download-photo: {e}")
+        raise HTTPException(status_code=500, detail="Unexpected error generating download URL")
 
-        # Derive a nice filename from the blob name (last path segment)
-        filename = os.path.basename(blob_name) if "/" in blob_name else blob_name
 
+def sign_download_urls(photo_urls: List[str]) -> dict:
+    """Sign a batch of photo URLs, collecting per-photo failures"""
+    signed = []
+    failed = []
+    for photo_url in photo_urls:
         try:
-            signed_url = blob.generate_signed_url(
-                version="v4",
-                expiration=timedelta(minutes=10),
-                method="GET",
-                response_disposition=f'attachment; filename="{filename}"',
+            blob_name = parse_photo_url(photo_url)
+        except Exception:
+            failed.append({"photo_url": photo_url, "error": "Invalid photo_url format"})
+            continue
+        try:
+            signed_url, expires_at = sign_download_url(blob_name)
+        except HTTPException as e:
+            failed.append({"photo_url": photo_url, "error": e.detail})
+            continue
+        signed.append({
+            "photo_url": photo_url,
+            "signed_url": signed_url,
+            "expires_at": int(expires_at),
+        })
+    return {"signed_urls": signed, "failed": failed}
+
+
+@app.post("/download-photos")
+async def generate_download_urls(
+    photo_urls: Optional[List[str]] = Body(None, description="Public GCS photo URLs to sign"),
+    event_id: Optional[str] = Body(None, description="Sign every photo of this event instead"),
+):
+    """
+    Generate signed download URLs for many photos in one round trip.
+
+    Pass either photo_urls or event_id. Per-photo failures are reported
+    in "failed" rather than failing the whole batch.
+    """
+    try:
+        if event_id and not photo_urls:
+            photo_urls = (await get_event_listing(event_id))["photos"]
+        if not photo_urls:
+            raise HTTPException(status_code=400, detail="Provide photo_urls or event_id")
+        if len(photo_urls) > DOWNLOAD_BATCH_MAX:
+            raise HTTPException(
+                status_code=413,
+                detail=f"At most {DOWNLOAD_BATCH_MAX} photos can be signed per request",
             )
-        except Exception as e:
-            logger.error(f"❌ Failed to generate signed URL: {e}")
-            raise HTTPException(status_code=500, detail="Failed to generate signed download URL")
 
-        return {"signed_url": signed_url}
+        # Signing is local CPU work that grows with the batch, so no call timeout
+        result = await gcs.run(sign_download_urls, photo_urls, timeout=None)
+        logger.info(f"🔏 Signed {len(result['signed_urls'])}/{len(photo_urls)} download URLs")
+
+        return {
+            "status": "success",
+            "count": len(result["signed_urls"]),
+            **result,
+        }
 
     except HTTPException:
         raise
+    except gcs.GCSTimeout as e:
+        logger.error(f"❌ Timed out listing photos to sign: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        logger.error(f"❌ Unexpected error in /download-photo: {e}")
-        raise HTTPException(status_code=500, detail="Unexpected error generating download URL")
+        logger.error(f"❌ Unexpected error in /download-photos: {e}")
+        raise HTTPException(status_code=500, detail="Unexpected error generating download URLs")
+
+
+@app.get("/startup-profile")
+async def get_startup_profile():
+    """Cold-start timings: module import, each startup step, and the budget"""
+    total = startup_profile["import_seconds"] + (startup_profile["startup_seconds"] or 0)
+    return {
+        **startup_profile,
+        "total_seconds": round(total, 4),
+        "budget_seconds": COLD_START_BUDGET_SECONDS,
+        "within_budget": total <= COLD_START_BUDGET_SECONDS,
+    }
+
+
+def register_gauges():
+    """Index-size, cache and pool gauges, read when /metrics is scraped"""
+    gauge = metrics.REGISTRY.gauge
+    gauge("indexed_photos", "Indexed photos across all events", metadata_store.total_entries)
+    gauge(
+        "faces_in_memory", "Face embeddings held in memory (with FAISS, those not yet flushed to disk)",
+        lambda: face_matcher.face_count() if face_matcher else 0,
+    )
+    metrics.stats_gauges(
+        "metadata", "Metadata store", {"sqlite": metadata_store.stats},
+        [("resident_events", "gauge"), ("resident_bytes", "gauge"), ("file_bytes", "gauge"),
+         ("hits", "counter"), ("misses", "counter"), ("reloads", "counter"), ("evictions", "counter")],
+        "store",
+    )
+    metrics.stats_gauges(
+        "cache", "In-process cache",
+        {
+            "list": event_listing_cache.stats,
+            "list_body": listing_body_cache.stats,
+            "signed_url": signed_url_cache.stats,
+            "selfie_embedding": selfie_embedding_cache.stats,
+        },
+        [("entries", "gauge"), ("bytes", "gauge"), ("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("coalesced", "counter")],
+        "cache",
+    )
+    metrics.stats_gauges(
+        "pool", "Worker pool", {"selfie": selfie_pool.stats, "gcs": gcs.stats},
+        [("in_flight", "gauge"), ("completed", "counter"), ("failed", "counter"), ("timeouts", "counter"),
+         ("rejected", "counter")],
+        "pool",
+    )
+    gauge(
+        "index_jobs", "Indexing jobs by status",
+        lambda: {(status,): sum(1 for job in index_jobs.jobs.values() if job.status == status)
+                 for status in ("queued", "running", "completed", "failed")},
+        ("status",),
+    )
+    gauge(
+        "manifest_operations_total", "Manifest reads by result (served, missing, stale, errors) and writes",
+        lambda: {(result,): count for result, count in manifest_stats.items()}, ("result",), kind="counter",
+    )
+    gauge("derivatives_rendered_total", "Photos whose derivatives were rendered", lambda: derivatives.stats()["rendered"], kind="counter")
+
+
+register_gauges()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Latency histograms, GCS counters and index/cache gauges in Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/status")
 async def get_status():
     """Get current indexing status"""
-    unique_photos = set(m.get("photo_url") for m in embeddings_metadata.values())
+    total_entries = metadata_store.total_entries()
     return {
         "status": "ready",
         "mode": "MVP",
-        "indexed_unique_photos": len(unique_photos),
-        "total_entries": len(embeddings_metadata),
+        # Entries are keyed by blob name, so every entry is a unique photo
+        "indexed_unique_photos": total_entries,
+        "total_entries": total_entries,
+        "metadata_shards": metadata_store.stats(),
+        "list_cache": event_listing_cache.stats(),
+        "list_body_cache": listing_body_cache.stats(),
+        "manifests": dict(manifest_stats),
+        "signed_url_cache": signed_url_cache.stats(),
+        "selfie_pool": selfie_pool.stats(),
+        "derivatives": derivatives.stats(),
+        "face_clusters": cluster_store.stats() if cluster_store is not None else None,
+        "gcs": gcs.stats(),
+        "selfie_embedding_cache": selfie_embedding_cache.stats(),
     }
 
 
 @app.post("/demo/reset")
 async def reset_index():
     """Reset index (for demo purposes)"""
-    global embeddings_metadata
-    embeddings_metadata = {}
-    if os.path.exists(EMBEDDINGS_METADATA_PATH):
+    # Pending refreshes would flush and cluster faces of the old index
+    for task in face_refresh_tasks.values():
+        task.cancel()
+    face_refresh_tasks.clear()
+    await run_in_threadpool(metadata_store.reset)
+    await run_in_threadpool(job_store.clear)
+    index_jobs.jobs.clear()
+    if face_matcher is not None:
+        face_matcher.clear()
+    event_listing_cache.clear()
+    listing_body_cache.clear()
+    selfie_embedding_cache.clear()
+    dirty_faiss_events.clear()
+    if faiss_store is not None:
+        faiss_store.clear()
+    if cluster_store is not None:
+        cluster_store.clear()
+    if os.path.exists(LEGACY_METADATA_PATH):
         try:
-            os.remove(EMBEDDINGS_METADATA_PATH)
-        except:
+            os.remove(LEGACY_METADATA_PATH)
+        except Exception:
             pass
     logger.info("✅ Index reset")
     return {"status": "reset"}
@@ -414,14 +1813,5 @@ if __name__ == "__main__":
     import uvicorn
     logger.info("🚀 Running Event Photo Gallery API in MVP Mode")
     logger.info("📝 This is a simplified version for quick testing")
-    logger.info("📝 For production: Install insightface and faiss-cpu for AI face matching")
+    logger.info("📝 For production: Install insightface and set EMBEDDING_BACKEND=insightface for AI face matching")
     uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
-
-def initialize_face_analyzer():
-    """Placeholder - not used in MVP mode"""
-    pass
-
-
-def initialize_faiss_index():
-    """Placeholder - not used in MVP mode"""
-    pass
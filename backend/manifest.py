@@ -0,0 +1,182 @@
+"""
+Precomputed per-event photo manifests
+After indexing, an event's photo list (byte size, etag, generation and,
+when known, pixel dimensions and rendered derivative sizes) is written to
+GCS as a single JSON object, so /list-photos can serve a whole event with
+one object read instead of paging list_blobs over the event prefix.
+
+A manifest records the metadata-store version of its event when it was
+built. Every write to the event (indexed, re-indexed or tombstoned
+photos, a reset) bumps that version, which makes the manifest stale;
+callers then fall back to a live listing. A manifest is otherwise served
+for as long as the event is unchanged, so a listing stays one object read
+until the next index run.
+
+Photos uploaded to GCS without going through /index aren't in the
+manifest until the event is indexed again. Deployments that upload that
+way can set MANIFEST_MAX_AGE_SECONDS to bound how long they stay
+invisible (0, the default, means no age limit).
+"""
+
+import importlib.util
+import io
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import gcs
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMAT = 1
+MANIFEST_PREFIX = os.getenv("MANIFEST_PREFIX", "_manifests/")  # outside every event folder
+MANIFEST_MAX_AGE_SECONDS = float(os.getenv("MANIFEST_MAX_AGE_SECONDS", "0"))  # 0: no age limit
+HEADER_BYTES = int(os.getenv("MANIFEST_HEADER_BYTES", str(64 * 1024)))  # 0: don't read dimensions
+PIL_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+
+def manifest_blob_name(event_id: str) -> str:
+    return f"{MANIFEST_PREFIX}{event_id}.json"
+
+
+def image_dimensions(data: bytes) -> Tuple[Optional[int], Optional[int]]:
+    """
+    (width, height) of an image as displayed, i.e. after EXIF rotation
+
+    Only the header is parsed, so a truncated download of the first
+    HEADER_BYTES is enough. Returns (None, None) when the size can't be read.
+    """
+    if not PIL_AVAILABLE:
+        return None, None
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+            try:
+                orientation = img.getexif().get(0x0112)
+            except Exception:
+                orientation = None
+    except Exception:
+        return None, None
+    if orientation in (5, 6, 7, 8):  # stored rotated by 90°
+        width, height = height, width
+    return width, height
+
+
+def read_header_dimensions(blob_name: str) -> Tuple[Optional[int], Optional[int]]:
+    """Dimensions from a ranged read of the first HEADER_BYTES of a blob (blocking)"""
+    if not HEADER_BYTES or not PIL_AVAILABLE:
+        return None, None
+    blob = gcs.get_bucket().blob(blob_name)
+    with gcs.timed("download_header"):
+        data = blob.download_as_bytes(start=0, end=HEADER_BYTES - 1, timeout=gcs.CALL_TIMEOUT_SECONDS)
+    return image_dimensions(data)
+
+
+def build_manifest(
+    event_id: str,
+    versions: Dict[str, Tuple[Optional[int], Optional[str], Optional[int]]],
+    entries: Dict[str, dict],
+    index_version: int,
+) -> dict:
+    """
+    Manifest for an event from a live listing (blob name -> (generation,
+    etag, size)) and its indexed metadata entries. Dimensions and
+    derivatives are taken from entries whose generation still matches the
+    listed object.
+    """
+    folder = f"{event_id}/"
+    photos = []
+    for name in sorted(versions):
+        generation, etag, size = versions[name]
+        photo = {
+            "name": name[len(folder):] if name.startswith(folder) else name,
+            "size": size,
+            "etag": etag,
+            "generation": generation,
+        }
+        entry = entries.get(name)
+        if entry is not None and entry.get("generation") == generation:
+            if entry.get("width"):
+                photo["width"] = entry["width"]
+                photo["height"] = entry["height"]
+            if entry.get("derivatives"):
+                photo["derivatives"] = entry["derivatives"]
+        photos.append(photo)
+    return {
+        "format": MANIFEST_FORMAT,
+        "event_id": event_id,
+        "index_version": index_version,
+        "generated_at": time.time(),
+        "count": len(photos),
+        "photos": photos,
+    }
+
+
+def write_manifest(manifest: dict):
+    """Upload an event's manifest, replacing the previous one (blocking)"""
+    blob = gcs.get_bucket().blob(manifest_blob_name(manifest["event_id"]))
+    blob.upload_from_string(
+        json.dumps(manifest, separators=(",", ":")),
+        content_type="application/json",
+        timeout=gcs.CALL_TIMEOUT_SECONDS,
+    )
+
+
+def read_manifest(event_id: str) -> Optional[dict]:
+    """An event's manifest, or None if it has none or it's unreadable (blocking)"""
+    blob = gcs.get_bucket().blob(manifest_blob_name(event_id))
+    try:
+        data = blob.download_as_bytes(timeout=gcs.CALL_TIMEOUT_SECONDS)
+    except Exception as e:
+        if gcs.is_not_found(e):
+            return None
+        raise
+    try:
+        manifest = json.loads(data)
+    except ValueError as e:
+        logger.warning(f"⚠️ Ignoring corrupt manifest for {event_id}: {e}")
+        return None
+    if manifest.get("format") != MANIFEST_FORMAT or manifest.get("event_id") != event_id:
+        return None
+    return manifest
+
+
+def stale_reason(manifest: dict, index_version: int, max_age_seconds: float = MANIFEST_MAX_AGE_SECONDS) -> Optional[str]:
+    """Why a manifest can't be served, or None if it's fresh"""
+    if index_version > manifest.get("index_version", 0):
+        return "event re-indexed since it was written"
+    age = time.time() - manifest.get("generated_at", 0)
+    if max_age_seconds and age > max_age_seconds:
+        return f"{age:.0f}s old"
+    return None
+
+
+def photo_keys(manifest: dict) -> List[str]:
+    """Blob names of a manifest's photos"""
+    folder = f"{manifest['event_id']}/"
+    return [folder + photo["name"] for photo in manifest["photos"]]
+
+
+def photo_urls(manifest: dict, url_prefix: str) -> List[str]:
+    """Public URLs of a manifest's photos"""
+    folder = f"{url_prefix}{manifest['event_id']}/"
+    return [folder + photo["name"] for photo in manifest["photos"]]
+
+
+def photo_details(manifest: dict, url_prefix: str) -> List[dict]:
+    """Per-photo URL, size, etag and (when known) dimensions"""
+    folder = f"{url_prefix}{manifest['event_id']}/"
+    return [
+        {
+            "photo_url": folder + photo["name"],
+            "size": photo.get("size"),
+            "etag": photo.get("etag"),
+            "width": photo.get("width"),
+            "height": photo.get("height"),
+        }
+        for photo in manifest["photos"]
+    ]
@@ -0,0 +1,390 @@
+"""
+Face matching engine
+Per-event face embeddings live in one contiguous matrix; a selfie is
+matched with a single batched cosine-similarity pass plus argpartition top-k
+"""
+
+import copy
+import hashlib
+import io
+import logging
+import threading
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 512
+SEARCH_CHUNK_ROWS = 2048  # float16 matrices are upcast to float32 in cache-sized chunks of this many rows
+
+# Per-thread score and upcast buffers reused across searches
+_scratch = threading.local()
+
+
+def _scratch_buffer(name: str, shape: Tuple[int, ...]) -> np.ndarray:
+    """A float32 buffer of at least shape's size, kept for this thread's next search"""
+    size = int(np.prod(shape))
+    buffer = getattr(_scratch, name, None)
+    if buffer is None or buffer.size < size:
+        buffer = np.empty(max(size, 2 * (0 if buffer is None else buffer.size)), dtype=np.float32)
+        setattr(_scratch, name, buffer)
+    return buffer[:size].reshape(shape)
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so a dot product is a cosine similarity"""
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+class EmbeddingBackend:
+    """Turns image bytes into one L2-normalized embedding per detected face"""
+
+    name = "base"
+    dim = EMBEDDING_DIM
+
+    def load(self, image_bytes: bytes, max_side: Optional[int] = None):
+        """Decode an image, downscaled so its longer side is at most max_side"""
+        return image_bytes
+
+    def embed_image(self, image) -> np.ndarray:
+        """Return a (faces, dim) float32 array; zero rows if no face was found"""
+        raise NotImplementedError
+
+    def embed(self, image_bytes: bytes, max_side: Optional[int] = None) -> np.ndarray:
+        return self.embed_image(self.load(image_bytes, max_side))
+
+
+class HashEmbeddingBackend(EmbeddingBackend):
+    """
+    Deterministic offline backend: every image is treated as one face whose
+    embedding is derived from the content hash. Identical bytes always give
+    identical embeddings, so the engine can be exercised without a model.
+    """
+
+    name = "hash"
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def embed_image(self, image_bytes: bytes) -> np.ndarray:
+        # Works on the raw bytes, so there is nothing to decode or downscale
+        if not image_bytes:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        seed = int.from_bytes(hashlib.sha256(image_bytes).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return normalize(vector)
+
+
+class InsightFaceBackend(EmbeddingBackend):
+    """insightface detector + ArcFace embeddings, loaded on first use"""
+
+    name = "insightface"
+
+    def __init__(self, model_name: str = "buffalo_l", det_size: Tuple[int, int] = (640, 640)):
+        self.model_name = model_name
+        self.det_size = det_size
+        self._app = None
+        self._lock = threading.Lock()
+
+    def _analyzer(self):
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    from insightface.app import FaceAnalysis
+
+                    app = FaceAnalysis(name=self.model_name, providers=["CPUExecutionProvider"])
+                    app.prepare(ctx_id=-1, det_size=self.det_size)
+                    self._app = app
+                    logger.info(f"✅ Loaded face analyzer ({self.model_name})")
+        return self._app
+
+    def load(self, image_bytes: bytes, max_side: Optional[int] = None) -> np.ndarray:
+        """
+        Decode to a BGR array. JPEGs are decoded at a reduced DCT scale
+        (Pillow draft mode), so a 12 MP phone photo is never fully
+        materialized when the detector only needs ~640 px.
+        """
+        from PIL import Image, ImageOps
+
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            if max_side:
+                image.draft("RGB", (max_side, max_side))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+        except Exception as e:
+            raise ValueError(f"Could not decode image: {e}")
+        if max_side:
+            image.thumbnail((max_side, max_side))
+        return np.ascontiguousarray(np.asarray(image)[:, :, ::-1])
+
+    def embed_image(self, image: np.ndarray) -> np.ndarray:
+        faces = self._analyzer().get(image)
+        if not faces:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return normalize(np.stack([face.normed_embedding for face in faces]))
+
+
+EMBEDDING_BACKENDS = {
+    "hash": HashEmbeddingBackend,
+    "insightface": InsightFaceBackend,
+}
+
+
+def create_embedding_backend(name: Optional[str]) -> Optional[EmbeddingBackend]:
+    """Build the configured backend; None/"none" disables face matching"""
+    if not name or name == "none":
+        return None
+    try:
+        return EMBEDDING_BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown embedding backend '{name}' (choose from {sorted(EMBEDDING_BACKENDS)})")
+
+
+class EventFaceMatrix:
+    """
+    All face embeddings of one event in a contiguous (capacity, dim) matrix
+
+    Rows are appended with amortized doubling; removed photos are masked out
+    and the matrix is compacted once dead rows exceed a quarter of it.
+    """
+
+    def __init__(self, dim: int, dtype=np.float32):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.matrix = np.zeros((0, dim), dtype=self.dtype)
+        self.row_photo = np.zeros(0, dtype=np.int64)  # row -> photo slot
+        self.alive = np.zeros(0, dtype=bool)
+        self.size = 0
+        self.dead = 0
+        self.photo_keys: List[Hashable] = []  # photo slot -> photo key
+        self.photo_rows: Dict[Hashable, np.ndarray] = {}  # photo key -> row numbers
+
+    def __len__(self) -> int:
+        return self.size - self.dead
+
+    def _reserve(self, rows: int):
+        needed = self.size + rows
+        if needed <= len(self.matrix):
+            return
+        capacity = max(needed, 2 * len(self.matrix), 64)
+        matrix = np.zeros((capacity, self.dim), dtype=self.dtype)
+        matrix[: self.size] = self.matrix[: self.size]
+        row_photo = np.zeros(capacity, dtype=np.int64)
+        row_photo[: self.size] = self.row_photo[: self.size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: self.size] = self.alive[: self.size]
+        self.matrix, self.row_photo, self.alive = matrix, row_photo, alive
+
+    def add(self, photo_key: Hashable, embeddings: np.ndarray):
+        """Add (or replace) the faces of one photo"""
+        self.remove(photo_key)
+        embeddings = normalize(embeddings)
+        if not len(embeddings):
+            return
+        self._reserve(len(embeddings))
+        slot = len(self.photo_keys)
+        self.photo_keys.append(photo_key)
+        rows = np.arange(self.size, self.size + len(embeddings))
+        self.matrix[rows] = embeddings.astype(self.dtype)
+        self.row_photo[rows] = slot
+        self.alive[rows] = True
+        self.photo_rows[photo_key] = rows
+        self.size += len(embeddings)
+
+    def remove(self, photo_key: Hashable):
+        """Mask out the faces of one photo"""
+        rows = self.photo_rows.pop(photo_key, None)
+        if rows is None:
+            return
+        self.alive[rows] = False
+        self.dead += len(rows)
+        if self.dead > max(64, self.size // 4):
+            self.compact()
+
+    def compact(self):
+        """Drop dead rows and unused photo slots"""
+        live = np.flatnonzero(self.alive[: self.size])
+        keys = list(self.photo_rows)
+        slot_of = {key: slot for slot, key in enumerate(keys)}
+        slot_remap = np.array([slot_of.get(key, -1) for key in self.photo_keys], dtype=np.int64)
+        row_remap = np.full(self.size, -1, dtype=np.int64)
+        row_remap[live] = np.arange(len(live))
+
+        self.matrix = np.ascontiguousarray(self.matrix[live])
+        self.row_photo = slot_remap[self.row_photo[live]] if len(live) else np.zeros(0, dtype=np.int64)
+        self.alive = np.ones(len(live), dtype=bool)
+        self.photo_keys = keys
+        self.photo_rows = {key: row_remap[rows] for key, rows in self.photo_rows.items()}
+        self.size = len(live)
+        self.dead = 0
+
+    def snapshot(self) -> "EventFaceMatrix":
+        """
+        Read-only view to search without holding the owner's lock. Rows
+        past size are the only ones add() writes in place, and compact()
+        and growth swap in new arrays, so those are shared; only the alive
+        mask, which remove() clears in place, is copied.
+        """
+        view = copy.copy(self)
+        view.alive = self.alive[: self.size].copy()
+        return view
+
+    def similarities(self, queries: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Best cosine similarity of any query face against every row (dead
+        rows included), written into out when given
+        """
+        matrix = self.matrix[: self.size]
+        scores = np.empty(self.size, dtype=np.float32) if out is None else out
+        single = len(queries) == 1
+        # One query is a matrix-vector product written straight into scores
+        products = scores if single else _scratch_buffer("products", (self.size, len(queries)))
+        weights = queries[0] if single else queries.T
+        if self.dtype == np.float32:
+            np.matmul(matrix, weights, out=products)
+        else:
+            upcast = _scratch_buffer("upcast", (min(self.size, SEARCH_CHUNK_ROWS), self.dim))
+            for start in range(0, self.size, SEARCH_CHUNK_ROWS):
+                chunk = matrix[start:start + SEARCH_CHUNK_ROWS]
+                np.copyto(upcast[: len(chunk)], chunk)
+                np.matmul(upcast[: len(chunk)], weights, out=products[start:start + len(chunk)])
+        if not single:
+            products.max(axis=1, out=scores)
+        return scores
+
+    def search(self, queries: np.ndarray, top_k: int, threshold: float) -> List[Tuple[Hashable, float]]:
+        """Top-k photos (best face per photo) with similarity >= threshold"""
+        if not len(self):
+            return []
+        queries = normalize(queries)
+        # Negated in place so argpartition's smallest are the best rows; dead rows sort last
+        costs = self.similarities(queries, out=_scratch_buffer("scores", (self.size,)))
+        np.negative(costs, out=costs)
+        if self.dead:
+            costs[~self.alive[: self.size]] = np.inf
+
+        # Over-fetch rows so photos with several matching faces still fill top_k
+        k = min(self.size, top_k * 4)
+        if k < self.size:
+            candidates = np.argpartition(costs, k - 1)[:k]
+        else:
+            candidates = np.arange(self.size)
+        candidates = candidates[costs[candidates] <= -threshold]
+        candidates = candidates[np.argsort(costs[candidates], kind="stable")]
+
+        results = []
+        seen = set()
+        for row in candidates:
+            slot = self.row_photo[row]
+            if slot in seen:
+                continue
+            seen.add(slot)
+            results.append((self.photo_keys[slot], -float(costs[row])))
+            if len(results) >= top_k:
+                break
+        return results
+
+
+class FaceMatcher:
+    """Per-event face matrices behind /match"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM, dtype=np.float32):
+        self.dim = dim
+        self.dtype = dtype
+        self.events: Dict[str, EventFaceMatrix] = {}
+        self._lock = threading.Lock()
+
+    def add(self, event_id: str, photo_key: Hashable, embeddings: np.ndarray):
+        with self._lock:
+            matrix = self.events.get(event_id)
+            if matrix is None:
+                matrix = self.events[event_id] = EventFaceMatrix(self.dim, self.dtype)
+            matrix.add(photo_key, embeddings)
+
+    def remove(self, event_id: str, photo_key: Hashable):
+        with self._lock:
+            matrix = self.events.get(event_id)
+            if matrix is not None:
+                matrix.remove(photo_key)
+
+    @property
+    def itemsize(self) -> int:
+        return np.dtype(self.dtype).itemsize
+
+    def drop_event(self, event_id: str):
+        with self._lock:
+            self.events.pop(event_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+
+    def export(self, event_id: str) -> Tuple[List[Hashable], np.ndarray, Dict[Hashable, np.ndarray]]:
+        """
+        Copy of an event's live faces: (row keys, float32 embeddings, photo
+        rows snapshot). The snapshot lets a caller release exactly the
+        photos it persisted via release().
+        """
+        with self._lock:
+            matrix = self.events.get(event_id)
+            if matrix is None or not len(matrix):
+                return [], np.zeros((0, self.dim), dtype=np.float32), {}
+            live = np.flatnonzero(matrix.alive[: matrix.size])
+            row_keys = [matrix.photo_keys[slot] for slot in matrix.row_photo[live]]
+            return row_keys, matrix.matrix[live].astype(np.float32), dict(matrix.photo_rows)
+
+    def release(self, event_id: str, snapshot: Dict[Hashable, np.ndarray]):
+        """Drop photos from an export() snapshot that haven't changed since"""
+        with self._lock:
+            matrix = self.events.get(event_id)
+            if matrix is None:
+                return
+            for key, rows in snapshot.items():
+                if matrix.photo_rows.get(key) is rows:
+                    matrix.remove(key)
+            if not len(matrix):
+                del self.events[event_id]
+
+    def has_photo(self, event_id: str, photo_key: Hashable) -> bool:
+        matrix = self.events.get(event_id)
+        return matrix is not None and photo_key in matrix.photo_rows
+
+    def face_count(self, event_id: Optional[str] = None) -> int:
+        if event_id is not None:
+            return len(self.events.get(event_id, ()))
+        return sum(len(m) for m in self.events.values())
+
+    def match(
+        self,
+        queries: np.ndarray,
+        event_id: Optional[str] = None,
+        top_k: int = 100,
+        threshold: float = 0.0,
+    ) -> List[Tuple[Hashable, float]]:
+        """Photos whose faces best match the query faces, highest score first"""
+        with self._lock:
+            if event_id is not None:
+                matrices = [self.events[event_id]] if event_id in self.events else []
+            else:
+                matrices = list(self.events.values())
+            # Searched outside the lock, so indexing commits never wait on a matrix product
+            snapshots = [matrix.snapshot() for matrix in matrices]
+        results = []
+        for matrix in snapshots:
+            results.extend(matrix.search(queries, top_k, threshold))
+        results.sort(key=lambda r: -r[1])
+        return results[:top_k]
+
+
+def encode_embeddings(embeddings: np.ndarray) -> bytes:
+    """Pack a (faces, dim) array as raw float32 bytes for the metadata store"""
+    return np.ascontiguousarray(embeddings, dtype=np.float32).tobytes()
+
+
+def decode_embeddings(data: bytes, dim: int) -> np.ndarray:
+    """Inverse of encode_embeddings for the backend's dim"""
+    return np.frombuffer(data, dtype=np.float32).reshape(-1, dim)
@@ -0,0 +1,403 @@
+"""
+Event-scoped photo metadata shared by every worker
+Entries live in a SQLite database in WAL mode, so several uvicorn workers
+read concurrently while /index writes each batch in one transaction. An
+event's entries are loaded into memory on first use and evicted
+least-recently-used once resident shards exceed a memory budget, so worker
+memory tracks the events that are actually hot.
+
+Each event row carries a version that every write bumps; a worker reloads
+its resident copy of an event when the version moved under it.
+
+Rows are stored compactly: event ids are interned in the events table,
+blob names are kept relative to their event folder, face embeddings are
+raw float32 blobs, and fields derivable from the row (photo URL, event id,
+"indexed") aren't stored at all. Full URLs are rebuilt from url_prefix
+only when returned. Reads go through SQLite's memory-mapped I/O.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from pools import SQLiteConnections
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY,
+        event_id TEXT NOT NULL UNIQUE,
+        photo_count INTEGER NOT NULL,
+        version INTEGER NOT NULL
+    )""",
+    # A rowid table: rows with ~2 KB embedding blobs pack badly into WITHOUT ROWID pages
+    """CREATE TABLE IF NOT EXISTS photos (
+        event INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        generation INTEGER,
+        etag TEXT,
+        faces INTEGER,
+        embeddings BLOB,
+        extra TEXT,
+        PRIMARY KEY (event, name)
+    )""",
+]
+
+COLUMNS = ("generation", "etag", "faces", "embeddings")
+DERIVED_FIELDS = ("photo_url", "event_id", "indexed")  # rebuilt from the row, never stored
+OUTSIDE_EVENT_MARK = "\n"  # GCS object names can't contain line feeds
+
+
+def _pack_name(event_id: str, key: str) -> str:
+    """Blob name relative to the event folder"""
+    folder = f"{event_id}/"
+    return key[len(folder):] if key.startswith(folder) else OUTSIDE_EVENT_MARK + key
+
+
+def _unpack_name(event_id: str, name: str) -> str:
+    return name[1:] if name.startswith(OUTSIDE_EVENT_MARK) else f"{event_id}/{name}"
+
+
+def compact_entry(entry: dict) -> dict:
+    """Drop fields derivable from the row"""
+    return {k: v for k, v in entry.items() if k not in DERIVED_FIELDS and v is not None}
+
+
+def _pack_row(entry: dict) -> tuple:
+    extra = {k: v for k, v in entry.items() if k not in COLUMNS}
+    return tuple(entry.get(c) for c in COLUMNS) + (
+        json.dumps(extra, separators=(",", ":")) if extra else None,
+    )
+
+
+def _unpack_row(row: tuple) -> dict:
+    entry = {c: v for c, v in zip(COLUMNS, row) if v is not None}
+    if row[len(COLUMNS)]:
+        entry.update(json.loads(row[len(COLUMNS)]))
+    return entry
+
+
+class EventShard:
+    """Compact metadata entries of one event, keyed by blob name"""
+
+    def __init__(self, event_id: str, url_prefix: str = ""):
+        self.event_id = event_id
+        self.url_prefix = url_prefix
+        self.entries: Dict[str, dict] = {}
+        self.version = 0  # events.version this copy reflects
+        self.nbytes = 0  # estimated resident size
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def photo_url(self, key: str) -> str:
+        return self.url_prefix + key
+
+    def photo_urls(self) -> List[str]:
+        return [self.url_prefix + key for key in self.entries]
+
+
+def _entry_nbytes(key: str, entry: dict) -> int:
+    # Rough footprint: key, embeddings and a fixed cost per field
+    embeddings = entry.get("embeddings")
+    return len(key) + 64 * len(entry) + (len(embeddings) if embeddings else 0)
+
+
+class MetadataStore:
+    """
+    SQLite-backed entries with an LRU of resident event shards
+
+    on_load(shard) / on_evict(shard) let the caller maintain derived
+    in-memory structures (e.g. face matrices) for resident events only;
+    on_load returns the bytes those structures add. Unless
+    resident_embeddings is set, embeddings are dropped from resident
+    entries once on_load has seen them.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        url_prefix: str = "",
+        memory_budget_bytes: int = 256 * 1024 * 1024,
+        mmap_bytes: int = 256 * 1024 * 1024,
+        busy_timeout_ms: int = 10000,
+        on_load: Optional[Callable[[EventShard], Optional[int]]] = None,
+        on_evict: Optional[Callable[[EventShard], None]] = None,
+        resident_embeddings: bool = False,
+    ):
+        self.path = path
+        self.url_prefix = url_prefix
+        self.memory_budget_bytes = memory_budget_bytes
+        self.on_load = on_load
+        self.on_evict = on_evict
+        self.resident_embeddings = resident_embeddings
+        self._connections = SQLiteConnections(path, busy_timeout_ms, mmap_bytes)
+        self._shards: "OrderedDict[str, EventShard]" = OrderedDict()
+        self._resident_bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    # Connections
+
+    def _conn(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    def open(self):
+        """Create or upgrade the schema; no event is loaded until it's used"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._upgrade(conn)
+        with self._lock:
+            self._drop_resident()
+        logger.info(
+            f"✅ Metadata store has {len(self.event_ids())} events, "
+            f"{self.total_entries()} photos (loaded lazily)"
+        )
+
+    def _upgrade(self, conn: sqlite3.Connection):
+        """Create the schema"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # Loading and eviction
+
+    def _event_row(self, event_id: str) -> Tuple[Optional[int], int]:
+        """(interned id, version) of an event; (None, 0) if it was never written"""
+        row = self._conn().execute("SELECT id, version FROM events WHERE event_id = ?", (event_id,)).fetchone()
+        return (row[0], row[1]) if row else (None, 0)
+
+    def _event_version(self, event_id: str) -> int:
+        return self._event_row(event_id)[1]
+
+    def _load_shard(self, event_id: str) -> EventShard:
+        shard = EventShard(event_id, self.url_prefix)
+        conn = self._conn()
+        # One read transaction, so the rows and the version agree
+        conn.execute("BEGIN")
+        try:
+            event, shard.version = self._event_row(event_id)
+            rows = conn.execute(
+                "SELECT name, generation, etag, faces, embeddings, extra FROM photos WHERE event = ?", (event,)
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        shard.entries = {_unpack_name(event_id, row[0]): _unpack_row(row[1:]) for row in rows}
+        shard.nbytes = sum(_entry_nbytes(k, e) for k, e in shard.entries.items())
+        return shard
+
+    def get_shard(self, event_id: str) -> EventShard:
+        """
+        Resident shard for an event, (re)loading it and evicting others as
+        needed. SQL runs outside the lock, so a slow read or a writer holding
+        the database never blocks callers of resident events.
+        """
+        version = self._event_version(event_id)
+        with self._lock:
+            shard = self._shards.get(event_id)
+            if shard is not None and shard.version == version:
+                self._shards.move_to_end(event_id)
+                self.hits += 1
+                return shard
+        loaded = self._load_shard(event_id)
+        with self._lock:
+            shard = self._shards.get(event_id)
+            if shard is not None:
+                if shard.version >= loaded.version:
+                    # Loaded or committed to by another thread meanwhile
+                    self._shards.move_to_end(event_id)
+                    self.hits += 1
+                    return shard
+                # Another worker wrote to this event since we loaded it
+                self.reloads += 1
+                self._unload(event_id)
+            else:
+                self.misses += 1
+            self._shards[event_id] = loaded
+            derived = 0
+            if self.on_load is not None:
+                # on_load may report derived memory (e.g. face matrices) to count against the budget
+                derived = self.on_load(loaded) or 0
+            if not self.resident_embeddings:
+                loaded.entries = {key: self._resident(entry) for key, entry in loaded.entries.items()}
+                loaded.nbytes = sum(_entry_nbytes(k, e) for k, e in loaded.entries.items())
+            loaded.nbytes += derived
+            self._resident_bytes += loaded.nbytes
+            self._evict(keep=event_id)
+            return loaded
+
+    def _unload(self, event_id: str) -> EventShard:
+        shard = self._shards.pop(event_id)
+        self._resident_bytes -= shard.nbytes
+        if self.on_evict is not None:
+            self.on_evict(shard)
+        return shard
+
+    def _evict(self, keep: Optional[str] = None):
+        while self._resident_bytes > self.memory_budget_bytes and len(self._shards) > 1:
+            event_id = next(iter(self._shards))
+            if event_id == keep:
+                self._shards.move_to_end(event_id)
+                continue
+            shard = self._unload(event_id)
+            self.evictions += 1
+            logger.info(f"♻️ Evicted metadata shard {event_id} ({shard.nbytes} bytes)")
+
+    def _drop_resident(self):
+        for event_id in list(self._shards):
+            self._unload(event_id)
+
+    # Writes
+
+    def _write(self, event_id: str, records: List[dict]) -> Tuple[int, int]:
+        """
+        Apply records in one write transaction and bump the event version.
+        Returns (version before, version after).
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            event, before = self._event_row(event_id)
+            if event is None:
+                event = conn.execute(
+                    "INSERT INTO events (event_id, photo_count, version) VALUES (?, 0, 0)", (event_id,)
+                ).lastrowid
+            for record in records:
+                name = _pack_name(event_id, record["key"])
+                if record["op"] == "put":
+                    conn.execute(
+                        "INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (event, name) + _pack_row(record["entry"]),
+                    )
+                else:
+                    # Tombstone for an object that no longer exists in GCS
+                    conn.execute("DELETE FROM photos WHERE event = ? AND name = ?", (event, name))
+            count = conn.execute("SELECT COUNT(*) FROM photos WHERE event = ?", (event,)).fetchone()[0]
+            conn.execute("UPDATE events SET photo_count = ?, version = ? WHERE id = ?", (count, before + 1, event))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return before, before + 1
+
+    def _apply(self, shard: EventShard, records: List[dict]):
+        """Mirror committed records in a resident shard"""
+        before = shard.nbytes
+        for record in records:
+            key = record["key"]
+            old = shard.entries.pop(key, None) if record["op"] == "delete" else shard.entries.get(key)
+            if old is not None:
+                shard.nbytes -= _entry_nbytes(key, old)
+            if record["op"] == "put":
+                entry = shard.entries[key] = self._resident(record["entry"])
+                shard.nbytes += _entry_nbytes(key, entry)
+        self._resident_bytes += shard.nbytes - before
+
+    def _resident(self, entry: dict) -> dict:
+        """Entry as held in a resident shard"""
+        if self.resident_embeddings or "embeddings" not in entry:
+            return entry
+        return {k: v for k, v in entry.items() if k != "embeddings"}
+
+    def _commit(self, event_id: str, records: List[dict]):
+        self.get_shard(event_id)
+        # The write transaction may wait out another worker's; the lock is only taken to mirror it
+        version_before, version_after = self._write(event_id, records)
+        with self._lock:
+            shard = self._shards.get(event_id)
+            if shard is not None and shard.version == version_before:
+                self._apply(shard, records)
+                shard.version = version_after
+            # else another writer committed in between: the next get_shard() reloads
+            self._evict(keep=event_id)
+
+    def put(self, event_id: str, items: Iterable[Tuple[str, dict]]):
+        """Insert or replace entries of one event in a single transaction"""
+        records = [{"op": "put", "key": key, "entry": compact_entry(entry)} for key, entry in items]
+        if records:
+            self._commit(event_id, records)
+
+    def delete(self, event_id: str, keys: Iterable[str]):
+        """Remove entries of one event in a single transaction"""
+        records = [{"op": "delete", "key": key} for key in keys]
+        if records:
+            self._commit(event_id, records)
+
+    def checkpoint(self):
+        """Fold the WAL back into the database file"""
+        try:
+            self._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            logger.error(f"❌ Failed to checkpoint metadata store: {e}")
+
+    def reset(self):
+        """Forget every event"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM photos")
+        # Bump rather than drop versions so other workers' copies go stale
+        conn.execute("UPDATE events SET photo_count = 0, version = version + 1")
+        conn.execute("COMMIT")
+        with self._lock:
+            self._drop_resident()
+
+    # Migration from embeddings_metadata.json
+
+    def import_legacy(self, entries: Dict[str, dict]):
+        """Load a whole-deployment {key: entry} dict, one transaction per event"""
+        by_event: Dict[str, List[Tuple[str, dict]]] = {}
+        for key, entry in entries.items():
+            by_event.setdefault(entry.get("event_id"), []).append((key, entry))
+        for event_id, items in by_event.items():
+            self.put(event_id, items)
+
+    # Reporting
+
+    def event_ids(self) -> List[str]:
+        rows = self._conn().execute("SELECT event_id FROM events WHERE photo_count > 0 ORDER BY event_id")
+        return [row[0] for row in rows]
+
+    def version(self, event_id: str) -> int:
+        """Current version of an event (0 if it was never written), without loading it"""
+        return self._event_version(event_id)
+
+    def count(self, event_id: str) -> int:
+        row = self._conn().execute("SELECT photo_count FROM events WHERE event_id = ?", (event_id,)).fetchone()
+        return row[0] if row else 0
+
+    def total_entries(self) -> int:
+        return self._conn().execute("SELECT COALESCE(SUM(photo_count), 0) FROM events").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "file_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "events": len(self.event_ids()),
+            "resident_events": len(self._shards),
+            "resident_bytes": self._resident_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "evictions": self.evictions,
+        }
+
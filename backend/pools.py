@@ -0,0 +1,64 @@
+"""
+Lazily built worker threads and per-thread SQLite connections
+LazyThreadPool backs the GCS, derivative and selfie pools: threads are
+only started on first use (keeping cold starts short) and a pool that was
+shut down starts again on the next submit. SQLiteConnections gives every
+thread its own connection to a WAL database shared by several workers.
+"""
+
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class LazyThreadPool:
+    """ThreadPoolExecutor created on first use"""
+
+    def __init__(self, workers: int, name: str):
+        self.workers = max(1, workers)
+        self.name = name
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def executor(self) -> ThreadPoolExecutor:
+        executor = self._executor
+        if executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+                executor = self._executor
+        return executor
+
+    def submit(self, fn: Callable[..., Any], *args) -> Future:
+        return self.executor().submit(fn, *args)
+
+    def shutdown(self):
+        """Stop the worker threads; the pool restarts on the next use"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SQLiteConnections:
+    """One connection per thread to a WAL database; readers run alongside a writer"""
+
+    def __init__(self, path: str, busy_timeout_ms: int = 10000, mmap_bytes: int = 0):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_bytes = mmap_bytes
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+            conn.execute("PRAGMA journal_mode = WAL")
+            # A commit survives a crashed process; only power loss can drop the last few
+            conn.execute("PRAGMA synchronous = NORMAL")
+            if self.mmap_bytes:
+                conn.execute(f"PRAGMA mmap_size = {self.mmap_bytes}")
+            self._local.conn = conn
+        return conn
@@ -0,0 +1,150 @@
+"""
+Selfie ingestion for /match
+Request bodies are capped before the multipart form is parsed, the file
+part is read in chunks against the same cap, and decoding, downscaling
+and embedding run in a small dedicated thread pool. When that pool and its
+queue are full, new selfies are refused immediately instead of piling up
+behind each other and tying up the threads other endpoints rely on.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict
+
+from fastapi import UploadFile
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+from pools import LazyThreadPool
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_BYTES = 256 * 1024
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # boundaries, part headers and small form fields
+
+
+class UploadTooLarge(Exception):
+    """The upload exceeded the configured size cap"""
+
+
+class PoolSaturated(Exception):
+    """Every worker is busy and the wait queue is full"""
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware capping the request body of selected paths
+
+    It runs before the multipart form is parsed and spooled, so an
+    oversized upload costs at most max_bytes of reading: a Content-Length
+    over the cap is refused with 413 before any of the body is read, and a
+    chunked (or understated) body is cut off with 413 as soon as the bytes
+    received pass it.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+        detail = f"Request body is larger than {max_bytes} bytes"
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def capped_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Raised while the form is parsed; FastAPI re-raises HTTPExceptions as they are
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, capped_receive, send)
+
+
+async def read_upload(upload: UploadFile, max_bytes: int, hasher=None) -> bytes:
+    """
+    Read an upload chunk by chunk, stopping as soon as it exceeds max_bytes
+
+    By now the form has been parsed and the file spooled, within the
+    request cap set by UploadLimitMiddleware; this enforces the exact
+    limit on the file itself. A hashlib object passed as hasher is fed
+    every chunk, so the content hash costs no extra pass over the bytes.
+    """
+    chunks = []
+    size = 0
+    while True:
+        chunk = await upload.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(f"Upload is larger than {max_bytes} bytes")
+        chunks.append(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+    return b"".join(chunks)
+
+
+class BoundedExecutor:
+    """
+    Thread pool that admits at most workers + queue_size tasks at once
+
+    run() raises PoolSaturated right away when the pool is full, so callers
+    can shed load (e.g. 503 + Retry-After) instead of queueing unboundedly.
+    """
+
+    def __init__(self, workers: int, queue_size: int, name: str = "selfie"):
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_size)
+        self.name = name
+        self._pool = LazyThreadPool(self.workers, name)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self.rejected += 1
+                raise PoolSaturated(f"{self._in_flight} tasks in flight")
+            self._in_flight += 1
+        ok = False
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._pool.executor(), fn, *args)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": self._in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        """Stop the worker threads; the pool restarts on the next run()"""
+        self._pool.shutdown()
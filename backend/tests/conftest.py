@@ -0,0 +1,75 @@
+"""
+Shared test setup
+main reads its configuration at import time, so the environment is pointed
+at a local-directory bucket, deterministic hash embeddings and a scratch
+data directory before any test imports it.
+"""
+
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="gallery-tests-")
+os.environ.update(
+    GCS_BACKEND="local",
+    LOCAL_GCS_DIR=os.path.join(SCRATCH_DIR, "gcs"),
+    GCS_BUCKET_NAME="test-bucket",
+    FAKE_GCS_SEED="",
+    EMBEDDING_BACKEND="hash",
+    USE_FAISS="0",  # same behaviour whether or not faiss is installed
+    DATA_DIR=os.path.join(SCRATCH_DIR, "data"),
+    DERIVATIVE_SIZES="256",
+    COMPRESS_MIN_BYTES="1024",
+)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """TestClient over the app, started once for the whole session"""
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def bucket():
+    """The local-directory bucket the app reads from"""
+    import fake_gcs
+    import gcs
+
+    return fake_gcs.get_fake_bucket(gcs.get_bucket_name())
+
+
+@pytest.fixture
+def make_jpeg():
+    """JPEG bytes of a solid-colour image"""
+    from PIL import Image
+
+    def make(color="red", size=(600, 400)) -> bytes:
+        buf = io.BytesIO()
+        Image.new("RGB", size, color).save(buf, "JPEG")
+        return buf.getvalue()
+
+    return make
+
+
+def photo_url(key: str) -> str:
+    return f"https://storage.googleapis.com/{os.environ['GCS_BUCKET_NAME']}/{key}"
+
+
+def index_event(client, event_id: str, keys, **params) -> dict:
+    """Index photos of an event inside the request and return the finished job"""
+    response = client.post(
+        "/index", params={"event_id": event_id, "wait": True, **params}, json=[photo_url(k) for k in keys]
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
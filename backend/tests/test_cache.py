@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from cache import TTLCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache(60, 10)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return ["photo"]
+
+    async def main():
+        results = await asyncio.gather(*(cache.get_or_load("ev", loader) for _ in range(20)))
+        assert all(r is results[0] for r in results)
+        assert await cache.get_or_load("ev", loader) is results[0]
+
+    run(main())
+    assert calls == 1
+    assert cache.coalesced == 19
+
+
+def test_failure_reaches_every_waiter_and_is_not_cached():
+    cache = TTLCache(60, 10)
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        raise ValueError("listing failed")
+
+    async def main():
+        results = await asyncio.gather(*(cache.get_or_load("ev", loader) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+
+    run(main())
+    assert cache.get("ev") is None
+
+
+def test_invalidation_only_drops_loads_of_its_key():
+    cache = TTLCache(60, 10)
+    release = None
+
+    async def loader(value):
+        await release.wait()
+        return value
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        stale = asyncio.ensure_future(cache.get_or_load("a", lambda: loader("old a")))
+        other = asyncio.ensure_future(cache.get_or_load("b", lambda: loader("b")))
+        await asyncio.sleep(0)
+        cache.invalidate("a")
+        # A caller after the invalidation starts a fresh load instead of joining the stale one
+        fresh = asyncio.ensure_future(cache.get_or_load("a", lambda: loader("new a")))
+        await asyncio.sleep(0)
+        release.set()
+        assert await stale == "old a"
+        assert await fresh == "new a"
+        assert await other == "b"
+
+    run(main())
+    assert cache.get("a") == "new a"
+    assert cache.get("b") == "b"
+
+
+def test_cancelled_caller_leaves_the_load_to_the_others():
+    cache = TTLCache(60, 10)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return "listing"
+
+    async def main():
+        first = asyncio.ensure_future(cache.get_or_load("ev", loader))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_load("ev", loader))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert await second == "listing"
+
+    run(main())
+    assert calls == 1
+    assert cache.get("ev") == "listing"
+
+
+def test_lru_and_ttl_bounds():
+    cache = TTLCache(60, 2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None  # least recently used
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+    cache.set("short", 4, ttl_seconds=0)
+    assert cache.get("short") is None
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_byte_budget_evicts_and_skips_oversized_values():
+    cache = TTLCache(60, 100, max_bytes=10)
+    cache.set("a", b"1234")
+    cache.set("b", b"5678")
+    assert cache.stats()["bytes"] == 8
+    cache.set("c", b"90ab")  # over the budget: the least recently used goes
+    assert cache.get("a") is None
+    assert cache.get("b") == b"5678" and cache.get("c") == b"90ab"
+    assert cache.stats()["bytes"] == 8
+
+    cache.set("b", b"12")  # a replaced value gives back its bytes
+    assert cache.stats()["bytes"] == 6
+    cache.set("huge", b"x" * 11)
+    assert cache.get("huge") is None
+    assert cache.get("c") == b"90ab"  # an oversized value evicts nothing
+    cache.invalidate("c")
+    assert cache.stats()["bytes"] == 2
@@ -0,0 +1,64 @@
+import numpy as np
+
+from clusters import ClusterStore
+from matcher import EventFaceMatrix, normalize
+
+DIM = 128
+SIZES = (40, 25, 12, 6, 1)  # faces per person, largest first
+
+
+def clustered_faces(seed=0, noise=0.25):
+    """Faces of a few people: each person's faces lie near their own random direction"""
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((len(SIZES), DIM)))
+    faces, keys, people = [], [], []
+    for person, size in enumerate(SIZES):
+        for i in range(size):
+            faces.append(centers[person] + noise * rng.standard_normal(DIM) / np.sqrt(DIM))
+            keys.append(f"p{person}_{i:02d}.jpg")
+            people.append(person)
+    return normalize(np.array(faces, dtype=np.float32)), keys, np.array(people)
+
+
+def test_two_stage_search_returns_the_flat_top_k(tmp_path):
+    faces, keys, _ = clustered_faces()
+    # A group photo: its second face belongs to person 1
+    faces = np.concatenate([faces, faces[[45]] * 0.999])
+    keys = keys + ["p0_00.jpg"]
+    clusters = ClusterStore(str(tmp_path), similarity=0.6).build("ev", keys, faces, version=1)
+    flat = EventFaceMatrix(DIM)
+    for key in dict.fromkeys(keys):
+        flat.add(key, faces[[row for row, k in enumerate(keys) if k == key]])
+
+    rng = np.random.default_rng(1)
+    for row in (0, 45, 70, 80, 83):
+        query = normalize(faces[row] + 0.2 * rng.standard_normal(DIM) / np.sqrt(DIM))
+        for top_k, threshold in ((5, 0.0), (20, 0.5), (100, 0.8)):
+            expected = flat.search(query, top_k, threshold)
+            found = clusters.search(query, top_k, threshold)
+            assert [key for key, _ in found] == [key for key, _ in expected]
+            assert np.allclose([s for _, s in found], [s for _, s in expected], atol=1e-5)
+
+
+def test_people_and_photos_are_ordered(tmp_path):
+    faces, keys, people = clustered_faces(seed=2)
+    clusters = ClusterStore(str(tmp_path), similarity=0.6).build("ev", keys, faces, version=1)
+    assert len(clusters) == len(SIZES)
+    assert clusters.photo_counts() == list(SIZES)  # largest cluster first
+
+    assert list(clusters.people(1)) == [0, 1, 2, 3, 4]
+    assert list(clusters.people(6)) == [0, 1, 2, 3]
+    assert list(clusters.people(13)) == [0, 1]
+
+    for cluster, size in enumerate(SIZES):
+        photos = clusters.photos(cluster)
+        assert sorted(photos) == sorted(k for k, p in zip(keys, people) if p == cluster)
+        # Most central face first
+        rows = [keys.index(key) for key in photos]
+        similarity = faces[rows] @ np.asarray(clusters.centroids[cluster])
+        assert np.all(np.diff(similarity) <= 1e-6)
+
+    # A face near person 1 resembles that person first
+    nearest = clusters.nearest(faces[[45]], threshold=0.5)
+    assert nearest[0][0] == 1
+    assert [score for _, score in nearest] == sorted((score for _, score in nearest), reverse=True)
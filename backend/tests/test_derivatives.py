@@ -0,0 +1,32 @@
+import io
+
+from PIL import Image
+
+from conftest import index_event, photo_url
+
+
+def test_indexing_renders_and_removes_derivatives(client, bucket, make_jpeg):
+    event_id = "derivatives-event"
+    keys = [f"{event_id}/photo_{i}.jpg" for i in range(3)]
+    for i, key in enumerate(keys):
+        bucket.put(key, make_jpeg(("red", "green", "blue")[i], size=(800 + i, 600)))
+
+    job = index_event(client, event_id, keys)
+    assert job["status"] == "success" and job["indexed_photos"] == 3
+    for key in keys:
+        with Image.open(io.BytesIO(bucket.blob(f"_derivatives/256/{key}.webp").download_as_bytes())) as image:
+            assert image.format == "WEBP"
+            assert max(image.size) == 256
+
+    listing = client.get("/list-photos", params={"event_id": event_id}).json()
+    assert listing["photos"] == [photo_url(k) for k in keys]
+    assert listing["thumbnails"]["256"] == [photo_url(f"_derivatives/256/{k}.webp") for k in keys]
+
+    # Unchanged photos are skipped, a deleted one is tombstoned with its derivative
+    bucket.remove(keys[0])
+    job = index_event(client, event_id, keys[1:])
+    assert job["skipped_photos"] == 2 and job["deleted_photos"] == 1
+    assert not bucket.blob(f"_derivatives/256/{keys[0]}.webp").exists()
+    assert bucket.blob(f"_derivatives/256/{keys[1]}.webp").exists()
+    listing = client.get("/list-photos", params={"event_id": event_id}).json()
+    assert listing["photos"] == [photo_url(k) for k in keys[1:]]
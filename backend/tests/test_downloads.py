@@ -0,0 +1,39 @@
+from conftest import photo_url
+
+
+def test_batch_signs_every_photo_and_reuses_signatures(client, bucket):
+    event_id = "download-event"
+    keys = [f"{event_id}/photo_{i}.jpg" for i in range(4)]
+    for key in keys:
+        bucket.put(key, b"jpeg bytes")
+    urls = [photo_url(k) for k in keys]
+
+    response = client.post("/download-photos", json={"photo_urls": urls + ["not a url"]})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["count"] == 4
+    assert [s["photo_url"] for s in body["signed_urls"]] == urls
+    assert body["failed"] == [{"photo_url": "not a url", "error": "Invalid photo_url format"}]
+    first = body["signed_urls"][0]
+    assert "response-content-disposition=attachment" in first["signed_url"]
+
+    # Signatures are reused until they near expiry, by the batch and single endpoints alike
+    again = client.post("/download-photos", json={"photo_urls": urls[:1]}).json()["signed_urls"][0]
+    assert again == first
+    single = client.get("/download-photo", params={"photo_url": urls[0]}).json()
+    assert single["signed_url"] == first["signed_url"]
+
+
+def test_batch_by_event_and_limits(client, bucket):
+    event_id = "download-event-listed"
+    for i in range(3):
+        bucket.put(f"{event_id}/photo_{i}.jpg", b"jpeg bytes")
+
+    body = client.post("/download-photos", json={"event_id": event_id}).json()
+    assert body["count"] == 3
+    assert client.post("/download-photos", json={}).status_code == 400
+
+    import main
+
+    too_many = [photo_url(f"{event_id}/photo_{i}.jpg") for i in range(main.DOWNLOAD_BATCH_MAX + 1)]
+    assert client.post("/download-photos", json={"photo_urls": too_many}).status_code == 413
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+
+from event_files import EventFileStore
+from faiss_store import FaissEventStore
+
+
+class LoadedArray:
+    def __init__(self, vectors, row_keys, stamp):
+        self.vectors = vectors
+        self.row_keys = row_keys
+        self.stamp = stamp
+
+
+class ArrayStore(EventFileStore[LoadedArray]):
+    suffixes = (".npy", ".keys.json")
+
+    def write(self, event_id, row_keys, vectors):
+        self._replace(event_id, lambda path: np.save(path, vectors), {"row_keys": row_keys})
+
+    def _read(self, data_path, meta, stamp):
+        return LoadedArray(np.load(data_path), meta["row_keys"], stamp)
+
+
+def test_rewrite_with_same_row_count_never_pairs_old_vectors(tmp_path):
+    store = ArrayStore(str(tmp_path))
+    store.write("ev", ["a", "b"], np.zeros((2, 4), dtype=np.float32))
+    assert store.load("ev").row_keys == ["a", "b"]
+
+    # Another worker's rewrite: same row count, new keys and vectors
+    ArrayStore(str(tmp_path)).write("ev", ["c", "d"], np.ones((2, 4), dtype=np.float32))
+    loaded = store.load("ev")
+    assert loaded.row_keys == ["c", "d"]
+    assert loaded.vectors.sum() == 8
+    # The replaced data file is removed; only the published pair is left
+    assert len(os.listdir(tmp_path)) == 2
+
+    store.delete("ev")
+    assert store.load("ev") is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_similar_event_ids_do_not_share_files(tmp_path):
+    store = FaissEventStore(str(tmp_path))
+    rng = np.random.default_rng(0)
+    first, second = rng.standard_normal((2, 3, 16)).astype(np.float32)
+    store.write("a b", ["x", "y", "z"], first)
+    store.write("a_b", ["p", "q", "r"], second)
+    store.write("A_B", ["s"], second[:1])
+
+    assert store.row_keys("a b") == ["x", "y", "z"]
+    assert store.row_keys("a_b") == ["p", "q", "r"]
+    assert store.row_keys("A_B") == ["s"]
+    keys, vectors = store.read_embeddings("a b")
+    assert np.allclose(vectors, first)
+
+    store.clear()
+    assert store.row_keys("a b") == []
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,46 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import gcs
+
+
+def test_run_counts_failures_and_timeouts_apart_from_completed_calls():
+    def fail():
+        raise ValueError("boom")
+
+    async def scenario():
+        assert await gcs.run(lambda: 1) == 1
+        with pytest.raises(ValueError):
+            await gcs.run(fail)
+        with pytest.raises(gcs.GCSTimeout):
+            await gcs.run(time.sleep, 0.5, timeout=0.01)
+
+    before = gcs.stats()
+    asyncio.run(scenario())
+    after = gcs.stats()
+    assert after["completed"] - before["completed"] == 1
+    assert after["failed"] - before["failed"] == 1
+    assert after["timeouts"] - before["timeouts"] == 1
+
+
+def test_credentials_file_is_rechecked_only_after_the_interval(tmp_path, monkeypatch):
+    path = tmp_path / "credentials.json"
+    path.write_text("{}")
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", str(path))
+    monkeypatch.setattr(gcs, "CREDENTIALS_CHECK_SECONDS", 3600)
+    key = gcs._credentials_key()
+    assert key == (str(path), path.stat().st_mtime_ns)
+
+    os.utime(path, ns=(0, 0))
+    assert gcs._credentials_key() == key  # not stat'ed again yet
+
+    monkeypatch.setattr(gcs, "CREDENTIALS_CHECK_SECONDS", 0)
+    assert gcs._credentials_key() == (str(path), 0)
+
+    # A different variable is picked up immediately
+    monkeypatch.setattr(gcs, "CREDENTIALS_CHECK_SECONDS", 3600)
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", '{"type": "service_account"}')
+    assert gcs._credentials_key() == ('{"type": "service_account"}', None)
@@ -0,0 +1,46 @@
+import main
+from conftest import index_event, photo_url
+
+
+def event_keys(event_id):
+    return set(main.metadata_store.get_shard(event_id).entries)
+
+
+def test_reindexing_processes_only_the_delta(client, bucket, make_jpeg):
+    event_id = "incremental-event"
+    keys = [f"{event_id}/photo_{i}.jpg" for i in range(5)]
+    for key in keys:
+        bucket.put(key, make_jpeg(size=(64, 48)))
+
+    job = index_event(client, event_id, keys + keys[:2])  # duplicates are indexed once
+    assert (job["indexed_photos"], job["skipped_photos"], job["deleted_photos"]) == (5, 0, 0)
+    assert event_keys(event_id) == set(keys)
+
+    job = index_event(client, event_id, keys)
+    assert (job["indexed_photos"], job["skipped_photos"], job["deleted_photos"]) == (0, 5, 0)
+
+    bucket.put(keys[1], make_jpeg("blue", size=(80, 48)))  # rewritten: new generation
+    bucket.remove(keys[4])
+    job = index_event(client, event_id, keys)
+    assert (job["indexed_photos"], job["skipped_photos"], job["deleted_photos"]) == (1, 3, 1)
+    assert job["failed_photos"] == [{"photo_url": photo_url(keys[4]), "error": "Not found in GCS"}]
+    assert event_keys(event_id) == set(keys[:4])
+    assert main.metadata_store.get_shard(event_id).entries[keys[1]]["width"] == 80
+
+
+def test_batch_only_tombstones_its_own_name_range(client, bucket, make_jpeg):
+    event_id = "batched-event"
+    keys = [f"{event_id}/photo_{i}.jpg" for i in range(6)]
+    for key in keys:
+        bucket.put(key, make_jpeg(size=(64, 48)))
+    index_event(client, event_id, keys)
+
+    bucket.remove(keys[1])
+    bucket.remove(keys[5])
+    job = index_event(client, event_id, keys[:3], write_manifest=False)
+    assert job["deleted_photos"] == 1  # photo_5 is outside this batch's range
+    assert event_keys(event_id) == set(keys) - {keys[1]}
+
+    # The end-of-run manifest sweeps the whole event
+    assert client.post("/index/manifest", params={"event_id": event_id}).json()["count"] == 4
+    assert event_keys(event_id) == set(keys) - {keys[1], keys[5]}
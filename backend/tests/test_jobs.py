@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+from conftest import index_event, photo_url
+from jobs import IndexJobRunner, JobStore
+
+
+def test_runner_retries_commits_and_shares_status(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"), max_jobs_kept=2)
+    store.open()
+    attempts = {}
+    committed = []
+
+    def process(event_id, item):
+        url = item["photo_url"]
+        attempts[url] = attempts.get(url, 0) + 1
+        if url == "broken" or (url == "flaky" and attempts[url] < 3):
+            raise OSError(f"cannot read {url}")
+        return {"photo_url": url}
+
+    async def commit(event_id, entries):
+        committed.append([e["photo_url"] for e in entries])
+
+    runner = IndexJobRunner(
+        process, commit, max_retries=2, retry_backoff_seconds=0.001, commit_every=2, store=store
+    )
+    urls = ["a", "flaky", "b", "broken", "c"]
+    job = asyncio.run(runner.run(runner.create("ev", urls)))
+
+    assert job.status == "completed"
+    assert job.indexed == 4 and job.processed == 5
+    assert job.retries == 2 + 2  # flaky succeeded on its third try, broken gave up after two retries
+    assert job.failed_photos == [{"photo_url": "broken", "error": "cannot read broken"}]
+    assert sorted(url for chunk in committed for url in chunk) == ["a", "b", "c", "flaky"]
+    assert max(len(chunk) for chunk in committed) <= 2
+
+    # Another worker (without the job in memory) answers from the store
+    other = IndexJobRunner(process, commit, store=store)
+    status = asyncio.run(other.status(job.job_id))
+    assert status["status"] == "completed"
+    assert status["indexed_photos"] == 4 and status["retries"] == 4
+    assert status["failed_photos"] == job.failed_photos
+    assert asyncio.run(other.status("unknown")) is None
+
+    # Finished jobs beyond max_jobs_kept are pruned from the store
+    for _ in range(2):
+        asyncio.run(runner.run(runner.create("ev", ["a"])))
+    assert store.load(job.job_id) is None
+
+
+def test_failing_prepare_fails_the_job(tmp_path):
+    async def prepare(job):
+        raise RuntimeError("listing failed")
+
+    async def commit(event_id, entries):
+        pass
+
+    runner = IndexJobRunner(lambda event_id, item: item, commit, prepare=prepare)
+    job = asyncio.run(runner.run(runner.create("ev", ["a"])))
+    assert job.status == "failed" and job.error == "listing failed"
+
+
+def test_index_endpoint_queues_and_reports_progress(client, bucket, make_jpeg):
+    event_id = "jobs-event"
+    keys = [f"{event_id}/photo_{i}.jpg" for i in range(5)]
+    for key in keys:
+        bucket.put(key, make_jpeg(size=(64, 48)))
+
+    response = client.post("/index", params={"event_id": event_id}, json=[photo_url(k) for k in keys])
+    assert response.status_code == 202
+    status_url = response.json()["status_url"]
+    deadline = time.monotonic() + 10
+    while True:
+        job = client.get(status_url).json()
+        if job["status"] in ("completed", "failed") or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    assert job["status"] == "completed"
+    assert job["indexed_photos"] == 5 and job["processed_photos"] == 5
+    assert client.get("/index/jobs/unknown").status_code == 404
+
+
+def test_inline_mode_runs_jobs_inside_the_request(client, bucket, make_jpeg, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "INDEX_INLINE", True)
+    key = "inline-event/photo.jpg"
+    bucket.put(key, make_jpeg(size=(64, 48)))
+    response = client.post("/index", params={"event_id": "inline-event"}, json=[photo_url(key)])
+    assert response.status_code == 200
+    assert response.json()["status"] == "success"
+    assert response.json()["indexed_photos"] == 1
+
+
+def test_demo_reset_forgets_jobs_entries_and_pending_refreshes(client, bucket, make_jpeg):
+    import main
+
+    key = "reset-event/photo.jpg"
+    bucket.put(key, make_jpeg(size=(64, 48)))
+    # A batch of a larger run leaves a delayed face refresh behind
+    job_id = index_event(client, "reset-event", [key], write_manifest=False)["job_id"]
+    assert client.get(f"/index/jobs/{job_id}").status_code == 200
+    refresh = main.face_refresh_tasks["reset-event"]
+
+    assert client.post("/demo/reset").json() == {"status": "reset"}
+    assert client.get(f"/index/jobs/{job_id}").status_code == 404
+    assert main.face_refresh_tasks == {}
+    assert refresh.cancelled() or refresh.cancelling()
+    status = client.get("/status").json()
+    assert status["total_entries"] == status["indexed_unique_photos"] == 0
@@ -0,0 +1,62 @@
+import pytest
+
+from conftest import index_event, photo_url
+
+EVENT_ID = "listing-event"
+
+
+@pytest.fixture
+def indexed_event(client, bucket, make_jpeg):
+    keys = [f"{EVENT_ID}/photo_{i:03d}.jpg" for i in range(40)]
+    for i, key in enumerate(keys):
+        bucket.put(key, make_jpeg((i * 6, 100, 200), size=(64, 48)))
+    index_event(client, EVENT_ID, keys)
+    return keys
+
+
+def test_etag_revalidation(client, bucket, make_jpeg, indexed_event):
+    response = client.get("/list-photos", params={"event_id": EVENT_ID})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"')
+    assert response.headers["cache-control"] == "no-cache"
+
+    revalidated = client.get("/list-photos", params={"event_id": EVENT_ID}, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+
+    # Another response variant has its own ETag
+    compact = client.get("/list-photos", params={"event_id": EVENT_ID, "compact": True}, headers={"If-None-Match": etag})
+    assert compact.status_code == 200 and compact.headers["etag"] != etag
+
+    key = f"{EVENT_ID}/photo_new.jpg"
+    bucket.put(key, make_jpeg("white", size=(64, 48)))
+    index_event(client, EVENT_ID, [key])
+    changed = client.get("/list-photos", params={"event_id": EVENT_ID}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert photo_url(key) in changed.json()["photos"]
+
+
+def test_compression(client, indexed_event):
+    plain = client.get("/list-photos", params={"event_id": EVENT_ID}, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+
+    response = client.get("/list-photos", params={"event_id": EVENT_ID}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "accept-encoding" in response.headers["vary"].lower()
+    assert response.json() == plain.json()  # decoded by the client
+    assert int(response.headers["content-length"]) < len(plain.content)
+
+    small = client.get("/health", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+
+def test_compact_listing_expands_to_full_urls(client, indexed_event):
+    full = client.get("/list-photos", params={"event_id": EVENT_ID}).json()
+    compact = client.get("/list-photos", params={"event_id": EVENT_ID, "compact": True}).json()
+    assert [compact["base_url"] + name for name in compact["photos"]] == full["photos"]
+    base = compact["thumbnail_base_urls"]["256"]
+    assert [base + name for name in compact["thumbnails"]["256"]] == full["thumbnails"]["256"]
+
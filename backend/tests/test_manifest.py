@@ -0,0 +1,45 @@
+import time
+
+import main
+import manifest
+from conftest import index_event, photo_url
+
+
+def list_photos(client, event_id):
+    main.event_listing_cache.invalidate(event_id)
+    response = client.get("/list-photos", params={"event_id": event_id})
+    assert response.status_code == 200, response.text
+    return response.json()["photos"]
+
+
+def test_fresh_manifest_is_served_without_listing_the_bucket(client, bucket, make_jpeg, monkeypatch):
+    event_id = "manifest-event"
+    keys = [f"{event_id}/photo_{i}.jpg" for i in range(4)]
+    for key in keys:
+        bucket.put(key, make_jpeg(size=(64, 48)))
+    index_event(client, event_id, keys)
+
+    def no_listing(*args, **kwargs):
+        raise AssertionError("the bucket was listed")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(bucket, "list_blobs", no_listing)
+        served = main.manifest_stats["served"]
+        assert list_photos(client, event_id) == [photo_url(k) for k in keys]
+        assert main.manifest_stats["served"] == served + 1
+
+    # A batch that doesn't rewrite the manifest still moves the event version past it
+    key = f"{event_id}/photo_new.jpg"
+    bucket.put(key, make_jpeg("white", size=(64, 48)))
+    index_event(client, event_id, [key], write_manifest=False)
+    stale = main.manifest_stats["stale"]
+    assert photo_url(key) in list_photos(client, event_id)
+    assert main.manifest_stats["stale"] == stale + 1
+
+
+def test_manifest_age_limit_is_off_by_default():
+    written = {"index_version": 3, "generated_at": time.time() - 30 * 86400}
+    assert manifest.MANIFEST_MAX_AGE_SECONDS == 0
+    assert manifest.stale_reason(written, 3) is None
+    assert manifest.stale_reason(written, 4) == "event re-indexed since it was written"
+    assert manifest.stale_reason(written, 3, max_age_seconds=60).endswith("s old")
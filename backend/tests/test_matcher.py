@@ -0,0 +1,111 @@
+import numpy as np
+
+from conftest import index_event, photo_url
+from matcher import EventFaceMatrix, FaceMatcher, HashEmbeddingBackend, decode_embeddings, encode_embeddings
+
+
+def random_faces(rng, n, dim=512):
+    return rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def test_hash_backend_is_deterministic():
+    backend = HashEmbeddingBackend()
+    first = backend.embed(b"same bytes")
+    assert first.shape == (1, backend.dim)
+    assert np.allclose(first, backend.embed(b"same bytes"))
+    assert np.isclose(np.linalg.norm(first), 1.0)
+    assert (first @ backend.embed(b"other bytes").T).item() < 0.5
+    assert backend.embed(b"").shape == (0, backend.dim)
+
+
+def test_match_ranks_identical_face_first():
+    rng = np.random.default_rng(0)
+    matcher = FaceMatcher()
+    for i in range(50):
+        matcher.add("ev", f"photo{i}", random_faces(rng, 2))
+    target = random_faces(rng, 1)
+    matcher.add("ev", "target", target)
+
+    results = matcher.match(target, "ev", top_k=5, threshold=0.0)
+    assert results[0][0] == "target"
+    assert np.isclose(results[0][1], 1.0)
+    assert matcher.match(target, "other-event") == []
+    # Random 512-d vectors are nearly orthogonal, so a high threshold keeps only the target
+    assert [key for key, _ in matcher.match(target, "ev", threshold=0.6)] == ["target"]
+
+
+def test_removed_and_replaced_photos():
+    rng = np.random.default_rng(1)
+    matcher = FaceMatcher()
+    target = random_faces(rng, 1)
+    matcher.add("ev", "target", target)
+    for i in range(200):
+        matcher.add("ev", f"photo{i}", random_faces(rng, 1))
+    for i in range(150):
+        matcher.remove("ev", f"photo{i}")  # enough dead rows to compact the matrix
+    assert matcher.face_count("ev") == 51
+    assert matcher.match(target, "ev", threshold=0.6)[0][0] == "target"
+
+    matcher.add("ev", "target", random_faces(rng, 1))
+    assert matcher.match(target, "ev", threshold=0.6) == []
+    matcher.remove("ev", "target")
+    assert not matcher.has_photo("ev", "target")
+
+
+def test_snapshot_is_unaffected_by_later_writes():
+    rng = np.random.default_rng(2)
+    matrix = EventFaceMatrix(512)
+    target = random_faces(rng, 1)
+    matrix.add("target", target)
+    matrix.add("other", random_faces(rng, 1))
+    snapshot = matrix.snapshot()
+
+    matrix.remove("target")
+    matrix.add("late", target)
+    assert [key for key, _ in snapshot.search(target, 5, 0.6)] == ["target"]
+    assert [key for key, _ in matrix.search(target, 5, 0.6)] == ["late"]
+
+
+def test_embeddings_round_trip():
+    rng = np.random.default_rng(3)
+    faces = random_faces(rng, 3)
+    assert np.array_equal(decode_embeddings(encode_embeddings(faces), 512), faces)
+    small = random_faces(rng, 2, dim=128)
+    assert decode_embeddings(encode_embeddings(small), 128).shape == (2, 128)
+
+
+def test_search_matches_brute_force_for_every_dtype_and_query_count():
+    rng = np.random.default_rng(4)
+    faces = random_faces(rng, 5000, dim=64)
+    faces /= np.linalg.norm(faces, axis=1, keepdims=True)
+    removed = set(range(0, 5000, 7))
+    for dtype in (np.float32, np.float16):
+        matrix = EventFaceMatrix(64, dtype)
+        for i, face in enumerate(faces):
+            matrix.add(f"p{i}", face)
+        for i in removed:
+            matrix.remove(f"p{i}")
+        for queries in (faces[[3]], faces[[3, 10, 20]]):
+            expected = (faces @ queries.T).max(axis=1)
+            expected[list(removed)] = -np.inf
+            order = np.argsort(-expected, kind="stable")[:10]
+            results = matrix.search(queries, 10, -1.0)
+            # Same scores in the same order; ties (and float16 near-ties) may swap keys
+            assert np.allclose([score for _, score in results], expected[order], atol=1e-2)
+            for key, score in results:
+                assert np.isclose(score, expected[int(key[1:])], atol=1e-2)
+
+
+def test_match_endpoint_returns_photo_with_identical_bytes(client, bucket, make_jpeg):
+    event_id = "match-event"
+    keys = [f"{event_id}/photo_{i:02d}.jpg" for i in range(10)]
+    for i, key in enumerate(keys):
+        bucket.put(key, make_jpeg((i * 20, 100, 200), size=(64, 48)))
+    index_event(client, event_id, keys)
+
+    selfie = bucket.blob(keys[7]).download_as_bytes()
+    response = client.post("/match", params={"event_id": event_id}, files={"selfie": ("selfie.jpg", selfie, "image/jpeg")})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["matched_photos"] == [photo_url(keys[7])]
+    assert body["similarity_scores"] == [1.0]
@@ -0,0 +1,96 @@
+import sqlite3
+
+import numpy as np
+
+from metadata_store import MetadataStore
+
+URL_PREFIX = "https://storage.googleapis.com/test-bucket/"
+
+
+def test_resident_shards_drop_embeddings_after_on_load(tmp_path):
+    path = str(tmp_path / "metadata.db")
+    embeddings = np.ones((2, 512), dtype=np.float32).tobytes()
+    MetadataStore(path).open()
+    writer = MetadataStore(path)
+    writer.open()
+    writer.put("ev", [("ev/a.jpg", {"generation": 1, "faces": 2, "embeddings": embeddings})])
+    # The writer's own resident copy doesn't keep them either
+    assert "embeddings" not in writer.get_shard("ev").entries["ev/a.jpg"]
+
+    seen = {}
+    reader = MetadataStore(path, on_load=lambda shard: seen.update(
+        {key: entry.get("embeddings") for key, entry in shard.entries.items()}
+    ))
+    reader.open()
+    shard = reader.get_shard("ev")
+    assert seen == {"ev/a.jpg": embeddings}
+    assert shard.entries["ev/a.jpg"] == {"generation": 1, "faces": 2}
+    assert shard.nbytes < len(embeddings)
+
+    keeping = MetadataStore(path, resident_embeddings=True)
+    keeping.open()
+    assert keeping.get_shard("ev").entries["ev/a.jpg"]["embeddings"] == embeddings
+
+
+def test_import_legacy_splits_baseline_metadata_by_event(tmp_path):
+    store = MetadataStore(str(tmp_path / "metadata.db"), url_prefix=URL_PREFIX)
+    store.open()
+    # embeddings_metadata.json entries, re-keyed by blob name
+    store.import_legacy({
+        "ev1/a.jpg": {"photo_url": URL_PREFIX + "ev1/a.jpg", "event_id": "ev1", "indexed": True},
+        "ev1/b.jpg": {"photo_url": URL_PREFIX + "ev1/b.jpg", "event_id": "ev1", "indexed": True},
+        "ev2/c.jpg": {"photo_url": URL_PREFIX + "ev2/c.jpg", "event_id": "ev2", "indexed": True},
+    })
+    assert store.event_ids() == ["ev1", "ev2"]
+    assert store.total_entries() == 3
+    shard = store.get_shard("ev1")
+    assert shard.entries == {"ev1/a.jpg": {}, "ev1/b.jpg": {}}
+    assert shard.photo_urls() == [URL_PREFIX + "ev1/a.jpg", URL_PREFIX + "ev1/b.jpg"]
+
+
+def test_write_from_another_store_reloads_resident_shard(tmp_path):
+    path = str(tmp_path / "metadata.db")
+    first = MetadataStore(path)
+    first.open()
+    second = MetadataStore(path)
+    second.open()
+
+    first.put("ev", [("ev/a.jpg", {"generation": 1})])
+    assert set(second.get_shard("ev").entries) == {"ev/a.jpg"}
+
+    first.put("ev", [("ev/b.jpg", {"generation": 2})])
+    first.delete("ev", ["ev/a.jpg"])
+    shard = second.get_shard("ev")
+    assert set(shard.entries) == {"ev/b.jpg"}
+    assert shard.version == first.version("ev") == 3
+    assert second.reloads == 1
+
+    first.reset()
+    assert second.get_shard("ev").entries == {}
+
+
+def test_rows_are_stored_compactly(tmp_path):
+    path = str(tmp_path / "metadata.db")
+    store = MetadataStore(path, url_prefix=URL_PREFIX)
+    store.open()
+    embeddings = np.arange(512, dtype=np.float32).tobytes()
+    store.put("ev", [
+        ("ev/a.jpg", {
+            "photo_url": URL_PREFIX + "ev/a.jpg", "event_id": "ev", "indexed": True,
+            "generation": 7, "etag": "abc", "faces": 1, "embeddings": embeddings, "width": 640,
+        }),
+        ("elsewhere/c.jpg", {"photo_url": URL_PREFIX + "elsewhere/c.jpg", "event_id": "ev", "generation": 9}),
+    ])
+
+    conn = sqlite3.connect(path)
+    rows = dict(conn.execute("SELECT name, extra FROM photos").fetchall())
+    # Names relative to the event folder; derived fields aren't stored, other fields go to extra
+    assert rows == {"a.jpg": '{"width":640}', "\nelsewhere/c.jpg": None}
+    assert conn.execute("SELECT embeddings FROM photos WHERE name = 'a.jpg'").fetchone()[0] == embeddings
+    conn.close()
+
+    shard = MetadataStore(path, url_prefix=URL_PREFIX, resident_embeddings=True).get_shard("ev")
+    assert shard.entries["ev/a.jpg"] == {
+        "generation": 7, "etag": "abc", "faces": 1, "embeddings": embeddings, "width": 640,
+    }
+    assert set(shard.photo_urls()) == {URL_PREFIX + "ev/a.jpg", URL_PREFIX + "elsewhere/c.jpg"}
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import main
+from conftest import index_event, photo_url
+from selfie import BoundedExecutor, PoolSaturated, UploadLimitMiddleware
+
+
+def limited_app(max_bytes):
+    app = FastAPI()
+    app.add_middleware(UploadLimitMiddleware, limits={"/upload": max_bytes})
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        return {"size": len(await request.body())}
+
+    @app.post("/other")
+    async def other(request: Request):
+        return {"size": len(await request.body())}
+
+    return TestClient(app)
+
+
+def test_upload_limit_refuses_large_content_length_and_chunked_bodies():
+    client = limited_app(1000)
+    assert client.post("/upload", content=b"x" * 1000).json() == {"size": 1000}
+
+    response = client.post("/upload", content=b"x" * 1001)
+    assert response.status_code == 413
+    assert "1000 bytes" in response.json()["detail"]
+
+    # No Content-Length: cut off once the received bytes pass the cap
+    chunks = iter([b"x" * 600, b"x" * 600, b"x" * 600])
+    assert client.post("/upload", content=chunks).status_code == 413
+    assert client.post("/upload", content=iter([b"x" * 500, b"x" * 400])).json() == {"size": 900}
+
+    assert client.post("/other", content=b"x" * 5000).json() == {"size": 5000}
+
+
+def test_match_refuses_selfie_over_max_bytes(client, monkeypatch):
+    monkeypatch.setattr(main, "SELFIE_MAX_BYTES", 100)
+    response = client.post("/match", files={"selfie": ("selfie.jpg", b"x" * 101, "image/jpeg")})
+    assert response.status_code == 413
+
+
+def test_bounded_executor_rejects_when_full():
+    pool = BoundedExecutor(workers=1, queue_size=1)
+    release = threading.Event()
+
+    async def scenario():
+        running = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolSaturated):
+            await pool.run(lambda: None)
+        release.set()
+        await asyncio.gather(*running)
+        assert await pool.run(lambda: 42) == 42
+
+    asyncio.run(scenario())
+    assert pool.stats()["rejected"] == 1
+    pool.shutdown()
+
+
+def test_match_sheds_load_when_selfie_pool_is_saturated(client, make_jpeg, monkeypatch):
+    pool = BoundedExecutor(workers=1, queue_size=0)
+    monkeypatch.setattr(main, "selfie_pool", pool)
+    release = threading.Event()
+    # Another request holding the only slot
+    busy = threading.Thread(target=asyncio.run, args=(pool.run(release.wait),))
+    busy.start()
+    try:
+        while pool.stats()["in_flight"] < 1:
+            time.sleep(0.01)
+        selfie = make_jpeg((1, 2, 3), size=(32, 32))
+        response = client.post("/match", files={"selfie": ("selfie.jpg", selfie, "image/jpeg")})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == str(main.SELFIE_RETRY_AFTER_SECONDS)
+    finally:
+        release.set()
+        busy.join()
+        pool.shutdown()
+
+
+def test_resubmitted_selfie_reuses_its_embedding(client, bucket, make_jpeg):
+    keys = ["cache-a/photo.jpg", "cache-b/photo.jpg"]
+    selfie = make_jpeg((9, 99, 199), size=(40, 40))
+    for key in keys:
+        bucket.put(key, selfie)
+        index_event(client, key.split("/")[0], [key])
+
+    def match(event_id):
+        response = client.post("/match", params={"event_id": event_id}, files={"selfie": ("selfie.jpg", selfie, "image/jpeg")})
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    hits = main.selfie_embedding_cache.hits
+    first = match("cache-a")
+    assert first["embedding_cache_hit"] is False
+    assert first["matched_photos"] == [photo_url(keys[0])]
+
+    # Same bytes against the same and another event: no new embedding
+    assert match("cache-a")["embedding_cache_hit"] is True
+    other = match("cache-b")
+    assert other["embedding_cache_hit"] is True
+    assert other["matched_photos"] == [photo_url(keys[1])]
+    assert main.selfie_embedding_cache.hits == hits + 2